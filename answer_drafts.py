@@ -0,0 +1,163 @@
+"""
+Autosaved answers for exams in progress.
+
+take_exam.html posts debounced diffs of the radio buttons to the autosave
+endpoint; they are merged into one row per (student, exam) in a local
+SQLite file, so a click never costs a Postgres write. A re-render of the
+exam (reload, crash, new tab) restores the checked answers and keeps the
+form's submit token, and the final submit fills in anything the form lost
+from the draft before the draft is closed.
+
+A draft belongs to one attempt: it is opened by take_exam's GET with a
+fresh form token (see submission_queue.submit_token) and only autosaves
+carrying that token are accepted. Closing it on submit makes late
+autosaves from the submitted page bounce instead of seeding the next
+attempt.
+
+Drafts are a convenience, not a record, so the file runs with
+synchronous=NORMAL: a WAL commit then survives a process crash without
+an fsync and an autosave stays well under a millisecond. Like the
+submission queue the file must be shared by every worker on the host;
+with several app hosts, students need to stick to one.
+
+Environment:
+  ANSWER_DRAFTS_PATH  SQLite file (default <tmp>/sac-answer-drafts.db)
+  ANSWER_DRAFTS_TTL   seconds an untouched draft is kept (default 2 days)
+"""
+
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+PATH = os.environ.get('ANSWER_DRAFTS_PATH') or os.path.join(tempfile.gettempdir(), 'sac-answer-drafts.db')
+TTL = float(os.environ.get('ANSWER_DRAFTS_TTL', 2 * 86400))
+PURGE_EVERY = 600
+MAX_KEYS = 500
+MAX_VALUE_LENGTH = 1000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS answer_drafts (
+    student_id INTEGER NOT NULL,
+    exam_id INTEGER NOT NULL,
+    token TEXT NOT NULL,
+    answers TEXT NOT NULL DEFAULT '{}',
+    saves INTEGER NOT NULL DEFAULT 0,
+    opened_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    closed_at REAL,
+    PRIMARY KEY (student_id, exam_id)
+) WITHOUT ROWID;
+'''
+
+_QID_RE = re.compile(r'^\d{1,10}$')
+
+_local = threading.local()
+_last_purge = 0
+
+
+class DraftError(ValueError):
+    """An autosave payload that can't be applied."""
+
+
+def _sqlite():
+    """This thread's connection to the drafts file."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(PATH, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+def open_draft(exam_id, student_id, new_token):
+    """The open draft for this attempt as (token, answers).
+
+    Reuses the draft left by an earlier render of the same attempt;
+    otherwise starts an empty one under `new_token`.
+    """
+    global _last_purge
+    now = time.time()
+    if now - _last_purge > PURGE_EVERY:
+        _last_purge = now
+        purge()
+    conn = _sqlite()
+    conn.execute('''
+        INSERT INTO answer_drafts (student_id, exam_id, token, opened_at, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (student_id, exam_id) DO UPDATE
+            SET token = excluded.token, answers = '{}', saves = 0,
+                opened_at = excluded.opened_at, updated_at = excluded.updated_at, closed_at = NULL
+            WHERE closed_at IS NOT NULL OR updated_at < ?
+    ''', (student_id, exam_id, new_token, now, now, now - TTL))
+    token, answers = conn.execute('''
+        SELECT token, answers FROM answer_drafts WHERE student_id = ? AND exam_id = ?
+    ''', (student_id, exam_id)).fetchone()
+    return token, json.loads(answers)
+
+
+def parse_diff(payload):
+    """Validate an autosave body {'token': ..., 'answers': {qid: value|null}}.
+
+    Returns (token, answers as a JSON merge patch); null clears an answer.
+    """
+    if not isinstance(payload, dict):
+        raise DraftError('expected a JSON object')
+    token, answers = payload.get('token'), payload.get('answers')
+    if not isinstance(token, str) or not isinstance(answers, dict):
+        raise DraftError('token and answers are required')
+    if len(answers) > MAX_KEYS:
+        raise DraftError('too many answers')
+    for qid, value in answers.items():
+        if not _QID_RE.match(qid):
+            raise DraftError(f'bad question id {qid!r}')
+        if value is not None and (not isinstance(value, str) or len(value) > MAX_VALUE_LENGTH):
+            raise DraftError(f'bad answer for question {qid}')
+    return token, json.dumps(answers)
+
+
+def autosave(exam_id, student_id, token, patch):
+    """Merge an answer diff into the open draft; False if it is stale.
+
+    Stale means the draft was closed by a submit, or reopened for a newer
+    attempt, since the page was rendered.
+    """
+    cur = _sqlite().execute('''
+        UPDATE answer_drafts
+        SET answers = json_patch(answers, ?), saves = saves + 1, updated_at = ?
+        WHERE student_id = ? AND exam_id = ? AND token = ? AND closed_at IS NULL
+    ''', (patch, time.time(), student_id, exam_id, token))
+    return cur.rowcount == 1
+
+
+def merged_answers(exam_id, student_id, token, answers):
+    """`answers` from a submitted form, gaps filled from this attempt's draft."""
+    row = _sqlite().execute('''
+        SELECT answers FROM answer_drafts
+        WHERE student_id = ? AND exam_id = ? AND token = ? AND closed_at IS NULL
+    ''', (student_id, exam_id, token)).fetchone()
+    if row is None:
+        return answers
+    draft = json.loads(row[0])
+    return {qid: value if value is not None else draft.get(qid) for qid, value in answers.items()}
+
+
+def close(exam_id, student_id, token):
+    """Mark this attempt's draft submitted."""
+    _sqlite().execute('''
+        UPDATE answer_drafts SET closed_at = ?
+        WHERE student_id = ? AND exam_id = ? AND token = ? AND closed_at IS NULL
+    ''', (time.time(), student_id, exam_id, token))
+
+
+def purge():
+    """Drop closed drafts and ones untouched for TTL."""
+    _sqlite().execute('''
+        DELETE FROM answer_drafts WHERE updated_at < ? OR closed_at < ?
+    ''', (time.time() - TTL, time.time() - 3600))
+
@@ -1,7 +1,7 @@
-import os, json
+import os, json, tempfile
 from datetime import timedelta, datetime
 from io import BytesIO
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, jsonify, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 import psycopg2
@@ -27,6 +27,26 @@ from flask import send_file, request, redirect, url_for, session
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
 
+import db
+import metrics
+import slow_queries
+import exam_cache
+import grading
+import exports
+import reports
+import bulk_import
+import import_jobs
+import question_import
+import image_store
+import static_assets
+import submission_queue
+import answer_drafts
+import exam_sessions
+import proctor_events
+from exam_helpers import (get_student_exams, get_leaderboard_page, get_submissions_page, submit_draft,
+                          attempt_session, session_matches)
+import pagination
+
 
 # Load .env
 load_dotenv()
@@ -46,65 +66,22 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 # --------------------
 # DB Connection
 # --------------------
-def get_db_connection():
-    return psycopg2.connect(DATABASE_URL, sslmode='require')
+# Pooled, request-scoped connections; see db.py
+db.init_app(app)
+metrics.init_app(app)
+slow_queries.init_app(app)
+image_store.init_app(app)
+static_assets.init_app(app)
+submission_queue.init_app(app)
+exam_sessions.init_app(app)
+proctor_events.init_app(app)
+get_db_connection = db.get_db_connection
 
 # --------------------
-# DB Init / Schema
+# DB Schema
 # --------------------
-def init_db():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('''CREATE TABLE IF NOT EXISTS users (
-                        id SERIAL PRIMARY KEY,
-                        name TEXT,
-                        email TEXT UNIQUE,
-                        mobile TEXT,
-                        password TEXT,
-                        role TEXT
-                    )''')
-    cur.execute('''CREATE TABLE IF NOT EXISTS exams (
-                        id SERIAL PRIMARY KEY,
-                        title TEXT,
-                        duration INTEGER,
-                        created_by INTEGER,
-                        attempts_allowed INTEGER DEFAULT 1
-                    )''')
-    cur.execute('''CREATE TABLE IF NOT EXISTS questions (
-                        id SERIAL PRIMARY KEY,
-                        exam_id INTEGER,
-                        question TEXT,
-                        image TEXT,
-                        option1 TEXT,
-                        option2 TEXT,
-                        option3 TEXT,
-                        option4 TEXT,
-                        answer TEXT
-                    )''')
-    cur.execute('''CREATE TABLE IF NOT EXISTS submissions (
-                        id SERIAL PRIMARY KEY,
-                        exam_id INTEGER,
-                        student_id INTEGER,
-                        answers TEXT,
-                        score INTEGER,
-                        attempt_number INTEGER DEFAULT 1,
-                        submitted_at TIMESTAMP
-                    )''')
-    # default accounts
-    cur.execute('SELECT COUNT(*) FROM users')
-    if cur.fetchone()[0] == 0:
-        users = [
-            ('Admin','admin@example.com','9999999999','admin123','admin'),
-            ('Mediator1','mediator@example.com','8888888888','mediator123','mediator'),
-            ('Student1','student@example.com','7777777777','student123','student')
-        ]
-        for u in users:
-            cur.execute('INSERT INTO users (name,email,mobile,password,role) VALUES (%s,%s,%s,%s,%s)', u)
-    conn.commit()
-    cur.close()
-    conn.close()
-
-init_db()
+# Schema changes live in migrations.py and run once per deploy
+# (`python migrations.py upgrade`), not on every worker boot.
 
 # --------------------
 # Helpers
@@ -137,14 +114,8 @@ def get_exams():
     return exams
 
 def get_exam(exam_id):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cur.execute('SELECT id, title, duration, created_by, attempts_allowed FROM exams WHERE id=%s', (exam_id,))
-    exam = dict(cur.fetchone()) if cur.rowcount > 0 else None
-    cur.execute('SELECT id, exam_id, question, image, option1, option2, option3, option4, answer FROM questions WHERE exam_id=%s', (exam_id,))
-    questions = [dict(r) for r in cur.fetchall()]
-    conn.close()
-    return exam, questions
+    # Exam definitions are immutable between edits; see exam_cache.py
+    return exam_cache.get_exam(exam_id)
 
 # --------------------
 # Routes
@@ -189,6 +160,54 @@ def admin_home():
         return redirect(url_for('login'))
     return render_template('admin_home.html', name=session['name'])
 
+@app.route('/admin/db_pool')
+def admin_db_pool():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+    return jsonify(db.pool_stats())
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    # Prometheus scrapes this with METRICS_TOKEN; see metrics.py
+    if not metrics.authorized(session):
+        return redirect(url_for('login'))
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/slow_queries')
+def admin_slow_queries():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+    # worst statements first, from the log slow_queries.py keeps
+    statements = slow_queries.worst(limit=request.args.get('limit', 50, type=int))
+    if request.args.get('format') == 'json':
+        return jsonify(statements)
+    return render_template('admin_slow_queries.html', statements=statements,
+                           threshold_ms=slow_queries.THRESHOLD_MS,
+                           explain_rate=slow_queries.EXPLAIN_RATE)
+
+@app.route('/admin/submission_queue')
+def admin_submission_queue():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+    return jsonify(submission_queue.stats())
+
+@app.route('/admin/exam_sessions')
+def admin_exam_sessions():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+    return jsonify(exam_sessions.stats())
+
+@app.route('/admin/proctor_events')
+def admin_proctor_events():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+    return jsonify(proctor_events.stats())
+
+@app.route('/admin/exam_cache')
+def admin_exam_cache():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+    return jsonify(exam_cache.cache_stats())
 
 # --------------------
 # Admin Routes (Add these to your existing admin routes section)
@@ -219,17 +238,14 @@ def create_exam():
                 opt3 = request.form[f'opt3_{i}']
                 opt4 = request.form[f'opt4_{i}']
                 answer = request.form[f'answer{i}']
-                img_file = request.files.get(f'image{i}')
-                filename = None
-                if img_file and img_file.filename != '':
-                    filename = secure_filename(img_file.filename)
-                    img_file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+                filename = image_store.save_upload(request.files.get(f'image{i}'))
                 cur.execute(
                     "INSERT INTO questions (exam_id,question,image,option1,option2,option3,option4,answer) "
                     "VALUES (%s,%s,%s,%s,%s,%s,%s,%s)",
                     (exam_id,question,filename,opt1,opt2,opt3,opt4,answer)
                 )
             conn.commit()
+            exam_cache.invalidate(exam_id)
             flash("Exam created successfully!")
         except Exception as e:
             conn.rollback()
@@ -240,23 +256,90 @@ def create_exam():
         return redirect(url_for('admin_home'))
     return render_template('create_exam_admin.html')
 
+@app.route('/admin/import_exam', methods=['GET', 'POST'])
+def import_exam_admin():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+    return _import_exam('admin_home')
+
+def _import_exam(home_endpoint):
+    """Shared by the admin and mediator import pages."""
+    if request.method == 'GET':
+        return render_template('import_exam.html', form={})
+
+    sheet_file = request.files.get('questions_file')
+    if not sheet_file or sheet_file.filename == '':
+        flash("No questions file selected", "danger")
+        return render_template('import_exam.html', form=request.form)
+    filename = sheet_file.filename.lower()
+    if not (filename.endswith('.csv') or filename.endswith('.xlsx') or filename.endswith('.xls')):
+        flash("Unsupported file type. Use CSV/XLS/XLSX.", "danger")
+        return render_template('import_exam.html', form=request.form)
+    images_zip = request.files.get('images_zip')
+    if images_zip is not None and images_zip.filename == '':
+        images_zip = None
+
+    exam = (request.form['title'], int(request.form['duration']), session['user_id'],
+            int(request.form.get('attempts_allowed') or 1))
+    conn = get_db_connection()
+    try:
+        sheet = question_import.read_sheet(sheet_file, filename)
+        exam_id, count = question_import.import_exam(
+            conn, exam, sheet, images_zip.stream if images_zip else None)
+    except question_import.QuestionImportError as e:
+        flash(str(e), "danger")
+        return render_template('import_exam.html', form=request.form,
+                               problems=e.problems[:500],
+                               problems_hidden=max(len(e.problems) - 500, 0))
+    except Exception as e:
+        flash(f"Error: {e}", "danger")
+        return render_template('import_exam.html', form=request.form)
+    finally:
+        conn.close()
+    exam_cache.invalidate(exam_id)
+    flash(f"Exam created with {count} questions!")
+    return redirect(url_for(home_endpoint))
+
 @app.route('/admin/submissions')
 def admin_submissions():
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
         
+    # keyset pagination: ?after=<token>&per_page=N&count=1
+    page = get_submissions_page(
+        after=request.args.get('after'),
+        size=pagination.page_size(request.args.get('per_page')),
+        with_total=request.args.get('count') == '1'
+    )
+    return render_template('admin_submissions.html', submissions=page.rows, page=page,
+                           page_sizes=pagination.PAGE_SIZES)
+
+@app.route('/admin/submissions/<int:submission_id>')
+def admin_submission_detail(submission_id):
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute('''
-        SELECT s.*, u.name as student_name, e.title as exam_title 
-        FROM submissions s 
-        JOIN users u ON s.student_id = u.id 
-        JOIN exams e ON s.exam_id = e.id 
-        ORDER BY s.submitted_at DESC
-    ''')
-    submissions = cur.fetchall()
+        SELECT id, exam_id, student_id, answer_codes, score, submitted_at, answers
+        FROM submissions WHERE id = %s
+    ''', (submission_id,))
+    submission = cur.fetchone()
+    cur.close()
     conn.close()
-    return render_template('admin_submissions.html', submissions=submissions)
+    if not submission:
+        flash("Submission not found", "danger")
+        return redirect(url_for('admin_submissions'))
+
+    payload = exam_cache.get_exam_payload(submission[1])
+    if payload:
+        answers = grading.submission_answers(submission[3], submission[6], payload['compiled_key'])
+        qmap = {q['id']: q['question'] for q in payload['questions']}
+    else:
+        answers = grading.submission_answers(None, submission[6], None)
+        qmap = {}
+    return render_template('submission_detail.html', submission=submission, answers=answers, qmap=qmap)
 
 @app.route('/admin/create_mediator', methods=['GET','POST'])
 def create_mediator():
@@ -376,41 +459,45 @@ def admin_leaderboard():
     # Get list of all exams for dropdown
     cur.execute("SELECT id, title FROM exams ORDER BY title;")
     exams = cur.fetchall()
-
-    # Fetch leaderboard with new sorting: score DESC, time_taken ASC, submitted_at ASC
-    if exam_id:
-        cur.execute('''
-            SELECT s.id, u.name as student_name, e.title as exam_title, s.score, 
-                   s.attempt_number, s.submitted_at, s.time_taken
-            FROM submissions s
-            JOIN users u ON s.student_id = u.id
-            JOIN exams e ON s.exam_id = e.id
-            WHERE e.id = %s
-            ORDER BY s.score DESC, 
-                     COALESCE(s.time_taken, 999999) ASC, 
-                     s.submitted_at ASC
-        ''', (exam_id,))
-    else:
-        cur.execute('''
-            SELECT s.id, u.name as student_name, e.title as exam_title, s.score, 
-                   s.attempt_number, s.submitted_at, s.time_taken
-            FROM submissions s
-            JOIN users u ON s.student_id = u.id
-            JOIN exams e ON s.exam_id = e.id
-            ORDER BY s.score DESC, 
-                     COALESCE(s.time_taken, 999999) ASC, 
-                     s.submitted_at ASC
-        ''')
-    
-    leaderboard = cur.fetchall()
+    cur.close()
     conn.close()
 
+    # Keyset-paginated: score DESC, time_taken ASC, submitted_at ASC
+    page = get_leaderboard_page(
+        exam_id=exam_id,
+        after=request.args.get('after'),
+        size=pagination.page_size(request.args.get('per_page')),
+        with_total=request.args.get('count') == '1'
+    )
+
     return render_template(
         'admin_leaderboard.html',
-        leaderboard=leaderboard,
+        leaderboard=page.rows,
+        page=page,
+        page_sizes=pagination.PAGE_SIZES,
         exams=exams,
         selected_exam=exam_id
     )
+
+@app.route('/admin/proctoring')
+def admin_proctoring():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    exam_id = request.args.get('exam_id', type=int)
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cur.execute("SELECT id, title FROM exams ORDER BY title;")
+    exams = cur.fetchall()
+    cur.close()
+    conn.close()
+
+    # per-student totals from proctor_events.py (a few seconds behind)
+    students = proctor_events.counts_for_exam(exam_id) if exam_id else []
+    if request.args.get('format') == 'json':
+        return jsonify(students)
+    return render_template('admin_proctoring.html', exams=exams, selected_exam=exam_id,
+                           students=students, kinds=proctor_events.KINDS)
 from io import BytesIO
 from flask import send_file, request, redirect, url_for, session
 from reportlab.lib.pagesizes import letter
@@ -425,62 +512,9 @@ def download_leaderboard_pdf():
     
     exam_id = request.args.get('exam_id', type=int)
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    # Fixed sorting: score DESC, time_taken ASC, submitted_at ASC
-    if exam_id:
-        cur.execute('''
-            SELECT u.name, e.title, s.score, s.attempt_number, s.submitted_at, s.time_taken
-            FROM submissions s
-            JOIN users u ON s.student_id = u.id
-            JOIN exams e ON s.exam_id = e.id
-            WHERE e.id = %s
-            ORDER BY s.score DESC, COALESCE(s.time_taken, 999999) ASC, s.submitted_at ASC
-        ''', (exam_id,))
-    else:
-        cur.execute('''
-            SELECT u.name, e.title, s.score, s.attempt_number, s.submitted_at, s.time_taken
-            FROM submissions s
-            JOIN users u ON s.student_id = u.id
-            JOIN exams e ON s.exam_id = e.id
-            ORDER BY s.score DESC, COALESCE(s.time_taken, 999999) ASC, s.submitted_at ASC
-        ''')
-    
-    data = cur.fetchall()
-    conn.close()
-
+    # Rows arrive in chunks from a server-side cursor (exports.py)
     buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    elements = []
-    styles = getSampleStyleSheet()
-
-    # Title
-    elements.append(Paragraph("Leaderboard Report", styles['Title']))
-    elements.append(Spacer(1, 12))
-
-    # Table header + data
-    table_data = [["S.No", "Student Name", "Exam Title", "Score", "Attempt", "Submitted At", "Time Taken"]]
-    for idx, row in enumerate(data, start=1):
-        submitted_at_str = row[4].strftime('%Y-%m-%d %H:%M') if row[4] else "Not Submitted"
-        time_taken_str = f"{row[5] // 60}m {row[5] % 60}s" if row[5] else "-"
-        table_data.append([idx, row[0], row[1], row[2], row[3], submitted_at_str, time_taken_str])
-
-    # Table styling
-    table = Table(table_data, repeatRows=1)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,0), colors.HexColor("#4FACFE")),
-        ('TEXTCOLOR', (0,0), (-1,0), colors.white),
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0,0), (-1,0), 11),
-        ('BOTTOMPADDING', (0,0), (-1,0), 10),
-        ('BACKGROUND', (0,1), (-1,-1), colors.whitesmoke),
-        ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
-    ]))
-    elements.append(table)
-
-    doc.build(elements)
+    exports.write_leaderboard_pdf(buffer, exam_id)
     buffer.seek(0)
 
     return send_file(
@@ -501,69 +535,9 @@ def download_leaderboard_excel():
 
     exam_id = request.args.get('exam_id', type=int)
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    # Fixed sorting: score DESC, time_taken ASC, submitted_at ASC
-    if exam_id:
-        cur.execute('''
-            SELECT u.name, e.title, s.score, s.attempt_number, s.submitted_at, s.time_taken
-            FROM submissions s
-            JOIN users u ON s.student_id = u.id
-            JOIN exams e ON s.exam_id = e.id
-            WHERE e.id = %s
-            ORDER BY s.score DESC, COALESCE(s.time_taken, 999999) ASC, s.submitted_at ASC
-        ''', (exam_id,))
-    else:
-        cur.execute('''
-            SELECT u.name, e.title, s.score, s.attempt_number, s.submitted_at, s.time_taken
-            FROM submissions s
-            JOIN users u ON s.student_id = u.id
-            JOIN exams e ON s.exam_id = e.id
-            ORDER BY s.score DESC, COALESCE(s.time_taken, 999999) ASC, s.submitted_at ASC
-        ''')
-    
-    data = cur.fetchall()
-    conn.close()
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Leaderboard"
-
-    headers = ["S.No", "Student Name", "Exam Title", "Score", "Attempt", "Submitted At", "Time Taken"]
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4FACFE", end_color="4FACFE", fill_type="solid")
-    alignment = Alignment(horizontal="center", vertical="center")
-    thin_border = Border(left=Side(style="thin"), right=Side(style="thin"),
-                         top=Side(style="thin"), bottom=Side(style="thin"))
-
-    # Header row
-    for col, header in enumerate(headers, start=1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = alignment
-        cell.border = thin_border
-
-    # Data rows
-    for idx, row in enumerate(data, start=1):
-        submitted_at_str = row[4].strftime('%Y-%m-%d %H:%M') if row[4] else "Not Submitted"
-        time_taken_str = f"{row[5] // 60}m {row[5] % 60}s" if row[5] else "-"
-        ws.append([idx, row[0], row[1], row[2], row[3], submitted_at_str, time_taken_str])
-
-    # Apply alignment & borders to all data cells
-    for row_cells in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=1, max_col=len(headers)):
-        for cell in row_cells:
-            cell.alignment = alignment
-            cell.border = thin_border
-
-    # Adjust column widths
-    for col in ws.columns:
-        max_length = max(len(str(cell.value)) if cell.value else 0 for cell in col)
-        ws.column_dimensions[col[0].column_letter].width = max_length + 4
-
-    buffer = BytesIO()
-    wb.save(buffer)
+    # write-only workbook spooled to a temp file, then streamed from disk
+    buffer = tempfile.TemporaryFile()
+    exports.write_leaderboard_xlsx(buffer, exam_id)
     buffer.seek(0)
 
     return send_file(
@@ -572,14 +546,76 @@ def download_leaderboard_excel():
         download_name="leaderboard.xlsx",
         mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
+
+@app.route('/admin/leaderboard/download/csv')
+def download_leaderboard_csv():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    exam_id = request.args.get('exam_id', type=int)
+
+    # bytes go out as they are produced; nothing is buffered whole
+    return Response(
+        stream_with_context(exports.leaderboard_csv(exam_id)),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=leaderboard.csv"}
+    )
     
+# --------------------
+# Background report jobs (see reports.py)
+# --------------------
+@app.route('/admin/reports', methods=['POST'])
+def start_report():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    fmt = request.values.get('format', 'pdf')
+    exam_id = request.values.get('exam_id', type=int)
+    try:
+        job = reports.start_report(fmt, exam_id)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(_report_json(job)), 202
+
+@app.route('/admin/reports/<job_id>')
+def report_status(job_id):
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    job = reports.job_status(job_id)
+    if not job:
+        return jsonify(error='unknown job'), 404
+    return jsonify(_report_json(job))
+
+@app.route('/admin/reports/<job_id>/download')
+def report_download(job_id):
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    found = reports.artifact(job_id)
+    if not found:
+        flash("Report is not ready.", "warning")
+        return redirect(url_for('admin_leaderboard'))
+    path, mimetype, name = found
+    return send_file(path, as_attachment=True, download_name=name, mimetype=mimetype)
+
+def _report_json(job):
+    job = dict(job)
+    job['status_url'] = url_for('report_status', job_id=job['id'])
+    if job['status'] == 'done':
+        job['download_url'] = url_for('report_download', job_id=job['id'])
+    return job
+
 @app.route('/admin/bulk_upload', methods=['GET', 'POST'])
 def admin_bulk_upload():
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
 
     if request.method == 'GET':
-        return render_template('bulk_upload.html', name=session.get('name', 'Admin'))
+        job_id = request.args.get('job')
+        job = import_jobs.job_status(job_id) if job_id else None
+        return render_template('bulk_upload.html', name=session.get('name', 'Admin'),
+                               job=_import_json(job) if job else None)
 
     uploaded = request.files.get('file')
     if not uploaded or uploaded.filename == '':
@@ -591,65 +627,54 @@ def admin_bulk_upload():
         flash("Unsupported file type. Use CSV/XLS/XLSX.", "danger")
         return redirect(url_for('admin_bulk_upload'))
 
+    # stage to disk and let a background job work through it in chunks, so
+    # big rosters don't run into the request timeout
+    job_id, path = import_jobs.stage_upload(uploaded, filename)
     try:
-        if filename.endswith('.csv'):
-            df = pd.read_csv(uploaded, dtype=str)
-        else:
-            df = pd.read_excel(uploaded, dtype=str)
-
-        df = df.replace({pd.NA: None, 'nan': None, 'NaN': None})
-        df.columns = [c.strip().lower() for c in df.columns]
+        columns = bulk_import.read_header(path)
     except Exception as e:
+        import_jobs.discard_upload(path)
         flash(f"Error reading file: {str(e)}", "danger")
         return redirect(url_for('admin_bulk_upload'))
 
-    required_cols = ['email', 'password']
-    for col in required_cols:
-        if col not in df.columns:
+    for col in bulk_import.REQUIRED_COLUMNS:
+        if col not in columns:
+            import_jobs.discard_upload(path)
             flash(f"Missing required column: {col}", "danger")
             return redirect(url_for('admin_bulk_upload'))
 
-    created, failed, skipped = 0, 0, 0
-    results = []
-    conn = get_db_connection()
-    cur = conn.cursor()
+    import_jobs.start_import(job_id, path, uploaded.filename)
+    return redirect(url_for('admin_bulk_upload', job=job_id))
 
-    for idx, row in df.iterrows():
-        try:
-            email = str(row.get('email') or '').strip()
-            password = str(row.get('password') or '').strip()
-            name = str(row.get('name') or '').strip()
-            mobile = str(row.get('mobile') or '').strip()
-            role = (row.get('role') or 'student').strip().lower()
-
-            if not email or not password:
-                skipped += 1
-                continue
-            if '@' not in email:
-                failed += 1
-                continue
-            if role not in ['student', 'mediator', 'admin']:
-                role = 'student'
+@app.route('/admin/bulk_upload/jobs/<job_id>')
+def bulk_upload_status(job_id):
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
 
-            cur.execute(
-                "INSERT INTO users (name, email, mobile, password, role) VALUES (%s,%s,%s,%s,%s)",
-                (name or None, email, mobile or None, password, role)
-            )
-            conn.commit()
-            created += 1
-        except psycopg2.IntegrityError:
-            conn.rollback()
-            failed += 1
-        except Exception as e:
-            conn.rollback()
-            failed += 1
+    job = import_jobs.job_status(job_id)
+    if not job:
+        return jsonify(error='unknown job'), 404
+    job = _import_json(job)
+    del job['problems']  # the page reloads to show them once the job is done
+    return jsonify(job)
 
-    cur.close()
-    conn.close()
+@app.route('/admin/bulk_upload/jobs/<job_id>/problems.csv')
+def bulk_upload_problems(job_id):
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    path = import_jobs.problem_report(job_id)
+    if not path:
+        flash("No report for that upload.", "warning")
+        return redirect(url_for('admin_bulk_upload'))
+    return send_file(path, as_attachment=True, download_name='import-problems.csv', mimetype='text/csv')
 
-    flash(f"Upload finished: {created} created, {skipped} skipped, {failed} failed",
-          "success" if failed == 0 else "warning")
-    return redirect(url_for('admin_bulk_upload'))
+def _import_json(job):
+    job = dict(job)
+    job['status_url'] = url_for('bulk_upload_status', job_id=job['id'])
+    if job['status'] in ('done', 'failed'):
+        job['problems_url'] = url_for('bulk_upload_problems', job_id=job['id'])
+    return job
 
 
 def allowed_file(filename):
@@ -730,13 +755,17 @@ def edit_exam(exam_id):
         # Update exam info
         cur.execute("""
             UPDATE exams
-            SET title=%s, duration=%s, attempts_allowed=%s
+            SET title=%s, duration=%s, attempts_allowed=%s,
+                content_version=content_version+1
             WHERE id=%s
         """, (request.form['title'], request.form['duration'], request.form['attempts_allowed'], exam_id))
 
         # Update questions
+        edited = []
         for q in questions:
             q_id = q['id']
+            edited.append({'id': q_id, 'answer': request.form.get(f"answer_{q_id}"),
+                           **{c: request.form.get(f"{c}_{q_id}") for c in grading.OPTION_COLUMNS}})
             cur.execute("""
                 UPDATE questions
                 SET question=%s, option1=%s, option2=%s, option3=%s, option4=%s, answer=%s
@@ -753,11 +782,41 @@ def edit_exam(exam_id):
 
         conn.commit()
         conn.close()
+        exam_cache.invalidate(exam_id)
         flash("Exam and questions updated successfully!", "success")
+        # answer codes are option positions, so reordering or renaming options
+        # moves the correct index even when the answer text is unchanged
+        before = grading.compile_answer_key(sorted((dict(q) for q in questions), key=lambda q: q['id']))
+        after = grading.compile_answer_key(sorted(edited, key=lambda q: q['id']))
+        if before.key.tobytes() != after.key.tobytes() or before.options != after.options:
+            # the edit is already saved; a failed regrade can be retried from manage_exams
+            try:
+                seen, changed = grading.regrade_exam(exam_id)
+                if changed:
+                    reports.invalidate(exam_id)
+                flash(f"Re-graded {seen} submissions ({changed} scores changed).", "success")
+            except Exception as e:
+                flash(f"Error re-grading exam: {e}", "danger")
         return redirect(url_for("manage_exams_admin"))
 
     conn.close()
     return render_template("edit_exam.html", exam=exam, questions=questions)
+
+# ---------- RE-GRADE ----------
+@app.route('/admin/manage_exams/regrade/<int:exam_id>')
+def regrade_exam(exam_id):
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    try:
+        seen, changed = grading.regrade_exam(exam_id)
+        if changed:
+            reports.invalidate(exam_id)
+        flash(f"Re-graded {seen} submissions ({changed} scores changed).", "success")
+    except Exception as e:
+        flash(f"Error re-grading exam: {e}", "danger")
+    return redirect(url_for("manage_exams_admin"))
+
 #---Preview Exam ---
 @app.route('/admin/preview_exam/<int:exam_id>')
 def preview_exam(exam_id):
@@ -799,6 +858,7 @@ def delete_exam(exam_id):
     cur.execute("DELETE FROM exams WHERE id = %s", (exam_id,))
     conn.commit()
     conn.close()
+    exam_cache.invalidate(exam_id)
     flash("Exam deleted successfully!", "success")
     return redirect(url_for("manage_exams_admin"))
 
@@ -905,17 +965,14 @@ def create_exam_mediator():
                 opt3 = request.form[f'opt3_{i}']
                 opt4 = request.form[f'opt4_{i}']
                 answer = request.form[f'answer{i}']
-                img_file = request.files.get(f'image{i}')
-                filename = None
-                if img_file and img_file.filename != '':
-                    filename = secure_filename(img_file.filename)
-                    img_file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+                filename = image_store.save_upload(request.files.get(f'image{i}'))
                 cur.execute(
                     "INSERT INTO questions (exam_id,question,image,option1,option2,option3,option4,answer) "
                     "VALUES (%s,%s,%s,%s,%s,%s,%s,%s)",
                     (exam_id,question,filename,opt1,opt2,opt3,opt4,answer)
                 )
             conn.commit()
+            exam_cache.invalidate(exam_id)
             flash("Exam created successfully!")
         except Exception as e:
             conn.rollback()
@@ -927,6 +984,13 @@ def create_exam_mediator():
     return render_template('create_exam.html')
 
 
+@app.route('/mediator/import_exam', methods=['GET', 'POST'])
+def import_exam_mediator():
+    if session.get('role') != 'mediator':
+        return redirect(url_for('login'))
+    return _import_exam('mediator_home')
+
+
 
 
 # --------------------
@@ -937,97 +1001,184 @@ def student_home():
     if session.get('role')!='student': 
         return redirect(url_for('login'))
         
-    exams = get_exams()
-    uid = session.get('user_id')
+    exam_infos = get_student_exams(session.get('user_id'))
+    return render_template('student_home.html', exam_infos=exam_infos, name=session.get('name'))
+
+from datetime import datetime
+import json
+
+def _attempts_used(exam_id, uid):
+    """Submissions of a student for an exam, including ones still queued."""
     conn = get_db_connection()
     cur = conn.cursor()
-    exam_infos = []
-    for ex in exams:
-        ex_id = ex['id']
-        attempts_allowed = ex.get('attempts_allowed',1)
-        cur.execute('SELECT COUNT(*) FROM submissions WHERE exam_id=%s AND student_id=%s', (ex_id, uid))
-        prev_attempts = cur.fetchone()[0]
-        remaining = max(attempts_allowed - prev_attempts, 0)
-        exam_infos.append({
-            'id': ex_id,
-            'title': ex['title'],
-            'duration': ex['duration'],
-            'created_by': ex.get('created_by'),
-            'attempts_allowed': attempts_allowed,
-            'prev_attempts': prev_attempts,
-            'remaining': remaining,
-        })
+    cur.execute('SELECT COUNT(*) FROM submissions WHERE exam_id=%s AND student_id=%s', (exam_id, uid))
+    used = cur.fetchone()[0] + submission_queue.pending_count(exam_id, uid)
     cur.close()
     conn.close()
-    return render_template('student_home.html', exam_infos=exam_infos, name=session.get('name'))
+    return used
 
-from datetime import datetime
-import json
+def _refuse_attempt(exam_id, uid, form_token, token, attempts_allowed):
+    """Close an attempt that is over the exam's limit without saving it."""
+    answer_drafts.close(exam_id, uid, form_token)
+    exam_sessions.finish(token)
+    flash(f'You have already attempted this exam ({attempts_allowed} allowed); this submission was not saved.')
+    return redirect(url_for('student_home'))
 
 @app.route('/student/take_exam/<int:exam_id>', methods=['GET','POST'])
 def take_exam(exam_id):
     if session.get('role') != 'student': 
         return redirect(url_for('login'))
         
-    exam, questions = get_exam(exam_id)
-    if not exam:
+    payload = exam_cache.get_exam_payload(exam_id)
+    if not payload:
         flash('Exam not found')
         return redirect(url_for('student_home'))
+    exam, questions = dict(payload['exam']), payload['questions']
         
     uid = session.get('user_id')
 
-    # Check attempts
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT attempts_allowed FROM exams WHERE id=%s', (exam_id,))
-    result = cur.fetchone()
-    attempts_allowed = result[0] if result else 1
-    cur.execute('SELECT COUNT(*) FROM submissions WHERE exam_id=%s AND student_id=%s', (exam_id, uid))
-    prev_attempts = cur.fetchone()[0]
-    
-    if prev_attempts >= attempts_allowed:
-        flash(f'You have already attempted this exam ({attempts_allowed} allowed).')
-        cur.close()
-        conn.close()
-        return redirect(url_for('student_home'))
-
     if request.method == 'POST':
+        # the clock started when the exam page was first served (exam_sessions.py)
+        form_token, exam_session = attempt_session(exam_id, uid, request.form.get('submit_token'))
+        if exam_session is None:
+            flash('This submission does not match an open attempt; please reopen the exam.')
+            return redirect(url_for('student_home'))
+        token = exam_session['token']
+        attempts_allowed = exam['attempts_allowed'] or 1
+        # an async flush would reject a submission over the limit after the
+        # student was told it went through, so refuse it here; a sync flush
+        # reports the rejection itself (QueueRejected) in the same round trip.
+        # A finished session is a double submit; queuing its token again is
+        # a no-op.
+        if (submission_queue.MODE != 'sync' and exam_session['finished_at'] is None
+                and _attempts_used(exam_id, uid) >= attempts_allowed):
+            return _refuse_attempt(exam_id, uid, form_token, token, attempts_allowed)
+        if exam_sessions.is_late(exam_session):
+            try:
+                submit_draft(exam_id, uid, form_token, exam_session)
+            except submission_queue.QueueRejected:
+                return _refuse_attempt(exam_id, uid, form_token, token, attempts_allowed)
+            flash('Time was up before this submission arrived; your answers saved before the deadline were submitted.')
+            return redirect(url_for('student_home'))
+
         answers = {}
         for q in questions:
             val = request.form.get(f"q{q['id']}")
             answers[str(q['id'])] = val
+        # anything the page lost (reload, crashed tab) comes from the autosaved draft
+        answers = answer_drafts.merged_answers(exam_id, uid, form_token, answers)
 
         # calculate score
-        score = sum(1 for q in questions if answers.get(str(q['id'])) == q['answer'])
-        attempt_number = prev_attempts + 1
-        submitted_at = datetime.now()
-
-        # ⏱ fetch time_taken from hidden field (set by JS timer)
-        time_taken = request.form.get('time_taken', type=int)
+        score = grading.score_answers(answers, payload['compiled_key'])
 
-        cur.execute('''
-            INSERT INTO submissions 
-            (exam_id, student_id, answers, score, attempt_number, submitted_at, time_taken)
-            VALUES (%s,%s,%s,%s,%s,%s,%s)
-        ''', (exam_id, uid, json.dumps(answers), score, attempt_number, submitted_at, time_taken))
+        # ⏱ server-side elapsed time
+        time_taken = exam_sessions.time_taken(exam_session)
 
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Queued locally and flushed to Postgres in batches (see
+        # submission_queue.py); attempt numbers are assigned when the batch
+        # is written.
+        # the form's token makes a double submit of the same page queue once
+        try:
+            submission_queue.enqueue(
+                exam_id, uid,
+                grading.pack_answers(answers, payload['compiled_key']),  # see grading.py
+                score, datetime.now(), time_taken, token=token)
+        except submission_queue.QueueRejected:
+            return _refuse_attempt(exam_id, uid, form_token, token, attempts_allowed)
+        except submission_queue.QueueError as e:
+            # keep the answers with the open attempt so the student can resubmit
+            answer_drafts.autosave(exam_id, uid, form_token,
+                                   json.dumps({k: v for k, v in answers.items() if v is not None}))
+            flash(f'Your submission could not be saved ({e}); please submit again.')
+            return redirect(url_for('take_exam', exam_id=exam_id))
+        answer_drafts.close(exam_id, uid, form_token)
+        exam_sessions.finish(token)
+        if request.form.get('disqualified'):
+            # the page hit its tab-switch limit and auto-submitted
+            proctor_events.record(exam_id, uid, token, [(proctor_events.KIND_CODES['disqualified'], None)])
         flash('Exam submitted successfully!')
         return redirect(url_for('student_home'))
 
-    cur.close()
-    conn.close()
+    # Check attempts (including ones still queued)
+    attempts_allowed = exam['attempts_allowed'] or 1
+    if _attempts_used(exam_id, uid) >= attempts_allowed:
+        flash(f'You have already attempted this exam ({attempts_allowed} allowed).')
+        return redirect(url_for('student_home'))
+
+    # a re-render of an unfinished attempt keeps its token, answers and clock
+    form_token, draft = answer_drafts.open_draft(exam_id, uid, submission_queue.new_form_token())
+    exam_session = exam_sessions.start(
+        exam_id, uid, submission_queue.submit_token(uid, form_token), exam['duration'])
+    if exam_sessions.is_late(exam_session):
+        submit_draft(exam_id, uid, form_token, exam_session)
+        flash('Time ran out on your last attempt; the answers saved for it were submitted.')
+        return redirect(url_for('student_home'))
     return render_template(
         'take_exam.html',
         exam=exam,
         questions=questions,
         tab_limit=TAB_SWITCH_LIMIT,
-        exam_duration=exam['duration']
+        exam_duration=exam['duration'],
+        remaining=max(exam_sessions.remaining(exam_session), 0),
+        submit_token=form_token,
+        draft=draft
     )
 
 
+@app.route('/student/take_exam/<int:exam_id>/autosave', methods=['POST'])
+def autosave_answers(exam_id):
+    """Merge a debounced answer diff into the student's draft (see answer_drafts.py)."""
+    if session.get('role') != 'student':
+        return jsonify({'error': 'not logged in'}), 401
+    try:
+        token, patch = answer_drafts.parse_diff(request.get_json(silent=True))
+    except answer_drafts.DraftError as e:
+        return jsonify({'error': str(e)}), 400
+    uid = session.get('user_id')
+    exam_session = exam_sessions.heartbeat(submission_queue.submit_token(uid, token))
+    if exam_session is not None and not session_matches(exam_session, exam_id, uid):
+        return jsonify({'error': 'no such attempt'}), 404
+    if exam_session is None or exam_sessions.is_late(exam_session):
+        return jsonify({'error': 'time is up'}), 409
+    if not answer_drafts.autosave(exam_id, uid, token, patch):
+        # submitted, or superseded by a newer attempt: the page should stop saving
+        return jsonify({'error': 'draft closed'}), 409
+    return '', 204
+
+
+@app.route('/student/take_exam/<int:exam_id>/heartbeat', methods=['POST'])
+def exam_heartbeat(exam_id):
+    """Seconds left on the attempt, for the page's timer; no Postgres access."""
+    if session.get('role') != 'student':
+        return jsonify({'error': 'not logged in'}), 401
+    token = (request.get_json(silent=True) or {}).get('token')
+    if not isinstance(token, str):
+        return jsonify({'error': 'token is required'}), 400
+    exam_session = exam_sessions.heartbeat(submission_queue.submit_token(session.get('user_id'), token))
+    if exam_session is None:
+        return jsonify({'error': 'no such attempt'}), 404
+    return jsonify({'remaining': max(exam_sessions.remaining(exam_session), 0),
+                    'finished': exam_session['finished_at'] is not None})
+
+
+@app.route('/student/take_exam/<int:exam_id>/events', methods=['POST'])
+def proctor_events_ingest(exam_id):
+    """Append a batch of focus/visibility/clipboard events (see proctor_events.py)."""
+    if session.get('role') != 'student':
+        return jsonify({'error': 'not logged in'}), 401
+    try:
+        token, events = proctor_events.parse_batch(request.get_json(silent=True))
+    except proctor_events.EventError as e:
+        return jsonify({'error': str(e)}), 400
+    uid = session.get('user_id')
+    token = submission_queue.submit_token(uid, token)
+    exam_session = exam_sessions.heartbeat(token)
+    if exam_session is None or exam_session['exam_id'] != exam_id:
+        return jsonify({'error': 'no such attempt'}), 404
+    proctor_events.record(exam_id, uid, token, events)
+    return '', 204
+
+
 # --------------------
 # Run
 # --------------------
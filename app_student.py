@@ -1,11 +1,25 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
 import os
+import json
 from datetime import timedelta
 from dotenv import load_dotenv
+import db
+import metrics
+import slow_queries
+import image_store
+import static_assets
+import submission_queue
+import answer_drafts
+import exam_sessions
+import proctor_events
+import grading
 from exam_helpers import (
     get_exam_with_questions,
     get_student_exams,
-    save_exam_submission
+    save_exam_submission,
+    submit_draft,
+    attempt_session,
+    session_matches
 )
 
 # Load local .env in development
@@ -19,6 +33,14 @@ if not DATABASE_URL:
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET', 'secret123')
 app.permanent_session_lifetime = timedelta(days=3650)
+db.init_app(app)
+metrics.init_app(app)
+slow_queries.init_app(app)
+image_store.init_app(app)
+static_assets.init_app(app)
+submission_queue.init_app(app)
+exam_sessions.init_app(app)
+proctor_events.init_app(app)
 
 # =====================
 # Student Dashboard & Exam Taking
@@ -48,33 +70,113 @@ def take_exam(exam_id):
         return redirect(url_for('student_home'))
     
     if request.method == 'POST':
+        form_token, exam_session = attempt_session(
+            exam_id, session.get('user_id'), request.form.get('submit_token'))
+        if exam_session is None:
+            flash('This submission does not match an open attempt; please reopen the exam.')
+            return redirect(url_for('student_home'))
+        if exam_sessions.is_late(exam_session):
+            submit_draft(exam_id, session.get('user_id'), form_token, exam_session)
+            flash('Time was up before this submission arrived; your answers saved before the deadline were submitted.')
+            return redirect(url_for('student_home'))
+
         # Collect submitted answers
         answers = {}
-        score = 0
         for q in questions:
             qid = str(q['id'])
-            submitted = request.form.get(f'q{qid}')
-            answers[qid] = submitted
-            if submitted == q['answer']:
-                score += 1
+            answers[qid] = request.form.get(f'q{qid}')
+        answers = answer_drafts.merged_answers(exam_id, session.get('user_id'), form_token, answers)
+        score = grading.score_answers(answers, grading.compile_answer_key(questions))
         
         # Save submission
         success, error = save_exam_submission(
             exam_id=exam_id,
             user_id=session.get('user_id'),
             answers=answers,
-            score=score
+            score=score,
+            time_taken=exam_sessions.time_taken(exam_session),
+            form_token=form_token
         )
         
         if success:
+            answer_drafts.close(exam_id, session.get('user_id'), form_token)
+            exam_sessions.finish(exam_session['token'])
+            if request.form.get('disqualified'):
+                proctor_events.record(
+                    exam_id, session.get('user_id'),
+                    exam_session['token'],
+                    [(proctor_events.KIND_CODES['disqualified'], None)])
             flash(f'Exam submitted successfully!')
             return redirect(url_for('student_home'))
         else:
+            # keep the answers with the open attempt so the student can resubmit
+            answer_drafts.autosave(exam_id, session.get('user_id'), form_token,
+                                   json.dumps({k: v for k, v in answers.items() if v is not None}))
             flash(f'Error saving submission: {error}')
     
+    form_token, draft = answer_drafts.open_draft(
+        exam_id, session.get('user_id'), submission_queue.new_form_token())
+    exam_session = exam_sessions.start(
+        exam_id, session.get('user_id'),
+        submission_queue.submit_token(session.get('user_id'), form_token), exam['duration'])
+    if exam_sessions.is_late(exam_session):
+        submit_draft(exam_id, session.get('user_id'), form_token, exam_session)
+        flash('Time ran out on your last attempt; the answers saved for it were submitted.')
+        return redirect(url_for('student_home'))
     return render_template(
         'take_exam.html',
         exam=exam,
         questions=questions,
-        tab_limit=3  # Or get from config
-    )
\ No newline at end of file
+        tab_limit=3,  # Or get from config
+        remaining=max(exam_sessions.remaining(exam_session), 0),
+        submit_token=form_token,
+        draft=draft
+    )
+
+@app.route('/student/take_exam/<int:exam_id>/autosave', methods=['POST'])
+def autosave_answers(exam_id):
+    """Merge a debounced answer diff into the student's draft"""
+    if 'role' not in session or session['role'] != 'student':
+        return jsonify({'error': 'not logged in'}), 401
+    try:
+        token, patch = answer_drafts.parse_diff(request.get_json(silent=True))
+    except answer_drafts.DraftError as e:
+        return jsonify({'error': str(e)}), 400
+    exam_session = exam_sessions.heartbeat(submission_queue.submit_token(session.get('user_id'), token))
+    if exam_session is not None and not session_matches(exam_session, exam_id, session.get('user_id')):
+        return jsonify({'error': 'no such attempt'}), 404
+    if exam_session is None or exam_sessions.is_late(exam_session):
+        return jsonify({'error': 'time is up'}), 409
+    if not answer_drafts.autosave(exam_id, session.get('user_id'), token, patch):
+        return jsonify({'error': 'draft closed'}), 409
+    return '', 204
+
+@app.route('/student/take_exam/<int:exam_id>/heartbeat', methods=['POST'])
+def exam_heartbeat(exam_id):
+    """Seconds left on the attempt, for the page's timer"""
+    if 'role' not in session or session['role'] != 'student':
+        return jsonify({'error': 'not logged in'}), 401
+    token = (request.get_json(silent=True) or {}).get('token')
+    if not isinstance(token, str):
+        return jsonify({'error': 'token is required'}), 400
+    exam_session = exam_sessions.heartbeat(submission_queue.submit_token(session.get('user_id'), token))
+    if exam_session is None:
+        return jsonify({'error': 'no such attempt'}), 404
+    return jsonify({'remaining': max(exam_sessions.remaining(exam_session), 0),
+                    'finished': exam_session['finished_at'] is not None})
+
+@app.route('/student/take_exam/<int:exam_id>/events', methods=['POST'])
+def proctor_events_ingest(exam_id):
+    """Append a batch of focus/visibility/clipboard events"""
+    if 'role' not in session or session['role'] != 'student':
+        return jsonify({'error': 'not logged in'}), 401
+    try:
+        token, events = proctor_events.parse_batch(request.get_json(silent=True))
+    except proctor_events.EventError as e:
+        return jsonify({'error': str(e)}), 400
+    token = submission_queue.submit_token(session.get('user_id'), token)
+    exam_session = exam_sessions.heartbeat(token)
+    if exam_session is None or exam_session['exam_id'] != exam_id:
+        return jsonify({'error': 'no such attempt'}), 404
+    proctor_events.record(exam_id, session.get('user_id'), token, events)
+    return '', 204
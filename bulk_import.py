@@ -0,0 +1,206 @@
+"""
+Bulk user import: vectorized validation + COPY into a staging table.
+
+The old loop ran one INSERT and one COMMIT per row and used IntegrityError
+to spot duplicates. Here a whole DataFrame is validated with column
+operations, existing emails are found with one `= ANY(...)` query, the valid
+rows are COPYed into a temp table and moved into `users` with a single
+INSERT ... ON CONFLICT DO NOTHING. Every input row gets a status in the
+returned report: created, skipped (missing email/password) or failed (with
+a reason).
+"""
+
+import io
+import itertools
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from db import get_db_connection
+
+REQUIRED_COLUMNS = ['email', 'password']
+USER_COLUMNS = ['name', 'email', 'mobile', 'password', 'role']
+ROLES = ['student', 'mediator', 'admin']
+
+
+def read_upload(fileobj, filename, **kwargs):
+    """Read a CSV/XLS/XLSX upload into a str DataFrame with normalized headers."""
+    if filename.lower().endswith('.csv'):
+        df = pd.read_csv(fileobj, dtype=str, **kwargs)
+    else:
+        df = pd.read_excel(fileobj, dtype=str, **kwargs)
+    return normalize_columns(df)
+
+
+def read_header(path):
+    """Normalized column names of a staged upload, without reading the rows."""
+    if path.lower().endswith('.csv'):
+        columns = pd.read_csv(path, dtype=str, nrows=0).columns
+    elif path.lower().endswith('.xlsx'):
+        wb = openpyxl.load_workbook(path, read_only=True)
+        try:
+            columns = next(wb.worksheets[0].iter_rows(max_row=1, values_only=True), ())
+        finally:
+            wb.close()
+    else:
+        columns = pd.read_excel(path, dtype=str, nrows=0).columns
+    return [str(c).strip().lower() for c in columns]
+
+
+def _cell_str(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # mobile numbers typed into Excel come back as floats
+    return str(value)
+
+
+def iter_chunks(path, chunk_size):
+    """Yield str DataFrames of at most `chunk_size` rows from a staged upload.
+
+    CSV is read with `pd.read_csv(chunksize=...)` and XLSX with openpyxl's
+    read-only mode, so neither is loaded whole. Legacy .xls has no streaming
+    reader and is read in one go, then sliced.
+    """
+    lower = path.lower()
+    if lower.endswith('.csv'):
+        for chunk in pd.read_csv(path, dtype=str, chunksize=chunk_size):
+            yield normalize_columns(chunk)
+    elif lower.endswith('.xlsx'):
+        wb = openpyxl.load_workbook(path, read_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            header = [str(c).strip().lower() for c in next(rows, ())]
+            width = len(header)
+            # blank rows are dropped, as read_csv does for blank lines
+            rows = (r for r in rows if any(v is not None for v in r))
+            while True:
+                batch = list(itertools.islice(rows, chunk_size))
+                if not batch:
+                    break
+                data = [[_cell_str(v) for v in r[:width]] + [None] * (width - len(r)) for r in batch]
+                yield pd.DataFrame(data, columns=header)
+        finally:
+            wb.close()
+    else:
+        df = normalize_columns(pd.read_excel(path, dtype=str))
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
+
+
+def normalize_columns(df):
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    return df
+
+
+def missing_columns(df):
+    return [c for c in REQUIRED_COLUMNS if c not in df.columns]
+
+
+def prepare_users(df, row_offset=0):
+    """Validate a chunk of rows; returns a DataFrame with status/reason columns.
+
+    `row_offset` numbers rows across chunks (row 1 is the first data row).
+    """
+    out = pd.DataFrame(index=df.index)
+    for col in USER_COLUMNS:
+        if col in df.columns:
+            values = df[col].astype('string').fillna('').str.strip()
+            out[col] = values.replace({'nan': '', 'NaN': ''})
+        else:
+            out[col] = ''
+    out['row'] = np.arange(row_offset + 1, row_offset + len(df) + 1)
+
+    out['role'] = out['role'].str.lower()
+    out.loc[~out['role'].isin(ROLES), 'role'] = 'student'
+
+    missing = (out['email'] == '') | (out['password'] == '')
+    bad_email = ~missing & ~out['email'].str.contains('@', regex=False)
+    dup_in_file = ~missing & ~bad_email & out['email'].duplicated(keep='first')
+
+    out['status'] = 'pending'
+    out['reason'] = ''
+    out.loc[missing, ['status', 'reason']] = ['skipped', 'missing email or password']
+    out.loc[bad_email, ['status', 'reason']] = ['failed', 'invalid email']
+    out.loc[dup_in_file, ['status', 'reason']] = ['failed', 'duplicate email in file']
+    return out
+
+
+def _existing_emails(cur, emails):
+    if not emails:
+        return set()
+    cur.execute('SELECT email FROM users WHERE email = ANY(%s)', (emails,))
+    return {r[0] for r in cur.fetchall()}
+
+
+def insert_users(prepared, conn=None, seen_emails=None):
+    """Insert the pending rows of a prepared chunk; updates status in place.
+
+    `seen_emails` carries emails from earlier chunks of the same file so
+    duplicates across chunks are reported like duplicates within one.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        pending = prepared['status'] == 'pending'
+        if seen_emails is not None:
+            repeat = pending & prepared['email'].isin(seen_emails)
+            prepared.loc[repeat, ['status', 'reason']] = ['failed', 'duplicate email in file']
+            pending &= ~repeat
+
+        existing = _existing_emails(cur, prepared.loc[pending, 'email'].tolist())
+        taken = pending & prepared['email'].isin(existing)
+        prepared.loc[taken, ['status', 'reason']] = ['failed', 'email already exists']
+        pending &= ~taken
+
+        rows = prepared.loc[pending, USER_COLUMNS].replace({'': None})
+        if len(rows):
+            cur.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS users_import (
+                    name TEXT, email TEXT, mobile TEXT, password TEXT, role TEXT
+                ) ON COMMIT DELETE ROWS
+            ''')
+            buf = io.StringIO()
+            rows.to_csv(buf, header=False, index=False)
+            buf.seek(0)
+            cur.copy_expert(
+                'COPY users_import (name, email, mobile, password, role) FROM STDIN WITH (FORMAT csv)',
+                buf)
+            cur.execute('''
+                INSERT INTO users (name, email, mobile, password, role)
+                SELECT name, email, mobile, password, role FROM users_import
+                ON CONFLICT (email) DO NOTHING
+                RETURNING email
+            ''')
+            created = {r[0] for r in cur.fetchall()}
+            inserted = pending & prepared['email'].isin(created)
+            prepared.loc[inserted, 'status'] = 'created'
+            # Lost a race with a concurrent insert between the check and COPY.
+            raced = pending & ~inserted
+            prepared.loc[raced, ['status', 'reason']] = ['failed', 'email already exists']
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        still = prepared['status'] == 'pending'
+        prepared.loc[still, ['status', 'reason']] = ['failed', f'database error: {e}']
+    finally:
+        cur.close()
+        if own_conn:
+            conn.close()
+    if seen_emails is not None:
+        seen_emails.update(prepared.loc[prepared['email'] != '', 'email'])
+    return prepared
+
+
+def summarize(prepared):
+    counts = prepared['status'].value_counts()
+    return {k: int(counts.get(k, 0)) for k in ('created', 'skipped', 'failed')}
+
+
+def import_users(df, conn=None):
+    """Validate and insert a whole DataFrame; returns (counts, report DataFrame)."""
+    prepared = insert_users(prepare_users(normalize_columns(df)), conn)
+    return summarize(prepared), prepared[['row', 'email', 'status', 'reason']]
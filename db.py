@@ -0,0 +1,325 @@
+"""
+Shared Postgres access layer for app.py, app_student.py and exam_helpers.py.
+
+Connections come from a bounded pool that is created lazily in each process,
+so gunicorn workers never share sockets inherited from the master. Inside a
+Flask request the first `get_db_connection()` checks a connection out and
+every later call in the same request reuses it; it goes back to the pool in
+the app-context teardown.
+
+Environment:
+  DATABASE_URL       Postgres/Neon connection string (required)
+  DB_SSLMODE         libpq sslmode (default require; `disable` or `prefer`
+                     for a local Postgres)
+  DB_POOL_MIN        connections opened eagerly per worker (default 1)
+  DB_POOL_MAX        hard cap on connections per worker (default 10)
+  DB_POOL_TIMEOUT    seconds to wait for a free connection (default 10)
+  DB_POOL_CHECK_IDLE seconds a pooled connection may idle before it is
+                     pinged with SELECT 1 on checkout (default 30)
+
+Pooled connections time every statement their cursors run (any
+cursor_factory) and pass it to the functions in `query_hooks`; the wait
+for a free connection goes to `checkout_hooks`. metrics.py uses both.
+With no hooks registered the cost is one perf_counter() pair per query.
+"""
+
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from flask import g, has_app_context
+
+load_dotenv()
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+CHECK_IDLE = float(os.environ.get('DB_POOL_CHECK_IDLE', 30))
+SSLMODE = os.environ.get('DB_SSLMODE', 'require')
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up within DB_POOL_TIMEOUT."""
+
+
+# hook(cursor, query, vars, seconds) after every statement on a pooled connection;
+# for executemany() `vars` is the list of parameter rows
+query_hooks = []
+# hook(seconds) after every checkout, with the time spent waiting for a slot
+checkout_hooks = []
+
+_cursor_classes = {}
+
+
+def _timed_cursor_class(base):
+    """`base` with execute/executemany/copy_expert timed for query_hooks."""
+    cls = _cursor_classes.get(base)
+    if cls is not None:
+        return cls
+
+    class TimedCursor(base):
+        def execute(self, query, vars=None):
+            started = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                _after_query(self, query, vars, time.perf_counter() - started)
+
+        def executemany(self, query, vars_list):
+            vars_list = list(vars_list)
+            started = time.perf_counter()
+            try:
+                return super().executemany(query, vars_list)
+            finally:
+                _after_query(self, query, vars_list, time.perf_counter() - started)
+
+        def copy_expert(self, sql, file, size=8192):
+            started = time.perf_counter()
+            try:
+                return super().copy_expert(sql, file, size)
+            finally:
+                _after_query(self, sql, None, time.perf_counter() - started)
+
+    TimedCursor.__name__ = f'Timed{base.__name__}'
+    _cursor_classes[base] = TimedCursor
+    return TimedCursor
+
+
+def _after_query(cursor, query, vars, seconds):
+    for hook in query_hooks:
+        hook(cursor, query, vars, seconds)
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """psycopg2 connection whose cursors report to query_hooks."""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+
+class PooledConnection:
+    """Thin proxy over a psycopg2 connection.
+
+    `close()` hands the connection back to the pool instead of tearing down
+    the TLS session, so existing `conn.close()` call sites keep working.
+    Everything else is delegated to the real connection.
+    """
+
+    def __init__(self, raw, request_scoped=False):
+        self._raw = raw
+        self._request_scoped = request_scoped
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def close(self):
+        # The request-scoped connection is returned in teardown so later
+        # helpers in the same request can reuse it.
+        if not self._request_scoped:
+            self.release()
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        _checkin(self._raw)
+
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+_slots = None
+_last_used = {}
+_stats = {
+    'checkouts': 0,
+    'checkins': 0,
+    'waits': 0,
+    'wait_seconds': 0.0,
+    'timeouts': 0,
+    'discarded': 0,
+    'health_checks': 0,
+}
+
+
+def _connect_kwargs():
+    return {
+        'sslmode': SSLMODE,
+        'connection_factory': TimedConnection,
+        'keepalives': 1,
+        'keepalives_idle': 30,
+        'keepalives_interval': 10,
+        'keepalives_count': 3,
+    }
+
+
+def _get_pool():
+    """Return this process's pool, building a fresh one after a fork."""
+    global _pool, _pool_pid, _slots
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _lock:
+        if _pool is None or _pool_pid != pid:
+            if not DATABASE_URL:
+                raise RuntimeError('DATABASE_URL not set')
+            _pool = psycopg2.pool.ThreadedConnectionPool(
+                POOL_MIN, POOL_MAX, DATABASE_URL, **_connect_kwargs()
+            )
+            _slots = threading.BoundedSemaphore(POOL_MAX)
+            _pool_pid = pid
+            _last_used.clear()
+    return _pool
+
+
+def _reset_after_fork():
+    # Drop references to the parent's sockets without closing them; closing
+    # here would send a Terminate message on a connection the parent owns.
+    global _pool, _pool_pid, _slots, _lock
+    _pool = None
+    _pool_pid = None
+    _slots = None
+    _lock = threading.Lock()
+    _last_used.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _healthy(conn):
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < CHECK_IDLE:
+        return True
+    _stats['health_checks'] += 1
+    try:
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout():
+    pool = _get_pool()
+    slots = _slots
+    started = time.monotonic()
+    if not slots.acquire(blocking=False):
+        _stats['waits'] += 1
+        if not slots.acquire(timeout=POOL_TIMEOUT):
+            _stats['timeouts'] += 1
+            raise PoolTimeout(f'no database connection free after {POOL_TIMEOUT}s')
+    waited = time.monotonic() - started
+    _stats['wait_seconds'] += waited
+    for hook in checkout_hooks:
+        hook(waited)
+    try:
+        while True:
+            conn = pool.getconn()
+            if _healthy(conn):
+                break
+            _stats['discarded'] += 1
+            _last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+    except Exception:
+        slots.release()
+        raise
+    _stats['checkouts'] += 1
+    return conn
+
+
+def _checkin(conn):
+    pool = _pool
+    if pool is None or _pool_pid != os.getpid():
+        # Connection belongs to a pool from before a fork; just drop it.
+        return
+    close = bool(conn.closed)
+    if not close:
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            close = True
+    if close:
+        _stats['discarded'] += 1
+        _last_used.pop(id(conn), None)
+    else:
+        _last_used[id(conn)] = time.monotonic()
+    pool.putconn(conn, close=close)
+    _stats['checkins'] += 1
+    _slots.release()
+
+
+def get_db_connection():
+    """Check out a pooled connection.
+
+    Within a request this returns the same connection on every call; outside
+    one (CLI scripts, background jobs) the caller must `close()` it.
+    """
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is None:
+            conn = PooledConnection(_checkout(), request_scoped=True)
+            g._db_conn = conn
+        return conn
+    return PooledConnection(_checkout())
+
+
+def checkout_connection():
+    """Check out a connection that is not tied to the current request.
+
+    For work that outlives the view function (streamed responses, background
+    jobs). The caller must `close()` it.
+    """
+    return PooledConnection(_checkout())
+
+
+def release_request_connection(exc=None):
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        conn.release()
+
+
+def init_app(app):
+    app.teardown_appcontext(release_request_connection)
+
+
+def pool_stats():
+    """Snapshot of this worker's pool counters."""
+    pool = _pool if _pool_pid == os.getpid() else None
+    stats = dict(_stats)
+    stats.update({
+        'pid': os.getpid(),
+        'min': POOL_MIN,
+        'max': POOL_MAX,
+        'in_use': len(pool._used) if pool else 0,
+        'idle': len(pool._pool) if pool else 0,
+    })
+    return stats
+
+
+def close_pool():
+    """Close every pooled connection (used on worker exit)."""
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+        _pool_pid = None
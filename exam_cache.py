@@ -0,0 +1,230 @@
+"""
+Cache of exam definitions (exam row, ordered questions, answer key and its
+compiled form from grading.py).
+
+Lookups go through two tiers:
+
+  1. a per-worker LRU of parsed payloads, and
+  2. the host-wide store in shared_cache.py, so a cold worker loads the
+     payload another worker already published instead of querying Postgres.
+
+A shared payload is plain data (_encode): a JSON section with the exam row
+and questions, then the compiled key's arrays. Workers use the arrays in
+place as read-only views of the shared mapping, so the key data exists once
+per host however many workers there are. Python objects can't be shared
+between processes, so each worker parses the JSON section once per exam
+edit into its LRU; that part of per-worker memory is bounded by
+EXAM_CACHE_SIZE (keep it near the number of exams that run at once), not
+flat.
+
+The format is stored under PAYLOAD_VERSION; bump it whenever _encode() or
+the payload built by _load() changes, so workers of a new deploy never read
+the old shape.
+
+Entries carry the exam's `content_version`. Once an entry's TTL lapses it is
+revalidated with a one-column version lookup and only reloaded when the
+version moved, which catches edits made outside the app. Edits made through
+the app call `invalidate()`, which bumps the exam's shared generation so
+every worker on the host drops its copy on its next lookup.
+
+Environment:
+  EXAM_CACHE_SIZE  max exams held per worker (default 16, LRU evicted)
+  EXAM_CACHE_TTL   seconds before an entry is revalidated (default 30)
+"""
+
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import psycopg2.extras
+
+from db import get_db_connection
+import grading
+import shared_cache
+
+CACHE_SIZE = int(os.environ.get('EXAM_CACHE_SIZE', 16))
+CACHE_TTL = float(os.environ.get('EXAM_CACHE_TTL', 30))
+PAYLOAD_VERSION = 3  # 2: compiled_key, 3: plain data instead of a pickle
+
+# magic, JSON length, question count; the arrays follow 8-byte aligned
+_HEADER = struct.Struct('<4sQQ')
+_MAGIC = b'SACX'
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # exam_id -> [version, expires_at, payload, generation]
+_stats = {
+    'hits': 0, 'misses': 0, 'shared_hits': 0, 'revalidated': 0,
+    'evictions': 0, 'invalidations': 0,
+}
+
+
+def _load(exam_id):
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cur.execute('''
+        SELECT id, title, duration, created_by, attempts_allowed, content_version
+        FROM exams WHERE id=%s
+    ''', (exam_id,))
+    row = cur.fetchone()
+    if not row:
+        cur.close()
+        conn.close()
+        return None
+    exam = dict(row)
+    cur.execute('''
+        SELECT id, exam_id, question, image, option1, option2, option3, option4, answer
+        FROM questions WHERE exam_id=%s ORDER BY id
+    ''', (exam_id,))
+    questions = [dict(r) for r in cur.fetchall()]
+    cur.close()
+    conn.close()
+    return _payload(exam, questions, grading.compile_answer_key(questions))
+
+
+def _payload(exam, questions, compiled):
+    return {
+        'exam': exam,
+        'questions': questions,
+        'answer_key': [q['answer'] for q in questions],
+        'compiled_key': compiled,
+        'version': exam['content_version'],
+    }
+
+
+def _encode(payload):
+    """Serialize a payload for shared_cache: header, JSON, question ids, key."""
+    data = json.dumps({'exam': payload['exam'], 'questions': payload['questions']},
+                      separators=(',', ':')).encode()
+    compiled = payload['compiled_key']
+    pad = -(_HEADER.size + len(data)) % 8
+    return b''.join([_HEADER.pack(_MAGIC, len(data), len(compiled.question_ids)), data, b'\0' * pad,
+                     compiled.question_ids.astype('<i8').tobytes(), compiled.key.tobytes()])
+
+
+def _decode(buf):
+    """Payload for _encode()d bytes; the key arrays are views into `buf`."""
+    try:
+        magic, size, n = _HEADER.unpack_from(buf)
+        if magic != _MAGIC:
+            return None
+        data = json.loads(buf[_HEADER.size:_HEADER.size + size])
+        offset = _HEADER.size + size + (-(_HEADER.size + size) % 8)
+        question_ids = np.frombuffer(buf, dtype='<i8', count=n, offset=offset)
+        key = np.frombuffer(buf, dtype=np.int8, count=n, offset=offset + 8 * n)
+    except (ValueError, KeyError, struct.error):
+        return None
+    questions = data['questions']
+    options = [tuple(q[c] for c in grading.OPTION_COLUMNS) for q in questions]
+    return _payload(data['exam'], questions, grading.CompiledKey(question_ids, key, options))
+
+
+def _current_version(exam_id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute('SELECT content_version FROM exams WHERE id=%s', (exam_id,))
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    return row[0] if row else None
+
+
+def _store(exam_id, payload, gen):
+    with _lock:
+        _entries[exam_id] = [payload['version'], time.monotonic() + CACHE_TTL, payload, gen]
+        _entries.move_to_end(exam_id)
+        while len(_entries) > CACHE_SIZE:
+            _entries.popitem(last=False)
+            _stats['evictions'] += 1
+
+
+def get_exam_payload(exam_id):
+    """Return the cached definition of an exam, or None if it doesn't exist.
+
+    The payload is shared between requests; treat it as read-only.
+    """
+    now = time.monotonic()
+    gen = shared_cache.generation(exam_id)
+    with _lock:
+        entry = _entries.get(exam_id)
+        if entry is not None and entry[3] != gen:
+            # Invalidated by some worker since we cached it.
+            del _entries[exam_id]
+            entry = None
+        if entry is not None:
+            _entries.move_to_end(exam_id)
+            if entry[1] > now:
+                _stats['hits'] += 1
+                return entry[2]
+
+    if entry is not None:
+        version = _current_version(exam_id)
+        if version is None:
+            invalidate(exam_id)
+            return None
+        if version == entry[0]:
+            with _lock:
+                entry[1] = now + CACHE_TTL
+                _stats['hits'] += 1
+                _stats['revalidated'] += 1
+            return entry[2]
+        # Edited behind our back: make every worker reload.
+        invalidate(exam_id)
+        gen = shared_cache.generation(exam_id)
+    else:
+        buf = shared_cache.get(exam_id, gen, PAYLOAD_VERSION)
+        payload = _decode(buf) if buf is not None else None
+        if payload is not None:
+            with _lock:
+                _stats['shared_hits'] += 1
+            _store(exam_id, payload, gen)
+            return payload
+
+    with _lock:
+        _stats['misses'] += 1
+    payload = _load(exam_id)
+    if payload is None:
+        return None
+    if shared_cache.put(exam_id, gen, _encode(payload), PAYLOAD_VERSION):
+        # use the shared copy of the key arrays, like every other worker
+        buf = shared_cache.get(exam_id, gen, PAYLOAD_VERSION)
+        payload = (_decode(buf) if buf is not None else None) or payload
+    _store(exam_id, payload, gen)
+    return payload
+
+
+def get_exam(exam_id):
+    """Cached equivalent of app.get_exam(): (exam dict copy, questions)."""
+    payload = get_exam_payload(exam_id)
+    if payload is None:
+        return None, []
+    return dict(payload['exam']), payload['questions']
+
+
+def invalidate(exam_id=None):
+    """Drop one exam (or everything) from every worker's cache."""
+    with _lock:
+        _stats['invalidations'] += 1
+        if exam_id is None:
+            _entries.clear()
+        else:
+            _entries.pop(exam_id, None)
+    if exam_id is None:
+        shared_cache.clear()
+    else:
+        shared_cache.invalidate(exam_id)
+
+
+def cache_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats['size'] = len(_entries)
+    stats['max_size'] = CACHE_SIZE
+    stats['ttl'] = CACHE_TTL
+    stats['shared_enabled'] = shared_cache.ENABLED
+    lookups = stats['hits'] + stats['shared_hits'] + stats['misses']
+    stats['hit_ratio'] = round((stats['hits'] + stats['shared_hits']) / lookups, 4) if lookups else None
+    return stats
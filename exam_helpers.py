@@ -1,97 +1,226 @@
 from datetime import datetime
-import json
 import psycopg2
 import psycopg2.extras
-
-def get_db_connection():
-    """Get a database connection using psycopg2 with DictCursor by default"""
-    conn = psycopg2.connect("DATABASE_URL", sslmode='require')
-    return conn
+from db import get_db_connection
+import exam_cache
+import grading
+import pagination
+import submission_queue
+import answer_drafts
+import exam_sessions
 
 def get_exam_with_questions(exam_id, user_id=None):
     """Get exam details and its questions, optionally with attempts info for a user"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    # Get exam details
-    if user_id:
-        cur.execute('''
-            SELECT e.*, 
-                   (SELECT COUNT(*) FROM submissions s 
-                    WHERE s.exam_id = e.id AND s.student_id = %s) as attempts_used
-            FROM exams e WHERE e.id = %s
-        ''', (user_id, exam_id))
-    else:
-        cur.execute('SELECT * FROM exams WHERE id = %s', (exam_id,))
-    
-    row = cur.fetchone()
-    if not row:
-        cur.close()
-        conn.close()
+    payload = exam_cache.get_exam_payload(exam_id)
+    if payload is None:
         return None, []
         
-    exam = dict(row)
+    exam = dict(payload['exam'])
+    questions = [dict(q, question_text=q['question']) for q in payload['questions']]
     if user_id:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT COUNT(*) FROM submissions
+            WHERE exam_id = %s AND student_id = %s
+        ''', (exam_id, user_id))
+        exam['attempts_used'] = cur.fetchone()[0] + submission_queue.pending_count(exam_id, user_id)
         exam['attempts_left'] = exam['attempts_allowed'] - exam['attempts_used']
+        cur.close()
+        conn.close()
     
-    # Get questions
-    cur.execute('''
-        SELECT id, exam_id, question as question_text, image,
-               option1, option2, option3, option4, answer
-        FROM questions 
-        WHERE exam_id = %s
-        ORDER BY id
-    ''', (exam_id,))
-    questions = [dict(row) for row in cur.fetchall()]
-    
-    cur.close()
-    conn.close()
     return exam, questions
 
 def get_student_exams(user_id):
-    """Get all exams with attempt counts for a student"""
+    """Get all exams with attempt counts for a student in a single query"""
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     
     cur.execute('''
-        SELECT e.id, e.title, e.duration, e.attempts_allowed,
-               (SELECT COUNT(*) FROM submissions s 
-                WHERE s.exam_id = e.id AND s.student_id = %s) as prev_attempts
+        SELECT e.id, e.title, e.duration, e.created_by,
+               COALESCE(e.attempts_allowed, 1) as attempts_allowed,
+               COALESCE(a.prev_attempts, 0) as prev_attempts
         FROM exams e
+        LEFT JOIN (
+            SELECT exam_id, COUNT(*) as prev_attempts
+            FROM submissions
+            WHERE student_id = %s
+            GROUP BY exam_id
+        ) a ON a.exam_id = e.id
         ORDER BY e.id DESC
     ''', (user_id,))
     
+    queued = submission_queue.pending_counts(user_id)
     exam_infos = []
     for row in cur.fetchall():
         exam = dict(row)
-        exam['remaining'] = exam['attempts_allowed'] - exam['prev_attempts']
+        exam['prev_attempts'] += queued.get(exam['id'], 0)
+        exam['remaining'] = max(exam['attempts_allowed'] - exam['prev_attempts'], 0)
         exam_infos.append(exam)
     
     cur.close()
     conn.close()
     return exam_infos
 
-def save_exam_submission(exam_id, user_id, answers, score):
-    """Save an exam submission with error handling and proper cleanup"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    success = False
-    error = None
-    
+def save_exam_submission(exam_id, user_id, answers, score, time_taken=None, form_token=None):
+    """Queue an exam submission (see submission_queue.py); returns (success, error)."""
     try:
-        submitted_at = datetime.now()
-        cur.execute('''
-            INSERT INTO submissions 
-            (exam_id, student_id, answers, score, submitted_at) 
-            VALUES (%s, %s, %s, %s, %s)
-        ''', (exam_id, user_id, json.dumps(answers), score, submitted_at))
-        conn.commit()
-        success = True
+        payload = exam_cache.get_exam_payload(exam_id)
+        submission_queue.enqueue(
+            exam_id, user_id, grading.pack_answers(answers, payload['compiled_key']),
+            score, datetime.now(), time_taken,
+            token=submission_queue.submit_token(user_id, form_token))
     except Exception as e:
-        conn.rollback()
-        error = str(e)
-    finally:
-        cur.close()
-        conn.close()
-    
-    return success, error
\ No newline at end of file
+        return False, str(e)
+    return True, None
+
+def session_matches(exam_session, exam_id, user_id):
+    """True if `exam_session` is this student's attempt at this exam."""
+    return (exam_session is not None and exam_session['exam_id'] == exam_id
+            and exam_session['student_id'] == user_id)
+
+def attempt_session(exam_id, user_id, form_token):
+    """(form token, exam session) for a submitted attempt, or (form_token, None).
+
+    A form token that matches no session of this student for this exam
+    falls back to the student's open session for the exam, so leaving the
+    field out (or sending another exam's token) can't dodge the deadline;
+    the returned form token is then that session's.
+    """
+    exam_session = exam_sessions.lookup(submission_queue.submit_token(user_id, form_token))
+    if not session_matches(exam_session, exam_id, user_id):
+        exam_session = exam_sessions.open_session(exam_id, user_id)
+        if exam_session is not None:
+            form_token = exam_session['token'].split('-', 1)[1]
+    return form_token, exam_session
+
+def submit_draft(exam_id, user_id, form_token, exam_session):
+    """Hand in an attempt that ran out of time with the answers autosaved for it."""
+    payload = exam_cache.get_exam_payload(exam_id)
+    answers = answer_drafts.merged_answers(
+        exam_id, user_id, form_token, {str(q['id']): None for q in payload['questions']})
+    submission_queue.enqueue(
+        exam_id, user_id, grading.pack_answers(answers, payload['compiled_key']),
+        grading.score_answers(answers, payload['compiled_key']),
+        datetime.fromtimestamp(exam_session['deadline']), exam_sessions.time_taken(exam_session),
+        token=exam_session['token'])
+    answer_drafts.close(exam_id, user_id, form_token)
+    exam_sessions.finish(exam_session['token'])
+
+# --------------------
+# Admin list views (keyset pagination, see pagination.py)
+# --------------------
+# NULL placement spelled out (these are Postgres' defaults, so the
+# migration 7 indexes still match); _leaderboard_after relies on it
+LEADERBOARD_ORDER = ('s.score DESC NULLS FIRST, s.time_taken ASC NULLS LAST, '
+                     's.submitted_at ASC NULLS LAST, s.id ASC')
+# what each list's cursor key holds (pagination.decode_cursor)
+LEADERBOARD_KEY = [(int, type(None)), (int, type(None)), (datetime, type(None)), (int,)]
+SUBMISSIONS_KEY = [(datetime, type(None)), (int,)]
+
+
+def _same(col, value):
+    return (f'{col} IS NULL', []) if value is None else (f'{col} = %s', [value])
+
+
+def _later(col, value, desc):
+    """`col` sorts strictly after `value` (DESC NULLS FIRST or ASC NULLS LAST)."""
+    if desc:
+        return (f'{col} IS NOT NULL', []) if value is None else (f'{col} < %s', [value])
+    return ('FALSE', []) if value is None else (f'({col} > %s OR {col} IS NULL)', [value])
+
+
+def _leaderboard_after(key):
+    """WHERE fragment for rows strictly after `key` in LEADERBOARD_ORDER.
+
+    Mixed sort directions and NULLs rule out a plain row comparison, so the
+    predicate is spelled out column by column: later in this column, or
+    equal here (IS NULL for a NULL) and later in the next.
+    """
+    columns = [('s.score', True), ('s.time_taken', False), ('s.submitted_at', False), ('s.id', False)]
+    sql, params = None, []
+    for (col, desc), value in reversed(list(zip(columns, key))):
+        later, later_params = _later(col, value, desc)
+        if sql is None:
+            sql, params = later, later_params
+        else:
+            same, same_params = _same(col, value)
+            sql, params = f'({later} OR ({same} AND {sql}))', later_params + same_params + params
+    return sql, params
+
+
+def get_leaderboard_page(exam_id=None, after=None, size=pagination.DEFAULT_PAGE_SIZE, with_total=False):
+    """One page of the leaderboard (score DESC, time_taken, submitted_at)"""
+    key, seen = pagination.decode_cursor(after, LEADERBOARD_KEY)
+    where, params = [], []
+    if exam_id:
+        where.append('s.exam_id = %s')
+        params.append(exam_id)
+    if key:
+        clause, key_params = _leaderboard_after(key)
+        where.append(clause)
+        params.extend(key_params)
+    where_sql = ('WHERE ' + ' AND '.join(where)) if where else ''
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cur.execute(f'''
+        SELECT s.id, u.name as student_name, e.title as exam_title, s.score,
+               s.attempt_number, s.submitted_at, s.time_taken
+        FROM submissions s
+        JOIN users u ON s.student_id = u.id
+        JOIN exams e ON s.exam_id = e.id
+        {where_sql}
+        ORDER BY {LEADERBOARD_ORDER}
+        LIMIT %s
+    ''', params + [size + 1])
+    rows = cur.fetchall()
+    page = pagination.build_page(
+        rows, size, seen,
+        lambda r: [r['score'], r['time_taken'], r['submitted_at'], r['id']])
+
+    if with_total:
+        if exam_id:
+            cur.execute('SELECT COUNT(*) FROM submissions WHERE exam_id = %s', (exam_id,))
+        else:
+            cur.execute('SELECT COUNT(*) FROM submissions')
+        page.total = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+    return page
+
+
+def get_submissions_page(after=None, size=pagination.DEFAULT_PAGE_SIZE, with_total=False):
+    """One page of all submissions, newest first"""
+    key, seen = pagination.decode_cursor(after, SUBMISSIONS_KEY)
+    where, params = '', []
+    if key:
+        submitted_at, sid = key
+        if submitted_at is None:
+            where = 'WHERE s.submitted_at IS NULL AND s.id < %s'
+            params = [sid]
+        else:
+            where = 'WHERE ((s.submitted_at, s.id) < (%s, %s) OR s.submitted_at IS NULL)'
+            params = [submitted_at, sid]
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cur.execute(f'''
+        SELECT s.id, u.name as student_name, e.title as exam_title, s.score,
+               s.attempt_number, s.submitted_at
+        FROM submissions s
+        JOIN users u ON s.student_id = u.id
+        JOIN exams e ON s.exam_id = e.id
+        {where}
+        ORDER BY s.submitted_at DESC NULLS LAST, s.id DESC
+        LIMIT %s
+    ''', params + [size + 1])
+    rows = cur.fetchall()
+    page = pagination.build_page(rows, size, seen, lambda r: [r['submitted_at'], r['id']])
+
+    if with_total:
+        cur.execute('SELECT COUNT(*) FROM submissions')
+        page.total = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+    return page
@@ -0,0 +1,294 @@
+"""
+Server-side clocks for exam attempts.
+
+The first render of an attempt (see take_exam) starts a session keyed by
+the attempt's submit token: when it started and when it has to be in. The
+submit then takes `time_taken` from that clock instead of the browser's
+hidden field, and a POST arriving more than GRACE seconds after the
+deadline is refused. Reloads keep the token (answer_drafts.open_draft), so
+they keep the clock too.
+
+Sessions live in a small SQLite table in shared memory (/dev/shm where it
+exists), shared by every worker on the host; starting one, checking a
+submit and the page's heartbeats are local reads/writes, never Postgres.
+A persister thread in each worker copies changed rows to the
+`exam_sessions` table (migration 10) every INTERVAL seconds in one
+statement, and a token missing locally (host rebooted, request landed on
+another host) is looked up there before a new clock is started.
+
+Environment:
+  EXAM_SESSIONS_PATH      SQLite file (default /dev/shm/sac-exam-sessions.db)
+  EXAM_SESSION_GRACE      seconds a submit may trail the deadline (default 30)
+  EXAM_SESSION_INTERVAL   seconds between batches to Postgres (default 10)
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import psycopg2.extras
+
+from db import checkout_connection, get_db_connection
+
+
+def _default_path():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'sac-exam-sessions.db')
+
+
+PATH = os.environ.get('EXAM_SESSIONS_PATH') or _default_path()
+GRACE = float(os.environ.get('EXAM_SESSION_GRACE', 30))
+INTERVAL = float(os.environ.get('EXAM_SESSION_INTERVAL', 10))
+BATCH_SIZE = 1000
+RETENTION = 86400
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS exam_sessions (
+    token TEXT PRIMARY KEY,
+    exam_id INTEGER NOT NULL,
+    student_id INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    deadline REAL NOT NULL,
+    last_seen REAL,
+    heartbeats INTEGER NOT NULL DEFAULT 0,
+    finished_at REAL,
+    version INTEGER NOT NULL DEFAULT 1,
+    persisted INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS exam_sessions_dirty ON exam_sessions (persisted, version);
+CREATE INDEX IF NOT EXISTS exam_sessions_student ON exam_sessions (student_id, exam_id);
+'''
+COLUMNS = 'token, exam_id, student_id, started_at, deadline, last_seen, heartbeats, finished_at'
+
+PERSIST_SQL = '''
+    INSERT INTO exam_sessions
+        (token, exam_id, student_id, started_at, deadline, last_seen, heartbeats, finished_at)
+    VALUES %s
+    ON CONFLICT (token) DO UPDATE SET
+        last_seen = GREATEST(exam_sessions.last_seen, excluded.last_seen),
+        heartbeats = GREATEST(exam_sessions.heartbeats, excluded.heartbeats),
+        finished_at = COALESCE(exam_sessions.finished_at, excluded.finished_at)
+'''
+
+_local = threading.local()
+_lock = threading.Lock()
+_persister = None
+_persister_pid = None
+_last_error = None
+
+
+def _sqlite():
+    """This thread's connection to the session table."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(PATH, timeout=5, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=OFF')  # shared memory; Postgres is the durable copy
+        conn.executescript(SCHEMA)
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+def _local_session(token):
+    return _sqlite().execute(f'SELECT {COLUMNS} FROM exam_sessions WHERE token = ?', (token,)).fetchone()
+
+
+def _from_postgres(token):
+    """Copy a session persisted by another host (or before a reboot) back in."""
+    cur = get_db_connection().cursor()
+    cur.execute(f'SELECT {COLUMNS} FROM exam_sessions WHERE token = %s', (token,))
+    row = cur.fetchone()
+    cur.close()
+    if row is None:
+        return None
+    epoch = [v.timestamp() if isinstance(v, datetime) else v for v in row]
+    # persisted = version: it is already in Postgres
+    _sqlite().execute(f'''
+        INSERT OR IGNORE INTO exam_sessions ({COLUMNS}, version, persisted)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, 1)
+    ''', epoch)
+    return _local_session(token)
+
+
+def start(exam_id, student_id, token, duration_minutes):
+    """The session for this attempt, starting its clock on first sight."""
+    found = _local_session(token) or _from_postgres(token)
+    if found is not None:
+        return found
+    now = time.time()
+    _sqlite().execute(f'''
+        INSERT OR IGNORE INTO exam_sessions ({COLUMNS})
+        VALUES (?, ?, ?, ?, ?, ?, 0, NULL)
+    ''', (token, exam_id, student_id, now, now + (duration_minutes or 0) * 60, now))
+    return _local_session(token)
+
+
+def lookup(token):
+    """The session for a submit token, or None if it never started."""
+    return _local_session(token) or _from_postgres(token)
+
+
+def open_session(exam_id, student_id):
+    """The student's latest unfinished session for an exam, or None.
+
+    For a submit whose token matches no session (field missing or
+    tampered with): the attempt it belongs to still has a deadline.
+    """
+    found = _sqlite().execute(f'''
+        SELECT {COLUMNS} FROM exam_sessions
+        WHERE student_id = ? AND exam_id = ? AND finished_at IS NULL
+        ORDER BY started_at DESC LIMIT 1
+    ''', (student_id, exam_id)).fetchone()
+    if found is not None:
+        return found
+    cur = get_db_connection().cursor()
+    cur.execute('''
+        SELECT token FROM exam_sessions
+        WHERE exam_id = %s AND student_id = %s AND finished_at IS NULL
+        ORDER BY started_at DESC LIMIT 1
+    ''', (exam_id, student_id))
+    row = cur.fetchone()
+    cur.close()
+    found = row and _from_postgres(row[0])
+    # finished here but not persisted yet
+    return found if found is not None and found['finished_at'] is None else None
+
+
+def heartbeat(token):
+    """Note the page is alive; returns the session (None if unknown)."""
+    _sqlite().execute('''
+        UPDATE exam_sessions SET last_seen = ?, heartbeats = heartbeats + 1, version = version + 1
+        WHERE token = ?
+    ''', (time.time(), token))
+    return _local_session(token)
+
+
+def finish(token):
+    _sqlite().execute('''
+        UPDATE exam_sessions SET finished_at = ?, version = version + 1
+        WHERE token = ? AND finished_at IS NULL
+    ''', (time.time(), token))
+
+
+def remaining(session, now=None):
+    """Whole seconds left before the deadline (negative once it has passed)."""
+    return int(session['deadline'] - (now or time.time()))
+
+
+def is_late(session, now=None):
+    return (now or time.time()) > session['deadline'] + GRACE
+
+
+def time_taken(session, now=None):
+    """Seconds from the start to `now`, capped at the exam's duration."""
+    end = min(now or time.time(), session['deadline'])
+    return max(0, int(end - session['started_at']))
+
+
+def _claim(limit):
+    conn = _sqlite()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute(f'''
+            SELECT {COLUMNS}, version FROM exam_sessions
+            WHERE persisted < version LIMIT ?
+        ''', (limit,)).fetchall()
+        conn.executemany('UPDATE exam_sessions SET persisted = ? WHERE token = ?',
+                         [(r['version'], r['token']) for r in rows])
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return rows
+
+
+def persist(limit=BATCH_SIZE):
+    """Copy one batch of changed sessions to Postgres; returns rows written."""
+    rows = _claim(limit)
+    if not rows:
+        return 0
+
+    def ts(v):
+        return datetime.fromtimestamp(v) if v is not None else None
+
+    values = [(r['token'], r['exam_id'], r['student_id'], ts(r['started_at']), ts(r['deadline']),
+               ts(r['last_seen']), r['heartbeats'], ts(r['finished_at'])) for r in rows]
+    conn = None
+    try:
+        conn = checkout_connection()
+        cur = conn.cursor()
+        psycopg2.extras.execute_values(cur, PERSIST_SQL, values, page_size=len(values))
+        conn.commit()
+        cur.close()
+    except Exception:
+        if conn is not None:
+            conn.rollback()
+        # mark them dirty again for the next pass
+        _sqlite().executemany('UPDATE exam_sessions SET persisted = 0 WHERE token = ?',
+                              [(r['token'],) for r in rows])
+        raise
+    finally:
+        if conn is not None:
+            conn.close()
+    return len(rows)
+
+
+def purge():
+    """Forget persisted sessions that ended (or ran out) more than RETENTION ago."""
+    _sqlite().execute('''
+        DELETE FROM exam_sessions
+        WHERE persisted = version AND COALESCE(finished_at, deadline) < ?
+    ''', (time.time() - RETENTION,))
+
+
+def _run_persister():
+    global _last_error
+    last_purge = 0
+    while True:
+        time.sleep(INTERVAL)
+        try:
+            while persist() >= BATCH_SIZE:
+                pass
+            if time.time() - last_purge > 600:
+                purge()
+                last_purge = time.time()
+        except Exception as e:  # keep the thread alive; rows stay dirty
+            _last_error = f'{datetime.now():%Y-%m-%d %H:%M:%S} {e}'
+
+
+def ensure_persister():
+    """Start this process's persister thread if it isn't running (e.g. after fork)."""
+    global _persister, _persister_pid
+    if _persister is not None and _persister_pid == os.getpid() and _persister.is_alive():
+        return
+    with _lock:
+        if _persister is None or _persister_pid != os.getpid() or not _persister.is_alive():
+            _persister = threading.Thread(target=_run_persister, name='exam-sessions', daemon=True)
+            _persister.start()
+            _persister_pid = os.getpid()
+
+
+def stats():
+    now = time.time()
+    row = _sqlite().execute('''
+        SELECT COUNT(*) FILTER (WHERE finished_at IS NULL AND deadline > ?),
+               COUNT(*) FILTER (WHERE persisted < version),
+               COUNT(*)
+        FROM exam_sessions
+    ''', (now,)).fetchone()
+    return {
+        'path': PATH,
+        'running': row[0],
+        'unpersisted': row[1],
+        'total': row[2],
+        'persister_alive': bool(_persister and _persister_pid == os.getpid() and _persister.is_alive()),
+        'last_error': _last_error,
+    }
+
+
+def init_app(app):
+    app.before_request(ensure_persister)
@@ -0,0 +1,162 @@
+"""
+Leaderboard exports (CSV, XLSX, PDF) that don't hold the whole result in memory.
+
+Rows come from a named (server-side) cursor in chunks of EXPORT_CHUNK_SIZE,
+so Postgres only ships one chunk at a time. CSV is yielded to the client as
+it is produced; XLSX uses openpyxl's write-only mode, which streams rows to a
+temp file instead of building a cell grid. The `write_*` functions are what
+reports.py runs in the background. Each also takes `rows`, an iterable of
+leaderboard rows to write instead of querying (scripts/bench_micro.py).
+"""
+
+import csv
+import io
+import os
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.utils import get_column_letter
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
+from db import checkout_connection
+from exam_helpers import LEADERBOARD_ORDER
+
+CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))
+
+HEADERS = ["S.No", "Student Name", "Exam Title", "Score", "Attempt", "Submitted At", "Time Taken"]
+# Write-only sheets need widths up front, so they can't be fitted to the data.
+COLUMN_WIDTHS = [8, 30, 30, 9, 10, 20, 14]
+
+
+def iter_leaderboard_rows(exam_id=None, chunk_size=CHUNK_SIZE):
+    """Yield (name, title, score, attempt, submitted_at, time_taken) in leaderboard order."""
+    conn = checkout_connection()
+    cur = conn.cursor(name='leaderboard_export')
+    cur.itersize = chunk_size
+    try:
+        where = 'WHERE s.exam_id = %s' if exam_id else ''
+        cur.execute(f'''
+            SELECT u.name, e.title, s.score, s.attempt_number, s.submitted_at, s.time_taken
+            FROM submissions s
+            JOIN users u ON s.student_id = u.id
+            JOIN exams e ON s.exam_id = e.id
+            {where}
+            ORDER BY {LEADERBOARD_ORDER}
+        ''', (exam_id,) if exam_id else ())
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cur.close()
+        conn.close()
+
+
+def format_row(idx, row):
+    submitted_at_str = row[4].strftime('%Y-%m-%d %H:%M') if row[4] else "Not Submitted"
+    time_taken_str = f"{row[5] // 60}m {row[5] % 60}s" if row[5] else "-"
+    return [idx, row[0], row[1], row[2], row[3], submitted_at_str, time_taken_str]
+
+
+def leaderboard_csv(exam_id=None, flush_bytes=64 * 1024, rows=None):
+    """Generator of CSV bytes, flushed roughly every `flush_bytes`."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write('\ufeff')  # so Excel opens it as UTF-8
+    writer.writerow(HEADERS)
+    if rows is None:
+        rows = iter_leaderboard_rows(exam_id)
+    for idx, row in enumerate(rows, start=1):
+        writer.writerow(format_row(idx, row))
+        if buf.tell() >= flush_bytes:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+
+def write_leaderboard_xlsx(fileobj, exam_id=None, rows=None):
+    """Write the leaderboard workbook to `fileobj` with bounded memory."""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Leaderboard")
+    for i, width in enumerate(COLUMN_WIDTHS, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="4FACFE", end_color="4FACFE", fill_type="solid")
+    alignment = Alignment(horizontal="center", vertical="center")
+    thin_border = Border(left=Side(style="thin"), right=Side(style="thin"),
+                         top=Side(style="thin"), bottom=Side(style="thin"))
+
+    header = []
+    for value in HEADERS:
+        cell = WriteOnlyCell(ws, value=value)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = alignment
+        cell.border = thin_border
+        header.append(cell)
+    ws.append(header)
+
+    if rows is None:
+        rows = iter_leaderboard_rows(exam_id)
+    for idx, row in enumerate(rows, start=1):
+        cells = []
+        for value in format_row(idx, row):
+            cell = WriteOnlyCell(ws, value=value)
+            cell.alignment = alignment
+            cell.border = thin_border
+            cells.append(cell)
+        ws.append(cells)
+
+    wb.save(fileobj)
+
+
+def write_leaderboard_csv(fileobj, exam_id=None, rows=None):
+    for chunk in leaderboard_csv(exam_id, rows=rows):
+        fileobj.write(chunk)
+
+
+# ReportLab lays out and splits one Table across pages by re-measuring the
+# remaining rows each time, which goes quadratic on big tables. Emitting a
+# series of modest tables keeps layout linear.
+PDF_ROWS_PER_TABLE = 500
+
+
+def _pdf_table(table_data):
+    table = Table(table_data, repeatRows=1)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.HexColor("#4FACFE")),
+        ('TEXTCOLOR', (0,0), (-1,0), colors.white),
+        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0,0), (-1,0), 11),
+        ('BOTTOMPADDING', (0,0), (-1,0), 10),
+        ('BACKGROUND', (0,1), (-1,-1), colors.whitesmoke),
+        ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
+    ]))
+    return table
+
+
+def write_leaderboard_pdf(fileobj, exam_id=None, rows=None):
+    doc = SimpleDocTemplate(fileobj, pagesize=letter)
+    styles = getSampleStyleSheet()
+    elements = [Paragraph("Leaderboard Report", styles['Title']), Spacer(1, 12)]
+
+    table_data = [HEADERS]
+    if rows is None:
+        rows = iter_leaderboard_rows(exam_id)
+    for idx, row in enumerate(rows, start=1):
+        table_data.append(format_row(idx, row))
+        if len(table_data) > PDF_ROWS_PER_TABLE:
+            elements.append(_pdf_table(table_data))
+            table_data = [HEADERS]
+    if len(table_data) > 1 or len(elements) == 2:
+        elements.append(_pdf_table(table_data))
+
+    doc.build(elements)
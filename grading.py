@@ -0,0 +1,240 @@
+"""
+Answer-key compilation and vectorized scoring.
+
+An exam's key is compiled once into NumPy arrays: question ids in display
+order and, for each question, the 1-based index of the correct option
+(0 when the stored answer matches none of the options, so nobody scores it).
+Submissions are encoded the same way, which turns grading into an element-
+wise compare over a (submissions x questions) int8 matrix.
+
+`regrade_exam()` streams every submission of an exam through a server-side
+cursor, rescores them in batches and writes changed scores back with one
+UPDATE per batch.
+
+Submissions store their choices in `submissions.answer_codes`: one byte per
+question in question-id order, 0 for unanswered, 1-4 for the chosen option.
+Questions are never added to or removed from an existing exam, so positions
+stay stable. Rows written before the column existed keep their JSON
+`answers` until the backfill migration converts them; rows whose answers
+can't be converted losslessly keep only the JSON.
+"""
+
+import json
+from collections import namedtuple
+
+import numpy as np
+import psycopg2.extras
+
+from db import get_db_connection
+
+OPTION_COLUMNS = ('option1', 'option2', 'option3', 'option4')
+BATCH_SIZE = 5000
+
+CompiledKey = namedtuple('CompiledKey', 'question_ids key options')
+
+
+def _option_index(options, text):
+    if text is None:
+        return 0
+    try:
+        return options.index(text) + 1
+    except ValueError:
+        return 0
+
+
+def compile_answer_key(questions):
+    """Compile questions (dicts with id, option1..4, answer) into a CompiledKey."""
+    question_ids = np.array([q['id'] for q in questions], dtype=np.int64)
+    options = [tuple(q[c] for c in OPTION_COLUMNS) for q in questions]
+    key = np.array([_option_index(opts, q['answer']) for opts, q in zip(options, questions)],
+                   dtype=np.int8)
+    return CompiledKey(question_ids, key, options)
+
+
+def encode_answers(answers, compiled):
+    """Map {question_id: option text} to an int8 array of chosen option indices."""
+    choices = np.zeros(len(compiled.question_ids), dtype=np.int8)
+    for i, (qid, opts) in enumerate(zip(compiled.question_ids.tolist(), compiled.options)):
+        choices[i] = _option_index(opts, answers.get(str(qid)))
+    return choices
+
+
+def pack_answers(answers, compiled):
+    """Encode a submission as the bytes stored in submissions.answer_codes."""
+    return encode_answers(answers, compiled).tobytes()
+
+
+def lossless(answers, compiled):
+    """True if every non-empty answer maps to one of the options."""
+    choices = encode_answers(answers, compiled)
+    for qid, c in zip(compiled.question_ids.tolist(), choices.tolist()):
+        if c == 0 and answers.get(str(qid)) not in (None, ''):
+            return False
+    return True
+
+
+def decode_codes(codes, compiled):
+    """int8 choices for stored answer_codes, or None if they don't fit the key."""
+    if codes is None or len(codes) != len(compiled.question_ids):
+        return None
+    return np.frombuffer(codes, dtype=np.int8)
+
+
+def submission_answers(codes, answers_json, compiled):
+    """{question_id: option text or None} for display, from either encoding."""
+    choices = decode_codes(codes, compiled)
+    if choices is None:
+        try:
+            return json.loads(answers_json) if answers_json else {}
+        except ValueError:
+            return {}
+    return {
+        str(qid): (opts[c - 1] if c else None)
+        for qid, opts, c in zip(compiled.question_ids.tolist(), compiled.options, choices.tolist())
+    }
+
+
+def score_matrix(choices, compiled):
+    """Scores for a (n_submissions, n_questions) int8 matrix of choices."""
+    if choices.size == 0:
+        return np.zeros(choices.shape[0], dtype=np.int32)
+    correct = (choices == compiled.key) & (compiled.key > 0)
+    return correct.sum(axis=1, dtype=np.int32)
+
+
+def score_answers(answers, compiled):
+    """Score a single {question_id: option text} submission."""
+    choices = encode_answers(answers, compiled)
+    return int(np.count_nonzero((choices == compiled.key) & (compiled.key > 0)))
+
+
+def _questions_for(cur, exam_id):
+    cur.execute('''
+        SELECT id, option1, option2, option3, option4, answer
+        FROM questions WHERE exam_id=%s ORDER BY id
+    ''', (exam_id,))
+    return [dict(r) for r in cur.fetchall()]
+
+
+def _choices_for_rows(rows, compiled):
+    """Stack a batch of (id, answer_codes, answers, score) rows into a matrix.
+
+    Rows with well-formed answer_codes are decoded with one frombuffer call;
+    legacy JSON rows fall back to per-row encoding.
+    """
+    n_q = len(compiled.question_ids)
+    choices = np.zeros((len(rows), n_q), dtype=np.int8)
+    packed = [r for r, row in enumerate(rows) if row[1] is not None and len(row[1]) == n_q]
+    if packed and n_q:
+        choices[packed] = np.frombuffer(b''.join(bytes(rows[r][1]) for r in packed),
+                                        dtype=np.int8).reshape(len(packed), n_q)
+    packed = set(packed)
+    for r, row in enumerate(rows):
+        if r in packed:
+            continue
+        try:
+            answers = json.loads(row[2]) if row[2] else {}
+        except ValueError:
+            answers = {}
+        if isinstance(answers, dict):
+            choices[r] = encode_answers(answers, compiled)
+    return choices
+
+
+def _flush_scores(cur, ids, scores, old_scores):
+    changed = [(int(i), int(s)) for i, s, o in zip(ids, scores, old_scores) if s != o]
+    if changed:
+        psycopg2.extras.execute_values(cur, '''
+            UPDATE submissions AS s SET score = v.score
+            FROM (VALUES %s) AS v(id, score)
+            WHERE s.id = v.id
+        ''', changed, page_size=len(changed))
+    return len(changed)
+
+
+def regrade_exam(exam_id, batch_size=BATCH_SIZE):
+    """Recompute submissions.score for every submission of an exam.
+
+    Returns (submissions_seen, scores_changed).
+    """
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    write_cur = conn.cursor()
+    stream = conn.cursor(name=f'regrade_{exam_id}')
+    stream.itersize = batch_size
+    seen = changed = 0
+    try:
+        compiled = compile_answer_key(_questions_for(cur, exam_id))
+        stream.execute('''
+            SELECT id, answer_codes, answers, score FROM submissions WHERE exam_id=%s
+        ''', (exam_id,))
+        while True:
+            rows = stream.fetchmany(batch_size)
+            if not rows:
+                break
+            scores = score_matrix(_choices_for_rows(rows, compiled), compiled)
+            changed += _flush_scores(write_cur, [row[0] for row in rows], scores,
+                                     [row[3] for row in rows])
+            seen += len(rows)
+        stream.close()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        write_cur.close()
+        cur.close()
+        conn.close()
+    return seen, changed
+
+
+def backfill_answer_codes(conn, batch_size=BATCH_SIZE, verbose=True):
+    """Fill answer_codes for submissions that only have JSON answers.
+
+    The JSON is replaced when the conversion is lossless. Rows whose answers
+    no longer match any option (the option text was edited afterwards) are
+    left as they are, answer_codes NULL, so readers keep using the JSON and
+    nothing is thrown away. Safe to re-run.
+    """
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    keys = {}
+    last_id = 0
+    total = 0
+    while True:
+        cur.execute('''
+            SELECT id, exam_id, answers FROM submissions
+            WHERE answer_codes IS NULL AND answers IS NOT NULL AND id > %s
+            ORDER BY id LIMIT %s
+        ''', (last_id, batch_size))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            try:
+                answers = json.loads(row['answers'])
+            except ValueError:
+                continue
+            if not isinstance(answers, dict):
+                continue
+            exam_id = row['exam_id']
+            if exam_id not in keys:
+                keys[exam_id] = compile_answer_key(_questions_for(cur, exam_id))
+            compiled = keys[exam_id]
+            # readers prefer answer_codes, so a lossy row keeps only its JSON
+            if lossless(answers, compiled):
+                updates.append((row['id'], psycopg2.Binary(pack_answers(answers, compiled))))
+        if updates:
+            psycopg2.extras.execute_values(cur, '''
+                UPDATE submissions AS s
+                SET answer_codes = v.codes, answers = NULL
+                FROM (VALUES %s) AS v(id, codes)
+                WHERE s.id = v.id
+            ''', updates, page_size=len(updates))
+        conn.commit()
+        last_id = rows[-1]['id']
+        total += len(updates)
+        if verbose:
+            print(f'  backfilled {total} submissions')
+    cur.close()
+    return total
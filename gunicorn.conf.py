@@ -0,0 +1,11 @@
+# Picked up automatically by `gunicorn app:app` (see Procfile).
+import os
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+
+def worker_exit(server, worker):
+    # Each worker owns its own pool (db.py rebuilds it after fork); close it
+    # cleanly so Neon doesn't keep idle sessions around until they time out.
+    import db
+    db.close_pool()
@@ -0,0 +1,172 @@
+"""
+Content-addressed store for question images, with resized variants.
+
+An upload is saved as `uploads/<h[:2]>/<h><ext>`, where `h` is the SHA-256
+of its bytes, and that relative name is what goes into `questions.image`.
+The same picture uploaded twice is stored once, and two different files
+called `diagram.png` no longer overwrite each other.
+
+New originals are handed to a small thread pool that writes downscaled,
+recompressed copies (`<h>-<width>w.webp`, one per IMAGE_VARIANT_WIDTHS
+narrower than the original) and then a `<h>.json` manifest. Templates call
+`question_image(name)` for src/srcset/size attributes; until the manifest
+exists (or for images saved before this store, which are plain file names)
+it just points at the original.
+
+Environment:
+  IMAGE_VARIANT_WIDTHS   comma-separated widths in px (default 480,960)
+  IMAGE_VARIANT_QUALITY  WebP/JPEG quality (default 80)
+  IMAGE_WORKERS          resize threads per gunicorn worker (default 2)
+"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import url_for
+from PIL import Image, ImageOps, features
+from werkzeug.utils import secure_filename
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
+WIDTHS = tuple(sorted(int(w) for w in os.environ.get('IMAGE_VARIANT_WIDTHS', '480,960').split(',')))
+QUALITY = int(os.environ.get('IMAGE_VARIANT_QUALITY', 80))
+WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+VARIANT_FORMAT, VARIANT_EXT = ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+# manifests never change once written, so they are cached for good
+_manifests = {}
+MANIFEST_CACHE_SIZE = 4096
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='image')
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def _digest_of(name):
+    """The content hash in a stored name, or None for a legacy upload."""
+    if not name or '/' not in name:
+        return None
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def _write_atomic(path, data):
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def save_image(data, filename, background=True):
+    """Store image bytes; returns the name to keep in `questions.image`.
+
+    Variants are made on the pool unless `background` is False.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    ext = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    name = f'{digest[:2]}/{digest}{ext}'
+    path = os.path.join(ROOT, name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path, data)
+    if not os.path.exists(_manifest_path(digest)):
+        if background:
+            _get_executor().submit(make_variants, name)
+        else:
+            make_variants(name)
+    return name
+
+
+def save_upload(file_storage):
+    """save_image() for a werkzeug FileStorage; None if nothing was uploaded."""
+    if not file_storage or file_storage.filename == '':
+        return None
+    return save_image(file_storage.read(), file_storage.filename)
+
+
+def _manifest_path(digest):
+    return os.path.join(ROOT, digest[:2], f'{digest}.json')
+
+
+def make_variants(name):
+    """Write the resized copies and manifest for a stored image (idempotent)."""
+    digest = _digest_of(name)
+    path = os.path.join(ROOT, name)
+    manifest = {'variants': []}
+    try:
+        with Image.open(path) as im:
+            # animations would lose their frames; serve those as uploaded
+            animated = getattr(im, 'is_animated', False)
+            if not animated:
+                im = ImageOps.exif_transpose(im)
+            manifest.update(width=im.width, height=im.height)
+            if not animated:
+                if im.mode not in ('RGB', 'RGBA'):
+                    im = im.convert('RGBA' if im.has_transparency_data else 'RGB')
+                if VARIANT_FORMAT == 'JPEG':
+                    im = im.convert('RGB')
+                options = {'quality': QUALITY, 'method': 4} if VARIANT_FORMAT == 'WEBP' else {'quality': QUALITY}
+                for width in WIDTHS:
+                    if width >= im.width:
+                        break
+                    height = max(1, round(im.height * width / im.width))
+                    variant = f'{digest[:2]}/{digest}-{width}w.{VARIANT_EXT}'
+                    buf = io.BytesIO()
+                    im.resize((width, height), Image.LANCZOS).save(buf, VARIANT_FORMAT, **options)
+                    _write_atomic(os.path.join(ROOT, variant), buf.getvalue())
+                    manifest['variants'].append([variant, width])
+    except (OSError, Image.DecompressionBombError):
+        pass  # not an image Pillow can read: the original is served as is
+    _write_atomic(_manifest_path(digest), json.dumps(manifest).encode())
+    return manifest
+
+
+def _manifest(digest):
+    found = _manifests.get(digest)
+    if found is None:
+        try:
+            with open(_manifest_path(digest)) as f:
+                found = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if len(_manifests) >= MANIFEST_CACHE_SIZE:
+            _manifests.clear()
+        _manifests[digest] = found
+    return found
+
+
+def question_image(name, display_width=None):
+    """Attributes for an <img> of a stored question image.
+
+    Returns a dict with `src` and, once variants exist, `srcset`, `width`
+    and `height`. `display_width` makes `src` the smallest copy at least that
+    wide, for thumbnails.
+    """
+    info = {'src': url_for('static', filename='uploads/' + name)}
+    digest = _digest_of(name)
+    manifest = _manifest(digest) if digest else None
+    if not manifest or 'width' not in manifest:
+        return info
+    info.update(width=manifest['width'], height=manifest['height'])
+    variants = manifest['variants']
+    if variants:
+        candidates = [(url_for('static', filename='uploads/' + v), w) for v, w in variants]
+        candidates.append((info['src'], manifest['width']))
+        info['srcset'] = ', '.join(f'{url} {w}w' for url, w in candidates)
+        if display_width:
+            info['src'] = next(url for url, w in candidates if w >= display_width or url == info['src'])
+    return info
+
+
+def init_app(app):
+    app.add_template_global(question_image)
@@ -0,0 +1,205 @@
+"""
+Background bulk user import jobs with progress reporting.
+
+The upload request only stages the file in IMPORT_DIR and queues a job; a
+small per-worker thread pool then reads it in chunks of IMPORT_CHUNK_SIZE
+rows (see bulk_import.iter_chunks) and runs each chunk through the same
+validate + COPY + INSERT ... ON CONFLICT path as before, committing per
+chunk. After every chunk the job file is rewritten with running counts, so
+any gunicorn worker can answer a status poll.
+
+Rows that were not created are appended to a per-job CSV as they are found
+(for download) and the first PROBLEM_PREVIEW of them are kept in the job
+state for the page to show.
+
+Environment:
+  IMPORT_DIR          where staged uploads and job files live
+  IMPORT_WORKERS      threads per gunicorn worker (default 1)
+  IMPORT_CHUNK_SIZE   rows per chunk (default 5000)
+  IMPORT_TTL          seconds before finished jobs are pruned (default 1 day)
+  IMPORT_STALE_AFTER  seconds without progress before a running job is presumed dead (default 300)
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import bulk_import
+from db import checkout_connection
+
+IMPORT_DIR = os.environ.get('IMPORT_DIR') or os.path.join(tempfile.gettempdir(), 'sac-imports')
+WORKERS = int(os.environ.get('IMPORT_WORKERS', 1))
+CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 5000))
+TTL = float(os.environ.get('IMPORT_TTL', 86400))
+STALE_AFTER = float(os.environ.get('IMPORT_STALE_AFTER', 300))
+
+PROBLEM_PREVIEW = 500
+REPORT_COLUMNS = ['row', 'email', 'status', 'reason']
+
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='import')
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def _paths(job_id):
+    """(job state, problem report CSV) paths."""
+    return (os.path.join(IMPORT_DIR, f'{job_id}.json'),
+            os.path.join(IMPORT_DIR, f'{job_id}.problems.csv'))
+
+
+def _write_state(job_id, state):
+    meta_path, _ = _paths(job_id)
+    state['updated_at'] = time.time()
+    tmp = f'{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, meta_path)
+
+
+def _read_state(job_id):
+    meta_path, _ = _paths(job_id)
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _prune():
+    cutoff = time.time() - TTL
+    for name in os.listdir(IMPORT_DIR):
+        path = os.path.join(IMPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _estimate_rows(path):
+    """Data rows in a staged CSV by counting newlines; None for spreadsheets.
+
+    Only used for the progress bar, so quoted newlines throwing it off a
+    little doesn't matter.
+    """
+    if not path.lower().endswith('.csv'):
+        return None
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def stage_upload(fileobj, filename):
+    """Save an uploaded file under IMPORT_DIR; returns (job id, staged path)."""
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    job_id = uuid.uuid4().hex[:20]
+    ext = os.path.splitext(filename)[1].lower()
+    path = os.path.join(IMPORT_DIR, f'{job_id}.upload{ext}')
+    fileobj.save(path)
+    return job_id, path
+
+
+def discard_upload(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _run(job_id, path):
+    state = _read_state(job_id)
+    state.update(status='running', started_at=time.time(), pid=os.getpid())
+    _write_state(job_id, state)
+
+    _, problems_path = _paths(job_id)
+    seen_emails = set()
+    conn = None
+    try:
+        conn = checkout_connection()
+        with open(problems_path, 'w', newline='') as problems_file:
+            problems_file.write(','.join(REPORT_COLUMNS) + '\n')
+            for chunk in bulk_import.iter_chunks(path, CHUNK_SIZE):
+                prepared = bulk_import.prepare_users(chunk, row_offset=state['processed'])
+                bulk_import.insert_users(prepared, conn, seen_emails=seen_emails)
+
+                for key, n in bulk_import.summarize(prepared).items():
+                    state[key] += n
+                state['processed'] += len(prepared)
+
+                problems = prepared.loc[prepared['status'] != 'created', REPORT_COLUMNS]
+                problems.to_csv(problems_file, header=False, index=False)
+                room = PROBLEM_PREVIEW - len(state['problems'])
+                if room > 0:
+                    state['problems'].extend(problems.head(room).to_dict('records'))
+                _write_state(job_id, state)
+        state.update(status='done', finished_at=time.time(), total=state['processed'])
+    except Exception as e:
+        state.update(status='failed', finished_at=time.time(), error=str(e))
+    finally:
+        if conn is not None:
+            conn.close()
+        discard_upload(path)
+    _write_state(job_id, state)
+
+
+def start_import(job_id, path, filename):
+    """Queue a staged upload for import; returns its state dict."""
+    _prune()
+    state = {
+        'id': job_id, 'filename': filename,
+        'status': 'queued', 'queued_at': time.time(), 'pid': os.getpid(),
+        'total': _estimate_rows(path), 'processed': 0,
+        'created': 0, 'skipped': 0, 'failed': 0,
+        'problems': [],
+    }
+    _write_state(job_id, state)
+    _get_executor().submit(_run, job_id, path)
+    return state
+
+
+def job_status(job_id):
+    """Current state of an import job, or None if unknown."""
+    state = _read_state(job_id)
+    if state is None:
+        return None
+    if state['status'] in ('queued', 'running'):
+        stalled = state['status'] == 'running' and time.time() - state['updated_at'] > STALE_AFTER
+        if stalled or not _alive(state['pid']):
+            state['status'] = 'stale'
+    return state
+
+
+def _alive(pid):
+    """Whether the worker process that owns a job still exists (same host only)."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def problem_report(job_id):
+    """Path of the CSV listing every row that was not created, else None."""
+    _, problems_path = _paths(job_id)
+    return problems_path if os.path.exists(problems_path) else None
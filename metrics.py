@@ -0,0 +1,334 @@
+"""
+Per-endpoint request metrics in the Prometheus text format.
+
+Every request records, under its Flask endpoint name:
+  - latency (histogram) and a count per method/status
+  - statements run, time spent in them and rows they returned (through
+    db.query_hooks, so every pooled cursor counts)
+  - time spent waiting for a pooled connection (db.checkout_hooks)
+  - statements per request (histogram), which is what gives an N+1 away
+
+Queries run outside a request (flusher threads, report jobs) are counted
+under the endpoint `_background`.
+
+Each gunicorn worker keeps its own counters and a thread drops a snapshot
+of them into METRICS_DIR every SNAPSHOT_INTERVAL seconds; `/admin/metrics`
+merges the snapshots of every worker on the host, so whichever worker
+answers the scrape reports the whole host. Recording is a few dict
+updates under a lock, cheap enough to leave on.
+
+Environment:
+  METRICS          set to 0 to turn recording off
+  METRICS_DIR      where worker snapshots go (default /dev/shm/sac-metrics)
+  METRICS_TOKEN    bearer token that may scrape /admin/metrics without an
+                   admin session
+  METRICS_LOG      set to 1 to also log one JSON line per request
+  METRICS_LOG_MS   only log requests slower than this (default 0: all)
+"""
+
+import glob
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+import db
+
+ENABLED = os.environ.get('METRICS', '1') != '0'
+LOG = os.environ.get('METRICS_LOG') == '1'
+LOG_MS = float(os.environ.get('METRICS_LOG_MS', 0))
+TOKEN = os.environ.get('METRICS_TOKEN')
+SNAPSHOT_INTERVAL = 2
+STALE_AFTER = 3600
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BACKGROUND = '_background'
+
+
+def _default_dir():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'sac-metrics')
+
+
+METRICS_DIR = os.environ.get('METRICS_DIR') or _default_dir()
+
+logger = logging.getLogger('sac.metrics')
+
+_lock = threading.Lock()
+# endpoint -> counters; see _new_endpoint()
+_endpoints = {}
+# (endpoint, method, status) -> requests
+_statuses = {}
+_pid = None
+_dirty = False
+_snapshotter = None
+_snapshotter_pid = None
+
+
+def _new_endpoint():
+    return {
+        'requests': 0,
+        'seconds': 0.0,
+        'latency': [0] * (len(LATENCY_BUCKETS) + 1),
+        'queries': 0,
+        'db_seconds': 0.0,
+        'rows': 0,
+        'wait_seconds': 0.0,
+        'queries_per_request': [0] * (len(QUERY_BUCKETS) + 1),
+    }
+
+
+def _bucket(buckets, value):
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            return i
+    return len(buckets)
+
+
+def _reset_if_forked():
+    # counters inherited from the master would be reported twice
+    global _pid
+    if _pid != os.getpid():
+        _endpoints.clear()
+        _statuses.clear()
+        _pid = os.getpid()
+
+
+# --------------------
+# Recording
+# --------------------
+def _on_query(cursor, query, vars, seconds):
+    global _dirty
+    rows = cursor.rowcount if cursor.description is not None and cursor.rowcount > 0 else 0
+    current = g.get('_metrics') if has_request_context() else None
+    if current is not None:
+        current['queries'] += 1
+        current['db_seconds'] += seconds
+        current['rows'] += rows
+        return
+    with _lock:
+        _reset_if_forked()
+        _dirty = True
+        stats = _endpoints.get(BACKGROUND) or _endpoints.setdefault(BACKGROUND, _new_endpoint())
+        stats['queries'] += 1
+        stats['db_seconds'] += seconds
+        stats['rows'] += rows
+
+
+def _on_checkout(seconds):
+    current = g.get('_metrics') if has_request_context() else None
+    if current is not None:
+        current['wait_seconds'] += seconds
+
+
+def _start_request():
+    _ensure_snapshotter()
+    g._metrics = {'started': time.perf_counter(), 'queries': 0, 'db_seconds': 0.0,
+                  'rows': 0, 'wait_seconds': 0.0, 'status': 500}
+
+
+def _note_status(response):
+    current = g.get('_metrics')
+    if current is not None:
+        current['status'] = response.status_code
+    return response
+
+
+def _finish_request(exc=None):
+    current = g.pop('_metrics', None)
+    if current is None:
+        return
+    global _dirty
+    seconds = time.perf_counter() - current['started']
+    endpoint = request.endpoint or '_unmatched'
+    with _lock:
+        _dirty = True
+        _reset_if_forked()
+        stats = _endpoints.get(endpoint) or _endpoints.setdefault(endpoint, _new_endpoint())
+        stats['requests'] += 1
+        stats['seconds'] += seconds
+        stats['latency'][_bucket(LATENCY_BUCKETS, seconds)] += 1
+        stats['queries'] += current['queries']
+        stats['db_seconds'] += current['db_seconds']
+        stats['rows'] += current['rows']
+        stats['wait_seconds'] += current['wait_seconds']
+        stats['queries_per_request'][_bucket(QUERY_BUCKETS, current['queries'])] += 1
+        key = (endpoint, request.method, current['status'])
+        _statuses[key] = _statuses.get(key, 0) + 1
+    if LOG and seconds * 1000 >= LOG_MS:
+        logger.info(json.dumps({
+            'endpoint': endpoint, 'method': request.method, 'status': current['status'],
+            'ms': round(seconds * 1000, 2), 'db_ms': round(current['db_seconds'] * 1000, 2),
+            'queries': current['queries'], 'rows': current['rows'],
+            'wait_ms': round(current['wait_seconds'] * 1000, 2),
+        }))
+
+
+# --------------------
+# Snapshots (one file per worker)
+# --------------------
+def _snapshot():
+    global _dirty
+    with _lock:
+        _reset_if_forked()
+        _dirty = False
+        data = {
+            'endpoints': {name: dict(stats, latency=list(stats['latency']),
+                                     queries_per_request=list(stats['queries_per_request']))
+                          for name, stats in _endpoints.items()},
+            'statuses': [[e, m, s, n] for (e, m, s), n in _statuses.items()],
+        }
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f'{os.getpid()}.json')
+    tmp = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _run_snapshotter():
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL)
+        try:
+            if _dirty:
+                _snapshot()
+        except OSError:
+            pass  # try again next round
+
+
+def _ensure_snapshotter():
+    """Start this process's snapshot thread if it isn't running (e.g. after fork)."""
+    global _snapshotter, _snapshotter_pid
+    if _snapshotter is not None and _snapshotter_pid == os.getpid() and _snapshotter.is_alive():
+        return
+    with _lock:
+        if _snapshotter is None or _snapshotter_pid != os.getpid() or not _snapshotter.is_alive():
+            _snapshotter = threading.Thread(target=_run_snapshotter, name='metrics', daemon=True)
+            _snapshotter.start()
+            _snapshotter_pid = os.getpid()
+
+
+def _alive(path):
+    try:
+        os.kill(int(os.path.basename(path).split('.')[0]), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge():
+    """Every worker's snapshot (this one's fresh) summed."""
+    _snapshot()
+    endpoints, statuses, workers = {}, {}, 0
+    cutoff = time.time() - STALE_AFTER
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        try:
+            if os.path.getmtime(path) < cutoff and not _alive(path):
+                os.remove(path)  # a worker that exited long ago
+                continue
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        workers += 1
+        for name, stats in data['endpoints'].items():
+            total = endpoints.setdefault(name, _new_endpoint())
+            for key, value in stats.items():
+                if isinstance(value, list):
+                    total[key] = [a + b for a, b in zip(total[key], value)]
+                else:
+                    total[key] += value
+        for endpoint, method, status, n in data['statuses']:
+            key = (endpoint, method, status)
+            statuses[key] = statuses.get(key, 0) + n
+    return endpoints, statuses, workers
+
+
+# --------------------
+# Prometheus text format
+# --------------------
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram(lines, name, help_text, buckets, per_endpoint, key, sum_key=None):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for endpoint, stats in per_endpoint:
+        counts, running = stats[key], 0
+        labels = f'endpoint="{_label(endpoint)}"'
+        for bound, count in zip(buckets, counts):
+            running += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {running}')
+        running += counts[-1]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {running}')
+        total = stats[sum_key] if sum_key else 0
+        lines.append(f'{name}_sum{{{labels}}} {total}')
+        lines.append(f'{name}_count{{{labels}}} {running}')
+
+
+def render():
+    """The host's metrics as Prometheus exposition text."""
+    endpoints, statuses, workers = _merge()
+    per_endpoint = sorted(endpoints.items())
+    requests = [(e, s) for e, s in per_endpoint if e != BACKGROUND]
+    lines = [
+        '# HELP sac_metrics_workers Worker snapshots merged into this scrape.',
+        '# TYPE sac_metrics_workers gauge',
+        f'sac_metrics_workers {workers}',
+        '# HELP sac_http_requests_total Requests by endpoint, method and status.',
+        '# TYPE sac_http_requests_total counter',
+    ]
+    for (endpoint, method, status), n in sorted(statuses.items()):
+        lines.append(f'sac_http_requests_total{{endpoint="{_label(endpoint)}",'
+                     f'method="{method}",status="{status}"}} {n}')
+    _histogram(lines, 'sac_http_request_duration_seconds', 'Request latency.',
+               LATENCY_BUCKETS, requests, 'latency', 'seconds')
+    # the sum of statements per request is the query total
+    _histogram(lines, 'sac_db_queries_per_request', 'Statements run by one request.',
+               QUERY_BUCKETS, requests, 'queries_per_request', 'queries')
+    for name, key, kind, help_text in (
+        ('sac_db_queries_total', 'queries', 'counter', 'Statements run.'),
+        ('sac_db_query_seconds_total', 'db_seconds', 'counter', 'Time spent in statements.'),
+        ('sac_db_rows_total', 'rows', 'counter', 'Rows returned by statements.'),
+        ('sac_db_checkout_wait_seconds_total', 'wait_seconds', 'counter',
+         'Time spent waiting for a pooled connection.'),
+    ):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for endpoint, stats in per_endpoint:
+            lines.append(f'{name}{{endpoint="{_label(endpoint)}"}} {stats[key]}')
+    return '\n'.join(lines) + '\n'
+
+
+def authorized(session):
+    """Admin session, or the scrape token as `Authorization: Bearer ...`."""
+    if session.get('role') == 'admin':
+        return True
+    header = request.headers.get('Authorization', '')
+    return bool(TOKEN) and hmac.compare_digest(header, f'Bearer {TOKEN}')
+
+
+def init_app(app):
+    if not ENABLED:
+        return
+    if LOG and not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    if _on_query not in db.query_hooks:
+        db.query_hooks.append(_on_query)
+        db.checkout_hooks.append(_on_checkout)
+    app.before_request(_start_request)
+    app.after_request(_note_status)
+    app.teardown_request(_finish_request)
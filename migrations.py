@@ -0,0 +1,328 @@
+"""
+Versioned schema migrations for the Postgres (Neon) database.
+
+Usage:
+  python migrations.py status      # show applied / pending versions
+  python migrations.py upgrade     # apply every pending migration
+
+Applied versions are recorded in `schema_migrations`, so web workers never
+run DDL on boot; the Procfile `release` phase runs `upgrade` once per deploy.
+
+Adding a migration: append a new `Migration` to MIGRATIONS with the next
+version number. Never edit one that has already shipped.
+"""
+
+import argparse
+import os
+import re
+from collections import namedtuple
+
+from dotenv import load_dotenv
+import psycopg2
+
+load_dotenv()
+
+# transactional=False runs each statement in autocommit mode, which
+# CREATE INDEX CONCURRENTLY requires. A statement may also be a callable
+# taking the connection, for data migrations that need Python.
+Migration = namedtuple('Migration', 'version name statements transactional')
+
+# Arbitrary key so two deploys can't migrate at the same time.
+LOCK_KEY = 7301452
+
+MIGRATIONS = [
+    Migration(1, 'initial schema', [
+        '''CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                name TEXT,
+                email TEXT UNIQUE,
+                mobile TEXT,
+                password TEXT,
+                role TEXT
+            )''',
+        '''CREATE TABLE IF NOT EXISTS exams (
+                id SERIAL PRIMARY KEY,
+                title TEXT,
+                duration INTEGER,
+                created_by INTEGER,
+                attempts_allowed INTEGER DEFAULT 1
+            )''',
+        '''CREATE TABLE IF NOT EXISTS questions (
+                id SERIAL PRIMARY KEY,
+                exam_id INTEGER,
+                question TEXT,
+                image TEXT,
+                option1 TEXT,
+                option2 TEXT,
+                option3 TEXT,
+                option4 TEXT,
+                answer TEXT
+            )''',
+        '''CREATE TABLE IF NOT EXISTS submissions (
+                id SERIAL PRIMARY KEY,
+                exam_id INTEGER,
+                student_id INTEGER,
+                answers TEXT,
+                score INTEGER,
+                attempt_number INTEGER DEFAULT 1,
+                submitted_at TIMESTAMP
+            )''',
+        # Older databases predate these columns.
+        'ALTER TABLE exams ADD COLUMN IF NOT EXISTS attempts_allowed INTEGER DEFAULT 1',
+        'ALTER TABLE submissions ADD COLUMN IF NOT EXISTS attempt_number INTEGER DEFAULT 1',
+        'ALTER TABLE submissions ADD COLUMN IF NOT EXISTS time_taken INTEGER',
+        # default accounts
+        '''INSERT INTO users (name,email,mobile,password,role)
+           SELECT * FROM (VALUES
+               ('Admin','admin@example.com','9999999999','admin123','admin'),
+               ('Mediator1','mediator@example.com','8888888888','mediator123','mediator'),
+               ('Student1','student@example.com','7777777777','student123','student')
+           ) AS v(name,email,mobile,password,role)
+           WHERE NOT EXISTS (SELECT 1 FROM users)''',
+    ], True),
+    Migration(2, 'hot-path indexes', [
+        # attempt counts / dashboard / take_exam
+        '''CREATE INDEX CONCURRENTLY IF NOT EXISTS submissions_exam_student_idx
+           ON submissions (exam_id, student_id)''',
+        # leaderboard order: score DESC, time_taken ASC NULLS LAST, submitted_at ASC
+        '''CREATE INDEX CONCURRENTLY IF NOT EXISTS submissions_leaderboard_idx
+           ON submissions (exam_id, score DESC, time_taken ASC NULLS LAST, submitted_at ASC)''',
+        '''CREATE INDEX CONCURRENTLY IF NOT EXISTS questions_exam_id_idx
+           ON questions (exam_id, id)''',
+        '''CREATE INDEX CONCURRENTLY IF NOT EXISTS users_role_idx
+           ON users (role)''',
+    ], False),
+    Migration(3, 'student dashboard index', [
+        # get_student_exams groups one student's submissions by exam
+        '''CREATE INDEX CONCURRENTLY IF NOT EXISTS submissions_student_exam_idx
+           ON submissions (student_id, exam_id)''',
+    ], False),
+    Migration(4, 'exam content version', [
+        # bumped on every edit; exam_cache.py revalidates against it
+        'ALTER TABLE exams ADD COLUMN IF NOT EXISTS content_version INTEGER NOT NULL DEFAULT 1',
+    ], True),
+    Migration(5, 'compact answer codes', [
+        # one byte per question, see grading.py
+        'ALTER TABLE submissions ADD COLUMN IF NOT EXISTS answer_codes BYTEA',
+    ], True),
+    Migration(6, 'backfill answer codes', [
+        lambda conn: _backfill_answer_codes(conn),
+    ], False),
+    Migration(7, 'keyset pagination indexes', [
+        # admin_submissions: submitted_at DESC NULLS LAST, id DESC
+        '''CREATE INDEX CONCURRENTLY IF NOT EXISTS submissions_recent_idx
+           ON submissions (submitted_at DESC NULLS LAST, id DESC)''',
+        # leaderboard keyset needs the id tiebreaker in the index
+        '''CREATE INDEX CONCURRENTLY IF NOT EXISTS submissions_leaderboard_keyset_idx
+           ON submissions (exam_id, score DESC, time_taken ASC NULLS LAST, submitted_at ASC, id ASC)''',
+        '''CREATE INDEX CONCURRENTLY IF NOT EXISTS submissions_leaderboard_all_idx
+           ON submissions (score DESC, time_taken ASC NULLS LAST, submitted_at ASC, id ASC)''',
+        'DROP INDEX CONCURRENTLY IF EXISTS submissions_leaderboard_idx',
+    ], False),
+    Migration(8, 'submission tokens', [
+        # submission_queue.py flushes with ON CONFLICT (submit_token) DO NOTHING,
+        # so a batch replayed after a crash can't insert twice
+        'ALTER TABLE submissions ADD COLUMN IF NOT EXISTS submit_token TEXT',
+        '''CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS submissions_submit_token_key
+           ON submissions (submit_token)''',
+    ], False),
+    Migration(9, 'unique attempt numbers', [
+        # concurrent submits used to be able to reuse an attempt number;
+        # renumber those in submission order before enforcing uniqueness
+        '''UPDATE submissions s SET attempt_number = r.rn
+           FROM (SELECT id, row_number() OVER (PARTITION BY exam_id, student_id
+                                               ORDER BY submitted_at NULLS LAST, id) AS rn
+                 FROM submissions) r
+           WHERE s.id = r.id AND s.attempt_number IS DISTINCT FROM r.rn''',
+        '''CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS submissions_attempt_key
+           ON submissions (exam_id, student_id, attempt_number)''',
+        # the unique index leads with (exam_id, student_id) and replaces it
+        'DROP INDEX CONCURRENTLY IF EXISTS submissions_exam_student_idx',
+    ], False),
+    Migration(10, 'exam sessions', [
+        # server-side attempt clocks, written in batches by exam_sessions.py;
+        # token is the attempt's submit token
+        '''CREATE TABLE IF NOT EXISTS exam_sessions (
+                token TEXT PRIMARY KEY,
+                exam_id INTEGER NOT NULL,
+                student_id INTEGER NOT NULL,
+                started_at TIMESTAMP NOT NULL,
+                deadline TIMESTAMP NOT NULL,
+                last_seen TIMESTAMP,
+                heartbeats INTEGER NOT NULL DEFAULT 0,
+                finished_at TIMESTAMP
+            )''',
+        'CREATE INDEX IF NOT EXISTS exam_sessions_exam_idx ON exam_sessions (exam_id, student_id)',
+    ], True),
+    Migration(11, 'proctoring events', [
+        # bulk-written by proctor_events.py; (source, seq) identifies a row of
+        # one host's local log, so a replayed batch inserts nothing
+        '''CREATE TABLE IF NOT EXISTS proctor_events (
+                id BIGSERIAL PRIMARY KEY,
+                source TEXT NOT NULL,
+                seq BIGINT NOT NULL,
+                exam_id INTEGER NOT NULL,
+                student_id INTEGER NOT NULL,
+                submit_token TEXT,
+                kind SMALLINT NOT NULL,
+                client_at TIMESTAMP,
+                received_at TIMESTAMP NOT NULL,
+                UNIQUE (source, seq)
+            )''',
+        'CREATE INDEX IF NOT EXISTS proctor_events_exam_student_idx ON proctor_events (exam_id, student_id)',
+        # running totals per student, bumped by the same statement
+        '''CREATE TABLE IF NOT EXISTS proctor_counts (
+                exam_id INTEGER NOT NULL,
+                student_id INTEGER NOT NULL,
+                kind SMALLINT NOT NULL,
+                n INTEGER NOT NULL,
+                last_at TIMESTAMP,
+                PRIMARY KEY (exam_id, student_id, kind)
+            )''',
+    ], True),
+    Migration(12, 'drop lossy answer codes', [
+        # migration 6 also wrote codes for rows it kept the JSON of, and
+        # readers prefer the codes; clear every row that has both and let the
+        # backfill convert the lossless ones again
+        'UPDATE submissions SET answer_codes = NULL WHERE answer_codes IS NOT NULL AND answers IS NOT NULL',
+        lambda conn: _backfill_answer_codes(conn),
+    ], False),
+]
+
+
+def _backfill_answer_codes(conn):
+    from grading import backfill_answer_codes
+    backfill_answer_codes(conn)
+
+
+def _connect():
+    url = os.environ.get('DATABASE_URL')
+    if not url:
+        raise RuntimeError('DATABASE_URL not set')
+    return psycopg2.connect(url, sslmode=os.environ.get('DB_SSLMODE', 'require'))
+
+
+def _ensure_version_table(conn):
+    cur = conn.cursor()
+    cur.execute('''CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        name TEXT,
+                        applied_at TIMESTAMP DEFAULT NOW()
+                    )''')
+    conn.commit()
+    cur.close()
+
+
+def applied_versions(conn):
+    _ensure_version_table(conn)
+    cur = conn.cursor()
+    cur.execute('SELECT version FROM schema_migrations')
+    versions = {r[0] for r in cur.fetchall()}
+    conn.commit()
+    cur.close()
+    return versions
+
+
+def pending(conn):
+    done = applied_versions(conn)
+    return [m for m in MIGRATIONS if m.version not in done]
+
+
+_CONCURRENT_INDEX_RE = re.compile(
+    r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)', re.I)
+
+
+def _invalid_index(cur, name):
+    cur.execute('''
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace
+          AND NOT i.indisvalid
+    ''', (name,))
+    return cur.fetchone() is not None
+
+
+def _run(conn, cur, stmt):
+    if callable(stmt):
+        stmt(conn)
+        return
+    # A failed CREATE INDEX CONCURRENTLY leaves an INVALID index behind that
+    # IF NOT EXISTS would skip on the re-run, so drop it and build again.
+    match = _CONCURRENT_INDEX_RE.match(stmt.strip())
+    if match and _invalid_index(cur, match.group(1)):
+        cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}')
+    cur.execute(stmt)
+    if match and _invalid_index(cur, match.group(1)):
+        raise RuntimeError(f'index {match.group(1)} was left invalid')
+
+
+def _apply(conn, migration):
+    cur = conn.cursor()
+    if migration.transactional:
+        try:
+            for stmt in migration.statements:
+                _run(conn, cur, stmt)
+            cur.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s)',
+                        (migration.version, migration.name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+        return
+
+    # Each statement must be idempotent (IF NOT EXISTS) so a half-applied
+    # migration can simply be re-run.
+    conn.autocommit = True
+    try:
+        for stmt in migration.statements:
+            _run(conn, cur, stmt)
+        cur.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s)',
+                    (migration.version, migration.name))
+    finally:
+        conn.autocommit = False
+        cur.close()
+
+
+def upgrade(conn, verbose=True):
+    """Apply every pending migration in version order; returns versions applied."""
+    cur = conn.cursor()
+    cur.execute('SELECT pg_advisory_lock(%s)', (LOCK_KEY,))
+    conn.commit()
+    applied = []
+    try:
+        for migration in pending(conn):
+            if verbose:
+                print(f'Applying {migration.version}: {migration.name}')
+            _apply(conn, migration)
+            applied.append(migration.version)
+    finally:
+        cur.execute('SELECT pg_advisory_unlock(%s)', (LOCK_KEY,))
+        conn.commit()
+        cur.close()
+    return applied
+
+
+def status(conn):
+    done = applied_versions(conn)
+    for m in MIGRATIONS:
+        print(f"{m.version:>4}  {'applied' if m.version in done else 'pending':8}  {m.name}")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Run schema migrations')
+    p.add_argument('command', choices=['upgrade', 'status'])
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    conn = _connect()
+    try:
+        if args.command == 'upgrade':
+            applied = upgrade(conn)
+            print(f'Applied {len(applied)} migration(s).' if applied else 'Schema is up to date.')
+        else:
+            status(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,92 @@
+"""
+Keyset ("seek") pagination helpers for the admin list views.
+
+A page is fetched with `WHERE (sort key) after (last row's sort key)` and a
+LIMIT, so page N costs the same index walk as page 1 instead of an OFFSET
+scan. The position is carried between requests as an opaque `after` token:
+the last row's sort-key values plus how many rows came before, which keeps
+the S.No column right without counting.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+PAGE_SIZES = (10, 25, 50, 100, 250)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def page_size(value):
+    """Clamp a ?per_page= value to something sane."""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def _to_json(value):
+    if isinstance(value, datetime):
+        return {'ts': value.isoformat()}
+    return value
+
+
+def _from_json(value):
+    if isinstance(value, dict) and 'ts' in value:
+        return datetime.fromisoformat(value['ts'])
+    return value
+
+
+def encode_cursor(key, seen):
+    raw = json.dumps({'k': [_to_json(v) for v in key], 'n': seen}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _matches(key, types):
+    # bool is an int subclass, but never a sort-key value
+    return len(key) == len(types) and all(
+        isinstance(v, allowed) and not isinstance(v, bool) for v, allowed in zip(key, types))
+
+
+def decode_cursor(token, types=None):
+    """Return (key values, rows seen) or (None, 0) for a missing/garbled token.
+
+    `types` gives the allowed types of each key value, e.g.
+    [(datetime, type(None)), (int,)]; a key of the wrong length or types
+    counts as garbled too.
+    """
+    if not token:
+        return None, 0
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw)
+        key, seen = [_from_json(v) for v in data['k']], int(data['n'])
+    except (ValueError, KeyError, TypeError):
+        return None, 0
+    if seen < 0 or (types is not None and not _matches(key, types)):
+        return None, 0
+    return key, seen
+
+
+class Page:
+    """One page of rows plus what the template needs to link onwards."""
+
+    def __init__(self, rows, size, start, next_after=None, total=None):
+        self.rows = rows
+        self.size = size
+        self.start = start          # rows before this page
+        self.next_after = next_after
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_after is not None
+
+
+def build_page(rows, size, seen, key_fn):
+    """Trim the LIMIT size+1 probe row and compute the next cursor."""
+    has_more = len(rows) > size
+    rows = rows[:size]
+    next_after = encode_cursor(key_fn(rows[-1]), seen + len(rows)) if has_more and rows else None
+    return Page(rows, size, seen, next_after)
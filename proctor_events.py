@@ -0,0 +1,279 @@
+"""
+Proctoring events (focus loss, tab hides, copy/paste) from exam pages.
+
+take_exam.html buffers events and posts them in batches to the events
+endpoint, which appends each batch to a local SQLite log in one
+transaction; nothing touches Postgres per event. Rows are a handful of
+integers: the event type is a small code (KINDS), times are epoch floats.
+
+One flusher per host at a time (a lease in the log's `meta` table) moves
+the log to Postgres in bulk. A single statement per batch inserts the
+events into `proctor_events` and adds them to the per-student totals in
+`proctor_counts` (migration 11). Each log row is identified by
+(source, seq), the log's own id plus its row id, and inserts skip rows
+already present, so a batch replayed after a crash is neither stored nor
+counted twice. The high-water mark only advances after the commit.
+
+Admins read `proctor_counts` (see counts_for_exam); it trails the log by
+about INTERVAL seconds.
+
+Environment:
+  PROCTOR_EVENTS_PATH      SQLite file (default <tmp>/sac-proctor-events.db)
+  PROCTOR_EVENTS_BATCH     rows per flush (default 5000)
+  PROCTOR_EVENTS_INTERVAL  seconds between flushes (default 2)
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import psycopg2.extras
+
+from db import checkout_connection, get_db_connection
+
+PATH = os.environ.get('PROCTOR_EVENTS_PATH') or os.path.join(tempfile.gettempdir(), 'sac-proctor-events.db')
+BATCH_SIZE = int(os.environ.get('PROCTOR_EVENTS_BATCH', 5000))
+INTERVAL = float(os.environ.get('PROCTOR_EVENTS_INTERVAL', 2))
+RETENTION = 86400
+LEASE = 30
+MAX_EVENTS_PER_POST = 200
+# client clocks further off than this are not trusted
+MAX_CLOCK_SKEW = 3600
+
+# Codes are stored; never reorder, only append.
+KINDS = ('blur', 'focus', 'hidden', 'visible', 'copy', 'cut', 'paste', 'contextmenu', 'disqualified')
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    exam_id INTEGER NOT NULL,
+    student_id INTEGER NOT NULL,
+    token TEXT,
+    kind INTEGER NOT NULL,
+    client_at REAL,
+    received_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+'''
+
+FLUSH_SQL = '''
+    WITH v (source, seq, exam_id, student_id, submit_token, kind, client_at, received_at) AS (
+        VALUES %s
+    ), ins AS (
+        INSERT INTO proctor_events
+            (source, seq, exam_id, student_id, submit_token, kind, client_at, received_at)
+        SELECT * FROM v
+        ON CONFLICT (source, seq) DO NOTHING
+        RETURNING exam_id, student_id, kind, received_at
+    )
+    INSERT INTO proctor_counts (exam_id, student_id, kind, n, last_at)
+    SELECT exam_id, student_id, kind, COUNT(*), MAX(received_at)
+    FROM ins GROUP BY exam_id, student_id, kind
+    ORDER BY exam_id, student_id, kind
+    ON CONFLICT (exam_id, student_id, kind) DO UPDATE
+        SET n = proctor_counts.n + excluded.n,
+            last_at = GREATEST(proctor_counts.last_at, excluded.last_at)
+'''
+VALUES_TEMPLATE = ('(%s::text, %s::bigint, %s::int, %s::int, %s::text, %s::smallint, '
+                   '%s::timestamp, %s::timestamp)')
+
+_local = threading.local()
+_lock = threading.Lock()
+_flusher = None
+_flusher_pid = None
+_last_error = None
+
+
+class EventError(ValueError):
+    """An events payload that can't be recorded."""
+
+
+def _sqlite():
+    """This thread's connection to the event log."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(PATH, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        conn.execute("INSERT OR IGNORE INTO meta VALUES ('source', ?)", (uuid.uuid4().hex,))
+        conn.execute("INSERT OR IGNORE INTO meta VALUES ('flushed_id', 0)")
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+def _meta(conn, key):
+    return conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()[0]
+
+
+def parse_batch(payload, now=None):
+    """Validate {'token': ..., 'events': [{'type': ..., 't': epoch ms}, ...]}.
+
+    Returns (token, [(kind code, client time or None), ...]).
+    """
+    if not isinstance(payload, dict):
+        raise EventError('expected a JSON object')
+    token, events = payload.get('token'), payload.get('events')
+    if not isinstance(token, str) or not isinstance(events, list):
+        raise EventError('token and events are required')
+    if len(events) > MAX_EVENTS_PER_POST:
+        raise EventError(f'at most {MAX_EVENTS_PER_POST} events per batch')
+    now = now or time.time()
+    parsed = []
+    for event in events:
+        if not isinstance(event, dict) or event.get('type') not in KIND_CODES:
+            raise EventError('unknown event type')
+        at = event.get('t')
+        at = at / 1000 if isinstance(at, (int, float)) and not isinstance(at, bool) else None
+        if at is not None and abs(at - now) > MAX_CLOCK_SKEW:
+            at = None
+        parsed.append((KIND_CODES[event['type']], at))
+    return token, parsed
+
+
+def record(exam_id, student_id, token, events):
+    """Append (kind code, client time) events to the local log in one transaction."""
+    if not events:
+        return
+    now = time.time()
+    conn = _sqlite()
+    conn.execute('BEGIN')
+    try:
+        conn.executemany('''
+            INSERT INTO events (exam_id, student_id, token, kind, client_at, received_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(exam_id, student_id, token, kind, at, now) for kind, at in events])
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def _take_lease(conn):
+    """Become this host's flusher for LEASE seconds; False if another one is."""
+    now, owner = time.time(), os.getpid()
+    cur = conn.execute('''
+        INSERT INTO meta VALUES ('lease', ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        WHERE json_extract(meta.value, '$.owner') = ? OR json_extract(meta.value, '$.until') < ?
+    ''', (json.dumps({'owner': owner, 'until': now + LEASE}), owner, now))
+    return cur.rowcount == 1
+
+
+def flush(limit=BATCH_SIZE):
+    """Copy one batch of the log to Postgres; returns rows handled."""
+    conn = _sqlite()
+    if not _take_lease(conn):
+        return 0
+    source, flushed_id = _meta(conn, 'source'), _meta(conn, 'flushed_id')
+    rows = conn.execute('''
+        SELECT id, exam_id, student_id, token, kind, client_at, received_at
+        FROM events WHERE id > ? ORDER BY id LIMIT ?
+    ''', (flushed_id, limit)).fetchall()
+    if not rows:
+        return 0
+
+    def ts(v):
+        return datetime.fromtimestamp(v) if v is not None else None
+
+    values = [(source, seq, exam_id, student_id, token, kind, ts(client_at), ts(received_at))
+              for seq, exam_id, student_id, token, kind, client_at, received_at in rows]
+    pg = checkout_connection()
+    try:
+        cur = pg.cursor()
+        psycopg2.extras.execute_values(cur, FLUSH_SQL, values, template=VALUES_TEMPLATE,
+                                       page_size=len(values))
+        pg.commit()
+        cur.close()
+    except Exception:
+        pg.rollback()
+        raise
+    finally:
+        pg.close()
+    # MAX: a flusher that outlived its lease must not move the mark back
+    conn.execute("UPDATE meta SET value = MAX(value, ?) WHERE key = 'flushed_id'", (rows[-1][0],))
+    return len(rows)
+
+
+def purge():
+    """Drop flushed rows older than RETENTION."""
+    conn = _sqlite()
+    conn.execute('DELETE FROM events WHERE id <= ? AND received_at < ?',
+                 (_meta(conn, 'flushed_id'), time.time() - RETENTION))
+
+
+def _run_flusher():
+    global _last_error
+    last_purge = 0
+    while True:
+        time.sleep(INTERVAL)
+        try:
+            while flush() >= BATCH_SIZE:
+                pass
+            if time.time() - last_purge > 600:
+                purge()
+                last_purge = time.time()
+        except Exception as e:  # keep the thread alive; the log keeps the rows
+            _last_error = f'{datetime.now():%Y-%m-%d %H:%M:%S} {e}'
+
+
+def ensure_flusher():
+    """Start this process's flusher thread if it isn't running (e.g. after fork)."""
+    global _flusher, _flusher_pid
+    if _flusher is not None and _flusher_pid == os.getpid() and _flusher.is_alive():
+        return
+    with _lock:
+        if _flusher is None or _flusher_pid != os.getpid() or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_run_flusher, name='proctor-events', daemon=True)
+            _flusher.start()
+            _flusher_pid = os.getpid()
+
+
+def counts_for_exam(exam_id):
+    """Per-student totals for an exam: [{name, email, student_id, counts: {kind: n}, last_at}]."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT c.student_id, u.name, u.email, c.kind, c.n, c.last_at
+        FROM proctor_counts c
+        LEFT JOIN users u ON u.id = c.student_id
+        WHERE c.exam_id = %s
+        ORDER BY u.name, c.student_id
+    ''', (exam_id,))
+    students = {}
+    for student_id, name, email, kind, n, last_at in cur.fetchall():
+        row = students.setdefault(student_id, {
+            'student_id': student_id, 'name': name, 'email': email, 'counts': {}, 'last_at': None})
+        row['counts'][KINDS[kind] if kind < len(KINDS) else str(kind)] = n
+        if last_at and (row['last_at'] is None or last_at > row['last_at']):
+            row['last_at'] = last_at
+    cur.close()
+    conn.close()
+    return list(students.values())
+
+
+def stats():
+    conn = _sqlite()
+    flushed_id = _meta(conn, 'flushed_id')
+    row = conn.execute('SELECT COUNT(*), MAX(id), MIN(received_at) FROM events WHERE id > ?',
+                       (flushed_id,)).fetchone()
+    return {
+        'path': PATH,
+        'unflushed': row[0],
+        'oldest_unflushed_seconds': round(time.time() - row[2], 3) if row[2] else None,
+        'flushed_id': flushed_id,
+        'flusher_alive': bool(_flusher and _flusher_pid == os.getpid() and _flusher.is_alive()),
+        'last_error': _last_error,
+    }
+
+
+def init_app(app):
+    app.before_request(ensure_flusher)
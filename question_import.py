@@ -0,0 +1,182 @@
+"""
+Bulk question import for an exam from a CSV/XLSX sheet plus an optional image zip.
+
+The sheet has one question per row: `question`, `option1`..`option4`,
+`answer` and an optional `image` naming a file inside the zip. `answer` may
+be the option text (what the create-exam form takes), the option number
+1-4, or a letter A-D; it is stored as the option text because that is what
+grading compares against.
+
+The whole sheet is validated with column operations and imported all or
+nothing: one bad row rejects the file and every problem is reported. The
+questions then go in with a single COPY, in sheet order (so question ids
+follow the sheet), and the referenced images are pulled out of the zip in
+one pass over its directory into the image store (see image_store.py).
+"""
+
+import io
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+import image_store
+
+OPTION_COLUMNS = ['option1', 'option2', 'option3', 'option4']
+REQUIRED_COLUMNS = ['question'] + OPTION_COLUMNS + ['answer']
+QUESTION_COLUMNS = ['question', 'image'] + OPTION_COLUMNS + ['answer']
+# headers people tend to write instead
+ALIASES = {'opt1': 'option1', 'opt2': 'option2', 'opt3': 'option3', 'opt4': 'option4',
+           'question_text': 'question', 'correct': 'answer', 'correct_answer': 'answer'}
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+MAX_IMAGE_BYTES = int(os.environ.get('QUESTION_IMAGE_MAX_BYTES', 5 * 1024 * 1024))
+MAX_QUESTIONS = int(os.environ.get('QUESTION_IMPORT_MAX', 20000))
+
+
+class QuestionImportError(ValueError):
+    """The sheet or zip can't be imported; `problems` lists (row, reason)."""
+
+    def __init__(self, message, problems=()):
+        super().__init__(message)
+        self.problems = list(problems)
+
+
+def read_sheet(fileobj, filename):
+    """Read a CSV/XLS/XLSX upload into a str DataFrame with normalized headers."""
+    if filename.lower().endswith('.csv'):
+        df = pd.read_csv(fileobj, dtype=str, keep_default_na=False)
+    else:
+        df = pd.read_excel(fileobj, dtype=str, keep_default_na=False)
+    df.columns = [ALIASES.get(c, c) for c in (str(c).strip().lower() for c in df.columns)]
+    return df
+
+
+def _zip_images(zip_file):
+    """(ZipFile, {basename: ZipInfo}) for the image files in an uploaded zip."""
+    try:
+        archive = zipfile.ZipFile(zip_file)
+    except zipfile.BadZipFile:
+        raise QuestionImportError('Image archive is not a valid zip file')
+    images = {}
+    for info in archive.infolist():
+        name = os.path.basename(info.filename)
+        if info.is_dir() or not name or name.startswith('.'):
+            continue
+        if name.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS:
+            images[name] = info
+    return archive, images
+
+
+def prepare_questions(df, image_names=()):
+    """Validate a sheet; returns (questions DataFrame, [(row, reason), ...]).
+
+    Rows are numbered as in the spreadsheet (the header is row 1).
+    """
+    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if missing:
+        raise QuestionImportError(f"Missing required column: {', '.join(missing)}")
+    if len(df) > MAX_QUESTIONS:
+        raise QuestionImportError(f'Too many questions ({len(df)}); the limit is {MAX_QUESTIONS}')
+
+    out = pd.DataFrame(index=df.index)
+    for col in QUESTION_COLUMNS:
+        values = df[col] if col in df.columns else pd.Series('', index=df.index)
+        out[col] = values.astype('string').fillna('').str.strip()
+    rows = np.arange(2, len(df) + 2)
+
+    # drop fully blank lines (trailing rows in spreadsheets)
+    blank = (out[REQUIRED_COLUMNS] == '').all(axis=1).to_numpy()
+    out, rows = out[~blank], rows[~blank]
+
+    options = out[OPTION_COLUMNS].to_numpy(dtype=object)
+    answer = out['answer'].to_numpy(dtype=object)
+    upper = out['answer'].str.upper().to_numpy(dtype=object)
+
+    # which option the answer names: by text first, then 1-4 / A-D
+    by_text = options == answer[:, None]
+    by_number = np.array(['1', '2', '3', '4'], dtype=object) == upper[:, None]
+    by_letter = np.array(['A', 'B', 'C', 'D'], dtype=object) == upper[:, None]
+    chosen = np.where(by_text.any(axis=1), by_text.argmax(axis=1),
+             np.where(by_number.any(axis=1), by_number.argmax(axis=1),
+             np.where(by_letter.any(axis=1), by_letter.argmax(axis=1), -1)))
+
+    empty = (out[REQUIRED_COLUMNS] == '').to_numpy()
+    checks = [
+        (empty.any(axis=1),
+         lambda i: 'missing ' + ', '.join(c for c, e in zip(REQUIRED_COLUMNS, empty[i]) if e)),
+        (~empty.any(axis=1) & (chosen < 0),
+         lambda i: f'answer "{answer[i]}" matches none of the options'),
+    ]
+    image = out['image'].to_numpy(dtype=object)
+    known = set(image_names)
+    no_image = (image != '') & ~np.isin(image, list(known))
+    checks.append((no_image, lambda i: f'image "{image[i]}" is not in the zip'))
+
+    problems = []
+    for mask, reason in checks:
+        problems.extend((int(rows[i]), reason(i)) for i in np.flatnonzero(mask))
+    problems.sort()
+
+    safe = np.clip(chosen, 0, 3)
+    out['answer'] = options[np.arange(len(out)), safe] if len(out) else out['answer']
+    return out, problems
+
+
+def _save_images(archive, images, wanted, stored):
+    """Extract the referenced images in one pass, filling {sheet name: stored name}."""
+    for name in sorted(wanted):
+        info = images[name]
+        if info.file_size > MAX_IMAGE_BYTES:
+            raise QuestionImportError(f'Image "{name}" is larger than {MAX_IMAGE_BYTES // 1024} KB')
+        with archive.open(info) as src:
+            data = src.read(MAX_IMAGE_BYTES + 1)
+        if len(data) > MAX_IMAGE_BYTES:
+            raise QuestionImportError(f'Image "{name}" is larger than {MAX_IMAGE_BYTES // 1024} KB')
+        stored[name] = image_store.save_image(data, name)
+
+
+def import_exam(conn, exam, sheet, images_zip):
+    """Create an exam and its questions from an uploaded sheet (+ image zip).
+
+    `exam` is (title, duration, created_by, attempts_allowed). Returns
+    (exam id, question count); raises QuestionImportError with the problems found,
+    in which case nothing was written.
+    """
+    archive, images = _zip_images(images_zip) if images_zip is not None else (None, {})
+    questions, problems = prepare_questions(sheet, images)
+    if problems:
+        raise QuestionImportError(f'{len(problems)} row(s) need fixing; nothing was imported', problems)
+    if questions.empty:
+        raise QuestionImportError('The file has no questions')
+
+    cur = conn.cursor()
+    saved = {}
+    try:
+        cur.execute(
+            "INSERT INTO exams (title,duration,created_by,attempts_allowed) VALUES (%s,%s,%s,%s) RETURNING id",
+            exam
+        )
+        exam_id = cur.fetchone()[0]
+
+        wanted = set(questions['image']) - {''}
+        _save_images(archive, images, wanted, saved)
+        questions['image'] = questions['image'].map(saved).fillna('').astype('string')
+        questions.insert(0, 'exam_id', exam_id)
+
+        buf = io.StringIO()
+        questions.replace({'': None}).to_csv(buf, header=False, index=False)
+        buf.seek(0)
+        cur.copy_expert(
+            'COPY questions (exam_id, question, image, option1, option2, option3, option4, answer) '
+            'FROM STDIN WITH (FORMAT csv)',
+            buf)
+        conn.commit()
+    except Exception:
+        # stored images are shared by content, so they stay even if unused
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return exam_id, len(questions)
@@ -0,0 +1,204 @@
+"""
+Background leaderboard report jobs with on-disk artifact caching.
+
+A report is identified by (format, exam id, submissions high-water mark),
+where the high-water mark is the exam's MAX(submission id), COUNT and
+content_version. The job id is a hash of that key, so:
+
+  - asking again while nothing changed returns the finished file at once,
+  - any gunicorn worker can answer status/download for a job another
+    worker started (state lives in REPORT_DIR, not in memory).
+
+Jobs run on a small per-worker thread pool. A job whose worker died shows
+up as `running` past REPORT_STALE_AFTER and is simply started again.
+
+Environment:
+  REPORT_DIR          where artifacts and job files live
+  REPORT_WORKERS      threads per gunicorn worker (default 2)
+  REPORT_TTL          seconds before unused artifacts are pruned (default 1 day)
+  REPORT_STALE_AFTER  seconds before a running job is presumed dead (default 900)
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db import get_db_connection
+import exports
+
+REPORT_DIR = os.environ.get('REPORT_DIR') or os.path.join(tempfile.gettempdir(), 'sac-reports')
+WORKERS = int(os.environ.get('REPORT_WORKERS', 2))
+TTL = float(os.environ.get('REPORT_TTL', 86400))
+STALE_AFTER = float(os.environ.get('REPORT_STALE_AFTER', 900))
+
+FORMATS = {
+    'pdf': ('application/pdf', exports.write_leaderboard_pdf),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+             exports.write_leaderboard_xlsx),
+    'csv': ('text/csv', exports.write_leaderboard_csv),
+}
+
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='report')
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def high_water_mark(exam_id=None):
+    """(max submission id, submission count, exam content_version) for the report's scope."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    if exam_id:
+        cur.execute('''
+            SELECT COALESCE(MAX(s.id), 0), COUNT(s.id),
+                   (SELECT content_version FROM exams WHERE id = %s)
+            FROM submissions s WHERE s.exam_id = %s
+        ''', (exam_id, exam_id))
+    else:
+        cur.execute('''
+            SELECT COALESCE(MAX(id), 0), COUNT(*),
+                   (SELECT COALESCE(SUM(content_version), 0) FROM exams)
+            FROM submissions
+        ''')
+    mark = cur.fetchone()
+    cur.close()
+    conn.close()
+    return list(mark)
+
+
+def _job_id(fmt, exam_id, mark, generation):
+    raw = json.dumps([fmt, exam_id, mark, generation])
+    return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+
+def _paths(job_id):
+    return (os.path.join(REPORT_DIR, f'{job_id}.json'),
+            os.path.join(REPORT_DIR, f'{job_id}.out'))
+
+
+def _write_state(job_id, state):
+    meta_path, _ = _paths(job_id)
+    tmp = f'{meta_path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, meta_path)
+
+
+def _read_state(job_id):
+    meta_path, _ = _paths(job_id)
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _generation(exam_id):
+    """Bumped by invalidate() for changes the high-water mark can't see (re-grades)."""
+    try:
+        with open(os.path.join(REPORT_DIR, f'gen-{exam_id or "all"}')) as f:
+            return int(f.read() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def invalidate(exam_id=None):
+    """Forget cached reports for an exam (and the all-exams report)."""
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    for scope in {exam_id or 'all', 'all'}:
+        path = os.path.join(REPORT_DIR, f'gen-{scope}')
+        gen = _generation(None if scope == 'all' else scope) + 1
+        with open(path, 'w') as f:
+            f.write(str(gen))
+
+
+def _prune():
+    cutoff = time.time() - TTL
+    for name in os.listdir(REPORT_DIR):
+        if name.startswith('gen-'):
+            continue
+        path = os.path.join(REPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _run(job_id, fmt, exam_id):
+    _, out_path = _paths(job_id)
+    state = _read_state(job_id) or {}
+    state.update(status='running', started_at=time.time(), pid=os.getpid())
+    _write_state(job_id, state)
+    writer = FORMATS[fmt][1]
+    tmp = f'{out_path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            writer(f, exam_id)
+        os.replace(tmp, out_path)
+        state.update(status='done', finished_at=time.time(), size=os.path.getsize(out_path))
+    except Exception as e:
+        state.update(status='failed', finished_at=time.time(), error=str(e))
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+    _write_state(job_id, state)
+
+
+def start_report(fmt, exam_id=None):
+    """Start (or reuse) a report job; returns its state dict."""
+    if fmt not in FORMATS:
+        raise ValueError(f'unknown report format: {fmt}')
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    job_id = _job_id(fmt, exam_id, high_water_mark(exam_id), _generation(exam_id))
+    state = job_status(job_id)
+    if state and state['status'] in ('queued', 'running', 'done'):
+        return state
+
+    _prune()
+    state = {
+        'id': job_id, 'format': fmt, 'exam_id': exam_id,
+        'status': 'queued', 'queued_at': time.time(),
+    }
+    _write_state(job_id, state)
+    _get_executor().submit(_run, job_id, fmt, exam_id)
+    return state
+
+
+def job_status(job_id):
+    """Current state of a job, or None if unknown."""
+    state = _read_state(job_id)
+    if state is None:
+        return None
+    _, out_path = _paths(job_id)
+    if state['status'] == 'done' and not os.path.exists(out_path):
+        return None  # artifact pruned
+    if state['status'] in ('queued', 'running'):
+        since = state.get('started_at') or state.get('queued_at') or 0
+        if time.time() - since > STALE_AFTER:
+            state['status'] = 'stale'
+    return state
+
+
+def artifact(job_id):
+    """(path, mimetype, download name) for a finished job, else None."""
+    state = job_status(job_id)
+    if not state or state['status'] != 'done':
+        return None
+    _, out_path = _paths(job_id)
+    # touch so _prune() keeps artifacts that are still being downloaded
+    os.utime(out_path)
+    return out_path, FORMATS[state['format']][0], f"leaderboard.{state['format']}"
@@ -0,0 +1,136 @@
+"""
+Benchmark the bulk user import pipeline at several roster sizes.
+
+Usage:
+  - Set DATABASE_URL to a Postgres you can create a scratch schema in
+  - Run: python scripts/bench_bulk_import.py --rows 1000 10000 100000
+  - Or, without a database: python scripts/bench_bulk_import.py --validate-only
+
+This script:
+  - Generates a roster with a few bad, missing and duplicate rows mixed in
+  - Times vectorized validation and the COPY + INSERT ... ON CONFLICT step
+  - Optionally times the old per-row INSERT/COMMIT loop for comparison
+  - Works in a throwaway schema (default `bench_import`) that is dropped after
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import pandas as pd
+from dotenv import load_dotenv
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+load_dotenv()
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Benchmark bulk user import')
+    p.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    p.add_argument('--validate-only', action='store_true', help='Skip the database step')
+    p.add_argument('--legacy', action='store_true', help='Also time the old row-by-row loop (slow)')
+    p.add_argument('--schema', default='bench_import', help='Scratch schema name')
+    p.add_argument('--keep', action='store_true', help='Keep the scratch schema')
+    return p.parse_args()
+
+
+def make_roster(n, tag):
+    emails = [f'student{i}.{tag}@example.com' for i in range(n)]
+    passwords = ['pass123'] * n
+    for i in range(0, n, 97):
+        emails[i] = 'not-an-email'
+    for i in range(5, n, 101):
+        passwords[i] = None
+    for i in range(7, n, 211):
+        emails[i] = emails[i - 1]
+    return pd.DataFrame({
+        'Email': emails,
+        'Name': [f'Student {i}' for i in range(n)],
+        'Mobile': ['9' * 10] * n,
+        'Password': passwords,
+        'Role': ['student'] * n,
+    }).astype('string')
+
+
+def legacy_import(df, conn):
+    """The old admin_bulk_upload loop: one INSERT and COMMIT per row."""
+    cur = conn.cursor()
+    df = df.replace({pd.NA: None, 'nan': None, 'NaN': None})
+    df.columns = [c.strip().lower() for c in df.columns]
+    created = 0
+    for _, row in df.iterrows():
+        email = str(row.get('email') or '').strip()
+        password = str(row.get('password') or '').strip()
+        if not email or not password or '@' not in email:
+            continue
+        try:
+            cur.execute(
+                "INSERT INTO users (name, email, mobile, password, role) VALUES (%s,%s,%s,%s,%s)",
+                (row.get('name'), email, row.get('mobile'), password, 'student'))
+            conn.commit()
+            created += 1
+        except psycopg2.IntegrityError:
+            conn.rollback()
+    cur.close()
+    return created
+
+
+def main():
+    args = parse_args()
+    import bulk_import
+
+    if args.validate_only:
+        print(f"{'rows':>8} {'validate ms':>12} {'rows/s':>12}")
+        for n in args.rows:
+            df = make_roster(n, 'v')
+            started = time.perf_counter()
+            bulk_import.prepare_users(bulk_import.normalize_columns(df))
+            elapsed = time.perf_counter() - started
+            print(f'{n:>8} {elapsed * 1000:>12.1f} {n / elapsed:>12.0f}')
+        return
+
+    url = os.environ.get('DATABASE_URL')
+    if not url:
+        raise RuntimeError('DATABASE_URL environment variable not set')
+    setup = psycopg2.connect(url, sslmode=os.environ.get('DB_SSLMODE', 'require'))
+    scur = setup.cursor()
+    scur.execute(f'CREATE SCHEMA IF NOT EXISTS {args.schema}')
+    setup.commit()
+
+    import migrations
+    conn = psycopg2.connect(url, sslmode=os.environ.get('DB_SSLMODE', 'require'), options=f'-c search_path={args.schema}')
+    try:
+        migrations.upgrade(conn, verbose=False)
+        print(f"{'rows':>8} {'created':>8} {'failed':>7} {'skipped':>8} {'total ms':>10} {'rows/s':>10}"
+              + (f" {'legacy ms':>10}" if args.legacy else ''))
+        for n in args.rows:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM users WHERE email LIKE '%@example.com' AND role = 'student'")
+            conn.commit()
+            cur.close()
+
+            df = make_roster(n, 'b')
+            started = time.perf_counter()
+            counts, _ = bulk_import.import_users(df, conn)
+            elapsed = time.perf_counter() - started
+            line = (f"{n:>8} {counts['created']:>8} {counts['failed']:>7} {counts['skipped']:>8} "
+                    f"{elapsed * 1000:>10.1f} {n / elapsed:>10.0f}")
+            if args.legacy:
+                started = time.perf_counter()
+                legacy_import(make_roster(n, 'l'), conn)
+                line += f' {(time.perf_counter() - started) * 1000:>10.1f}'
+            print(line)
+    finally:
+        conn.close()
+        if not args.keep:
+            scur.execute(f'DROP SCHEMA {args.schema} CASCADE')
+            setup.commit()
+        scur.close()
+        setup.close()
+
+
+if __name__ == '__main__':
+    main()
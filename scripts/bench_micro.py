@@ -0,0 +1,284 @@
+"""
+Micro-benchmarks for the CPU-bound code paths; no database needed.
+
+Usage:
+  - Run everything: python scripts/bench_micro.py
+  - A subset, quicker: python scripts/bench_micro.py --only score xlsx --quick
+  - Save results, then check a later run against them:
+      python scripts/bench_micro.py --save bench.json
+      python scripts/bench_micro.py --compare bench.json --threshold 25
+
+This script:
+  - Times each benchmark at several input sizes, with one untimed warm-up
+    round and then --rounds timed ones, and reports min/median/mean/stddev
+    per round and per item:
+      score         take_exam: score one submission and pack its answer codes
+                    (per item = one submission, size = questions per exam)
+      regrade       regrade_exam's batch step: stack answer codes into a
+                    matrix and score it (size = submissions)
+      csv / xlsx / pdf
+                    the leaderboard exports in exports.py (size = rows)
+      bulk_csv / bulk_xlsx
+                    bulk upload: read a staged roster in chunks and validate
+                    it with prepare_users (size = rows)
+  - Inputs are generated from a fixed seed, so runs are comparable
+  - --save writes the results as JSON; --compare exits 1 if any median got
+    slower than the saved one by more than --threshold percent
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import reportlab
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bulk_import
+import exports
+import grading
+
+SCORE_BATCH = 500
+REGRADE_QUESTIONS = 50
+BULK_CHUNK = 5000  # import_jobs' chunk size
+
+_cleanup = []  # staged roster files
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='CPU micro-benchmarks (no database)')
+    p.add_argument('--only', nargs='+', metavar='NAME', help=f'Benchmarks to run: {", ".join(BENCHMARKS)}')
+    p.add_argument('--quick', action='store_true', help='Skip the largest size of each benchmark')
+    p.add_argument('--rounds', type=int, default=5, help='Timed rounds per size')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--save', help='Write results to this JSON file')
+    p.add_argument('--compare', help='Compare against results saved earlier with --save')
+    p.add_argument('--threshold', type=float, default=25, help='Allowed slowdown of a median, percent')
+    return p.parse_args()
+
+
+# --------------------
+# Inputs
+# --------------------
+def make_questions(n):
+    return [{'id': 1000 + i, 'option1': f'Option A {i}', 'option2': f'Option B {i}',
+             'option3': f'Option C {i}', 'option4': f'Option D {i}', 'answer': f'Option {"ABCD"[i % 4]} {i}'}
+            for i in range(n)]
+
+
+def make_answers(rng, questions, n):
+    # a few unanswered questions, like real forms
+    return [{str(q['id']): q[f'option{rng.randint(1, 4)}'] for q in questions if rng.random() > 0.05}
+            for _ in range(n)]
+
+
+def make_leaderboard_rows(rng, n):
+    start = datetime(2026, 1, 1)
+    return [(f'Student {i}', 'Synthetic exam', rng.randint(0, 50), rng.randint(1, 3),
+             start + timedelta(seconds=rng.randint(0, 86400 * 30)), rng.randint(60, 5400))
+            for i in range(n)]
+
+
+def make_roster(rng, n):
+    """A roster with the usual mistakes: bad emails, blanks and repeats."""
+    rows = []
+    for i in range(n):
+        email = f'student{i}@example.com'
+        roll = rng.random()
+        if roll < 0.01:
+            email = 'not-an-email'
+        elif roll < 0.02 and rows:
+            email = rows[-1][1]
+        rows.append([f'Student {i}', email, f'9{i:09d}', '' if roll > 0.99 else 'pass123',
+                     rng.choice(['student', 'Student', 'mediator', ''])])
+    return pd.DataFrame(rows, columns=['Name', 'Email', 'Mobile', 'Password', 'Role'])
+
+
+# --------------------
+# Benchmarks: each setup returns (function to time, items per round)
+# --------------------
+def setup_score(rng, size):
+    questions = make_questions(size)
+    compiled = grading.compile_answer_key(questions)
+    answers = make_answers(rng, questions, SCORE_BATCH)
+
+    def run():
+        for a in answers:
+            grading.score_answers(a, compiled)
+            grading.pack_answers(a, compiled)
+    return run, SCORE_BATCH
+
+
+def setup_regrade(rng, size):
+    questions = make_questions(REGRADE_QUESTIONS)
+    compiled = grading.compile_answer_key(questions)
+    np_rng = np.random.default_rng(rng.randint(0, 2 ** 32))
+    codes = np_rng.integers(0, 5, (size, REGRADE_QUESTIONS), dtype=np.int8)
+    rows = [(i, codes[i].tobytes(), None, 0) for i in range(size)]
+
+    def run():
+        grading.score_matrix(grading._choices_for_rows(rows, compiled), compiled)
+    return run, size
+
+
+def setup_csv(rng, size):
+    rows = make_leaderboard_rows(rng, size)
+    return (lambda: exports.write_leaderboard_csv(io.BytesIO(), rows=rows)), size
+
+
+def setup_xlsx(rng, size):
+    rows = make_leaderboard_rows(rng, size)
+
+    def run():
+        with tempfile.TemporaryFile() as f:  # as download_leaderboard_excel does
+            exports.write_leaderboard_xlsx(f, rows=rows)
+    return run, size
+
+
+def setup_pdf(rng, size):
+    rows = make_leaderboard_rows(rng, size)
+    return (lambda: exports.write_leaderboard_pdf(io.BytesIO(), rows=rows)), size
+
+
+def _staged(df, suffix):
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    if suffix == '.csv':
+        df.to_csv(path, index=False)
+    else:
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(list(df.columns))
+        for row in df.itertuples(index=False):
+            ws.append(list(row))
+        wb.save(path)
+    _cleanup.append(path)
+    return path
+
+
+def _import_run(path):
+    def run():
+        offset = 0
+        for chunk in bulk_import.iter_chunks(path, BULK_CHUNK):
+            bulk_import.prepare_users(chunk, row_offset=offset)
+            offset += len(chunk)
+    return run
+
+
+def setup_bulk_csv(rng, size):
+    return _import_run(_staged(make_roster(rng, size), '.csv')), size
+
+
+def setup_bulk_xlsx(rng, size):
+    return _import_run(_staged(make_roster(rng, size), '.xlsx')), size
+
+
+# name -> (setup, sizes); --quick drops the last size
+BENCHMARKS = {
+    'score': (setup_score, [10, 50, 200]),
+    'regrade': (setup_regrade, [1000, 10000, 100000]),
+    'csv': (setup_csv, [1000, 10000, 100000]),
+    'xlsx': (setup_xlsx, [1000, 5000, 20000]),
+    'pdf': (setup_pdf, [500, 2000, 10000]),
+    'bulk_csv': (setup_bulk_csv, [1000, 10000, 100000]),
+    'bulk_xlsx': (setup_bulk_xlsx, [1000, 10000, 20000]),
+}
+
+
+def measure(run, rounds):
+    run()  # warm-up: imports, caches, first-call allocations
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'openpyxl': openpyxl.__version__,
+        'reportlab': reportlab.Version,
+    }
+
+
+def compare(results, baseline, threshold):
+    """(lines, regressions) for every benchmark present in both runs."""
+    saved = {(b['name'], b['size']): b for b in baseline['benchmarks']}
+    lines, regressions = [], []
+    for r in results:
+        old = saved.get((r['name'], r['size']))
+        if old is None:
+            continue
+        change = (r['median'] / old['median'] - 1) * 100
+        line = f"{r['name']:<10} {r['size']:>8} {old['median'] * 1000:>10.2f} {r['median'] * 1000:>10.2f} {change:>+8.1f}%"
+        lines.append(line)
+        if change > threshold:
+            regressions.append(line)
+    return lines, regressions
+
+
+def main():
+    args = parse_args()
+    names = args.only or list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        raise SystemExit(f'unknown benchmark(s): {", ".join(unknown)}; choose from {", ".join(BENCHMARKS)}')
+
+    results = []
+    print(f"{'benchmark':<10} {'size':>8} {'min ms':>10} {'median ms':>10} {'mean ms':>10} "
+          f"{'stddev':>8} {'us/item':>9}")
+    try:
+        for name in names:
+            setup, sizes = BENCHMARKS[name]
+            for size in sizes[:-1] if args.quick else sizes:
+                run, items = setup(random.Random(f'{args.seed}-{name}-{size}'), size)
+                times = measure(run, args.rounds)
+                r = {
+                    'name': name, 'size': size, 'items': items, 'rounds': args.rounds,
+                    'min': min(times), 'median': statistics.median(times),
+                    'mean': statistics.mean(times),
+                    'stddev': statistics.stdev(times) if len(times) > 1 else 0.0,
+                }
+                results.append(r)
+                print(f"{name:<10} {size:>8} {r['min'] * 1000:>10.2f} {r['median'] * 1000:>10.2f} "
+                      f"{r['mean'] * 1000:>10.2f} {r['stddev'] * 1000:>8.2f} {r['median'] / items * 1e6:>9.2f}")
+    finally:
+        for path in _cleanup:
+            os.remove(path)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'environment': environment(), 'seed': args.seed, 'benchmarks': results}, f, indent=2)
+        print(f'\nresults written to {args.save}')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('environment') != environment():
+            print(f"\nwarning: baseline was recorded on {baseline.get('environment')}")
+        lines, regressions = compare(results, baseline, args.threshold)
+        print(f"\n{'benchmark':<10} {'size':>8} {'before ms':>10} {'after ms':>10} {'change':>9}")
+        for line in lines:
+            print(line)
+        print(f'\n{len(regressions)} regression(s) over {args.threshold:g}% against {args.compare}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Benchmark the student dashboard query against the old per-exam COUNT loop.
+
+Usage:
+  - Set DATABASE_URL to a Postgres you can create a scratch schema in
+  - Run: python scripts/bench_student_dashboard.py --exams 10 100 1000
+
+This script:
+  - Creates a throwaway schema (default `bench_dashboard`) and migrates it
+  - Seeds N exams and a few submissions per exam for one student
+  - Runs the legacy N+1 loop and `get_student_exams`, counting statements
+  - Drops the schema afterwards (unless --keep)
+"""
+
+import os
+import sys
+import time
+import argparse
+
+from dotenv import load_dotenv
+import psycopg2
+import psycopg2.extras
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+load_dotenv()
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Benchmark student dashboard queries')
+    p.add_argument('--exams', type=int, nargs='+', default=[10, 100, 1000], help='Exam counts to test')
+    p.add_argument('--repeat', type=int, default=5, help='Runs per measurement')
+    p.add_argument('--schema', default='bench_dashboard', help='Scratch schema name')
+    p.add_argument('--keep', action='store_true', help='Keep the scratch schema')
+    return p.parse_args()
+
+
+class CountingCursor:
+    def __init__(self, cur, counter):
+        self._cur = cur
+        self._counter = counter
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    def execute(self, *args, **kwargs):
+        self._counter[0] += 1
+        return self._cur.execute(*args, **kwargs)
+
+
+class CountingConnection:
+    def __init__(self, conn, counter):
+        self._conn = conn
+        self._counter = counter
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(self._conn.cursor(*args, **kwargs), self._counter)
+
+    def close(self):
+        # Shared scratch connection; closed once at the end.
+        pass
+
+
+def legacy_student_home(conn, uid):
+    """The loop student_home ran before: one COUNT(*) per exam."""
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cur.execute('SELECT id, title, duration, created_by, attempts_allowed FROM exams')
+    exams = [dict(r) for r in cur.fetchall()]
+    exam_infos = []
+    for ex in exams:
+        cur.execute('SELECT COUNT(*) FROM submissions WHERE exam_id=%s AND student_id=%s', (ex['id'], uid))
+        prev_attempts = cur.fetchone()[0]
+        exam_infos.append(dict(ex, prev_attempts=prev_attempts,
+                               remaining=max(ex['attempts_allowed'] - prev_attempts, 0)))
+    cur.close()
+    return exam_infos
+
+
+def seed(conn, n_exams, uid):
+    cur = conn.cursor()
+    cur.execute('TRUNCATE exams, submissions RESTART IDENTITY')
+    cur.execute('''
+        INSERT INTO exams (title, duration, created_by, attempts_allowed)
+        SELECT 'Exam ' || g, 30, 1, 3 FROM generate_series(1, %s) g
+    ''', (n_exams,))
+    cur.execute('''
+        INSERT INTO submissions (exam_id, student_id, answers, score, attempt_number, submitted_at)
+        SELECT e.id, %s, '{}', 0, a, NOW()
+        FROM exams e CROSS JOIN generate_series(1, 2) a
+        WHERE e.id %% 2 = 0
+    ''', (uid,))
+    conn.commit()
+    cur.close()
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return result, min(timings)
+
+
+def main():
+    args = parse_args()
+    url = os.environ.get('DATABASE_URL')
+    if not url:
+        raise RuntimeError('DATABASE_URL environment variable not set')
+
+    setup = psycopg2.connect(url, sslmode=os.environ.get('DB_SSLMODE', 'require'))
+    cur = setup.cursor()
+    cur.execute(f'CREATE SCHEMA IF NOT EXISTS {args.schema}')
+    setup.commit()
+
+    # libpq reads PGOPTIONS, so every connection below (including the pool
+    # exam_helpers uses) resolves tables in the scratch schema.
+    os.environ['PGOPTIONS'] = f'-c search_path={args.schema}'
+    import migrations
+    import exam_helpers
+
+    conn = psycopg2.connect(url, sslmode=os.environ.get('DB_SSLMODE', 'require'))
+    try:
+        migrations.upgrade(conn, verbose=False)
+        uid = 1
+        print(f"{'exams':>7} {'legacy q':>9} {'legacy ms':>10} {'new q':>6} {'new ms':>8}")
+        for n in args.exams:
+            seed(conn, n, uid)
+
+            counter = [0]
+            counted = CountingConnection(conn, counter)
+            legacy, legacy_s = measure(lambda: legacy_student_home(counted, uid), args.repeat)
+            legacy_q = counter[0] // args.repeat
+
+            counter[0] = 0
+            exam_helpers.get_db_connection = lambda: counted
+            current, current_s = measure(lambda: exam_helpers.get_student_exams(uid), args.repeat)
+            current_q = counter[0] // args.repeat
+
+            assert sorted((e['id'], e['prev_attempts']) for e in legacy) == \
+                sorted((e['id'], e['prev_attempts']) for e in current)
+            print(f'{n:>7} {legacy_q:>9} {legacy_s * 1000:>10.1f} {current_q:>6} {current_s * 1000:>8.1f}')
+    finally:
+        conn.close()
+        if not args.keep:
+            cur.execute(f'DROP SCHEMA {args.schema} CASCADE')
+            setup.commit()
+        cur.close()
+        setup.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,455 @@
+"""
+Fill a database with a synthetic, production-sized dataset for benchmarks.
+
+Usage:
+  - Set DATABASE_URL to a local/scratch Postgres (migrations are applied first)
+  - Run: python scripts/generate_dataset.py --students 50000 --exams 500 --submissions 5000000
+  - Re-run with --clean to replace the previous synthetic data, or
+    --clean-only to just remove it
+  - Also (or only) write a SQLite file in the site.db layout:
+      python scripts/generate_dataset.py --sqlite synthetic.db [--no-postgres]
+
+This script:
+  - Generates mediators, students, exams with 50-150% of --questions
+    questions each, and submissions, all from one --seed: the same
+    arguments always produce the same rows
+  - Skews it like the real thing: a few exams draw most of the attempts
+    (Zipf, --skew), student activity is log-normal, students differ in
+    ability and questions in difficulty, retakes happen up to the exam's
+    attempts_allowed, and submissions cluster around each exam's sitting
+  - Writes rows valid for the current schema: answer_codes (one byte per
+    question, see grading.py), score, attempt_number 1..n per student and
+    exam, time_taken within the exam's duration; ids are in submitted_at
+    order, as the app would have inserted them
+  - Loads Postgres with COPY in one transaction, moves the id sequences
+    past the new rows and ANALYZEs the tables
+  - Synthetic accounts use @synthetic.test emails; --clean deletes them,
+    their exams and every submission to those exams first
+
+Notes:
+  - SQLite rows store `answers` as JSON (the legacy column) instead of
+    answer_codes, so the file also feeds migrate_sqlite_to_postgres.py.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import upgrade
+
+load_dotenv()
+
+EMAIL_DOMAIN = 'synthetic.test'
+DURATIONS = np.array([15, 30, 45, 60, 90, 120])
+ATTEMPTS_ALLOWED = np.array([1, 2, 3])
+ATTEMPTS_WEIGHTS = np.array([0.7, 0.2, 0.1])
+UNANSWERED = 0.03
+RETAKE_RATE = 0.25
+CHUNK_SIZE = 100000
+# epoch of the generated timeline, fixed so the seed alone decides the data
+END = datetime(2026, 1, 1)
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, email TEXT UNIQUE,
+    mobile TEXT, password TEXT, role TEXT
+);
+CREATE TABLE IF NOT EXISTS exams (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, duration INTEGER,
+    created_by INTEGER, attempts_allowed INTEGER DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, exam_id INTEGER, question TEXT, image TEXT,
+    option1 TEXT, option2 TEXT, option3 TEXT, option4 TEXT, answer TEXT
+);
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, exam_id INTEGER, student_id INTEGER,
+    answers TEXT, score INTEGER, attempt_number INTEGER DEFAULT 1,
+    submitted_at TEXT, time_taken INTEGER
+);
+'''
+# site.db predates these
+SQLITE_COLUMNS = [('exams', 'attempts_allowed INTEGER DEFAULT 1'),
+                  ('submissions', 'attempt_number INTEGER DEFAULT 1'),
+                  ('submissions', 'time_taken INTEGER')]
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Generate a synthetic benchmark dataset')
+    p.add_argument('--students', type=int, default=10000)
+    p.add_argument('--mediators', type=int, default=10)
+    p.add_argument('--exams', type=int, default=200)
+    p.add_argument('--questions', type=int, default=30, help='Mean questions per exam')
+    p.add_argument('--submissions', type=int, default=500000)
+    p.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of exam popularity')
+    p.add_argument('--days', type=int, default=365, help='Days of history to spread the exams over')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--sqlite', help='Also write the dataset to this SQLite file')
+    p.add_argument('--no-postgres', action='store_true', help='Only write the SQLite file')
+    p.add_argument('--clean', action='store_true', help='Delete a previous synthetic dataset first')
+    p.add_argument('--clean-only', action='store_true', help='Delete the synthetic dataset and stop')
+    return p.parse_args()
+
+
+# --------------------
+# Generation (ids are 0-based here; writers add their table's offset)
+# --------------------
+def make_users(args):
+    n_med = args.mediators
+    roles = ['mediator'] * n_med + ['student'] * args.students
+    names = [f'Mediator {i}' for i in range(n_med)] + [f'Student {i}' for i in range(args.students)]
+    emails = ([f'mediator{i}@{EMAIL_DOMAIN}' for i in range(n_med)]
+              + [f'student{i}@{EMAIL_DOMAIN}' for i in range(args.students)])
+    return pd.DataFrame({
+        'name': names,
+        'email': emails,
+        'mobile': [f'9{i:09d}' for i in range(len(roles))],
+        'password': 'password',
+        'role': roles,
+    })
+
+
+def make_exams(rng, args):
+    n = args.exams
+    return pd.DataFrame({
+        'title': [f'Synthetic exam {i}' for i in range(n)],
+        'duration': rng.choice(DURATIONS, n),
+        # None when there are no mediators, like exams an admin made
+        'created_by': rng.integers(0, args.mediators, n) if args.mediators else None,
+        'attempts_allowed': rng.choice(ATTEMPTS_ALLOWED, n, p=ATTEMPTS_WEIGHTS),
+        # when most students sat it; retakes follow
+        'sitting': rng.uniform(-args.days, -7, n) * 86400,
+    })
+
+
+def make_questions(rng, args, exams):
+    counts = rng.integers(max(1, args.questions // 2), max(2, args.questions * 3 // 2) + 1, len(exams))
+    exam_of = np.repeat(np.arange(len(exams)), counts)
+    n = len(exam_of)
+    key = rng.integers(1, 5, n)
+    letters = 'ABCD'
+    options = [[f'Option {letters[o]} of question {i}' for i in range(n)] for o in range(4)]
+    return pd.DataFrame({
+        'exam': exam_of,
+        'question': [f'Synthetic question {i} ' + 'lorem ipsum ' * int(w)
+                     for i, w in enumerate(rng.integers(1, 12, n))],
+        'option1': options[0], 'option2': options[1], 'option3': options[2], 'option4': options[3],
+        'answer': [options[k - 1][i] for i, k in enumerate(key)],
+        'key': key,
+        'difficulty': rng.normal(0, 1, n),
+    }), counts
+
+
+def _per_exam(rng, total, popularity, capacity):
+    """Split `total` over exams by popularity without exceeding any exam's capacity."""
+    counts = np.zeros(len(popularity), dtype=np.int64)
+    weights = popularity.copy()
+    while total > 0:
+        extra = np.minimum(rng.multinomial(total, weights / weights.sum()), capacity - counts)
+        counts += extra
+        total -= int(extra.sum())
+        weights[counts >= capacity] = 0  # full exams take no more
+    return counts
+
+
+def plan_attempts(rng, args, exams):
+    """(exam, student, attempt_number) for every submission, unique per attempt."""
+    n_students = args.students
+    allowed = exams['attempts_allowed'].to_numpy()
+    capacity = n_students * allowed
+    if args.submissions > capacity.sum():
+        raise SystemExit(f'{args.submissions} submissions need more students or exams '
+                         f'(room for {capacity.sum()})')
+    popularity = 1 / np.arange(1, len(exams) + 1) ** args.skew
+    popularity = rng.permutation(popularity / popularity.sum())
+    activity = rng.lognormal(0, 1, n_students)
+    activity /= activity.sum()
+
+    exam, student, attempt = [], [], []
+    for e, total in enumerate(_per_exam(rng, args.submissions, popularity, capacity)):
+        if total == 0:
+            continue
+        # about one student in four retakes, as far as the exam allows
+        takers = int(np.clip(round(total / (1 + RETAKE_RATE * (allowed[e] - 1))),
+                             -(-total // allowed[e]), min(total, n_students)))
+        who = rng.choice(n_students, takers, replace=False, p=activity)
+        retakes = np.bincount(
+            rng.choice(np.repeat(np.arange(takers), allowed[e] - 1), total - takers, replace=False),
+            minlength=takers) if total > takers else np.zeros(takers, dtype=np.int64)
+        n = retakes + 1
+        exam.append(np.full(total, e))
+        student.append(np.repeat(who, n))
+        attempt.append(np.arange(total) - np.repeat(np.cumsum(n) - n, n) + 1)
+    return np.concatenate(exam), np.concatenate(student), np.concatenate(attempt)
+
+
+def make_submissions(rng, args, exams, questions, q_counts):
+    """Yield DataFrames of submissions in submitted_at order, CHUNK_SIZE at a time."""
+    exam, student, attempt = plan_attempts(rng, args, exams)
+    n = len(exam)
+    duration = exams['duration'].to_numpy()[exam] * 60
+    time_taken = np.maximum(30, (duration * rng.beta(5, 2, n)).astype(np.int64))
+    # retakes a day or more after the previous attempt (a student's attempts
+    # are adjacent rows here); first sittings spread over the afternoon
+    gap = np.where(attempt > 1, 86400 * (1 + rng.exponential(3, n)), 0).cumsum()
+    first = np.flatnonzero(attempt == 1)
+    gap -= np.repeat(gap[first], np.diff(np.append(first, n)))
+    offset = gap + np.minimum(rng.exponential(3 * 3600, n), 20 * 3600) + time_taken
+    submitted = exams['sitting'].to_numpy()[exam] + offset
+    order = np.argsort(submitted, kind='stable')
+    exam, student, attempt = exam[order], student[order], attempt[order]
+    time_taken, submitted = time_taken[order], submitted[order]
+
+    ability = rng.normal(0, 1, args.students)
+    q_start = np.concatenate([[0], np.cumsum(q_counts)[:-1]])
+    width = int(q_counts.max())
+    # (exam, position) -> question row, -1 past the exam's last question
+    pos = np.arange(width)
+    layout = np.where(pos < q_counts[:, None], q_start[:, None] + pos, -1)
+    key = np.append(questions['key'].to_numpy(), 0).astype(np.int8)
+    difficulty = np.append(questions['difficulty'].to_numpy(), 0.0)
+
+    for lo in range(0, n, CHUNK_SIZE):
+        hi = min(lo + CHUNK_SIZE, n)
+        e, s, a = exam[lo:hi], student[lo:hi], attempt[lo:hi]
+        cells = layout[e]
+        valid = cells >= 0
+        k = key[cells]
+        logit = 1.7 * (ability[s][:, None] - difficulty[cells]) + 0.4 * (a[:, None] - 1)
+        correct = rng.random(cells.shape) < 1 / (1 + np.exp(-logit))
+        wrong = (k - 1 + rng.integers(1, 4, cells.shape)) % 4 + 1
+        choices = np.where(correct, k, wrong).astype(np.int8)
+        choices[(rng.random(cells.shape) < UNANSWERED) | ~valid] = 0
+        score = ((choices == k) & (k > 0)).sum(axis=1)
+        counts = q_counts[e]
+        yield pd.DataFrame({
+            'exam': e, 'student': s, 'attempt_number': a, 'score': score,
+            'submitted_at': pd.Timestamp(END) + pd.to_timedelta(submitted[lo:hi].round(), unit='s'),
+            'time_taken': time_taken[lo:hi],
+            'codes': [row[:c].tobytes() for row, c in zip(choices, counts)],
+        })
+
+
+# --------------------
+# Postgres
+# --------------------
+def pg_clean(cur):
+    cur.execute('''
+        CREATE TEMP TABLE synthetic_exams ON COMMIT DROP AS
+        SELECT e.id FROM exams e JOIN users u ON u.id = e.created_by WHERE u.email LIKE %s
+        UNION SELECT id FROM exams WHERE created_by IS NULL AND title LIKE 'Synthetic exam %%'
+    ''', (f'%@{EMAIL_DOMAIN}',))
+    cur.execute('DELETE FROM submissions WHERE exam_id IN (SELECT id FROM synthetic_exams)')
+    deleted = cur.rowcount
+    cur.execute('DELETE FROM submissions WHERE student_id IN (SELECT id FROM users WHERE email LIKE %s)',
+                (f'%@{EMAIL_DOMAIN}',))
+    deleted += cur.rowcount
+    cur.execute('DELETE FROM questions WHERE exam_id IN (SELECT id FROM synthetic_exams)')
+    cur.execute('DELETE FROM exams WHERE id IN (SELECT id FROM synthetic_exams)')
+    cur.execute('DELETE FROM users WHERE email LIKE %s', (f'%@{EMAIL_DOMAIN}',))
+    print(f'removed the previous synthetic dataset ({deleted} submissions)')
+
+
+def _copy(cur, table, columns, df):
+    buf = io.StringIO()
+    df.to_csv(buf, header=False, index=False)
+    buf.seek(0)
+    cur.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buf)
+
+
+def _next_id(cur, table):
+    cur.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}')
+    return cur.fetchone()[0]
+
+
+class PostgresWriter:
+    def __init__(self, conn, clean):
+        self.conn = conn
+        self.cur = conn.cursor()
+        # offsets are read once; nobody may insert alongside the COPY
+        self.cur.execute('LOCK TABLE users, exams, questions, submissions IN EXCLUSIVE MODE')
+        if clean:
+            pg_clean(self.cur)
+        self.cur.execute('SELECT 1 FROM users WHERE email LIKE %s LIMIT 1', (f'%@{EMAIL_DOMAIN}',))
+        if self.cur.fetchone():
+            raise SystemExit('a synthetic dataset is already loaded; pass --clean to replace it')
+
+    def write_fixtures(self, users, exams, questions):
+        self.user_base = _next_id(self.cur, 'users')
+        self.exam_base = _next_id(self.cur, 'exams')
+        question_base = _next_id(self.cur, 'questions')
+        _copy(self.cur, 'users', ['id', 'name', 'email', 'mobile', 'password', 'role'],
+              users.assign(id=np.arange(len(users)) + self.user_base)
+              [['id', 'name', 'email', 'mobile', 'password', 'role']])
+        _copy(self.cur, 'exams', ['id', 'title', 'duration', 'created_by', 'attempts_allowed'],
+              exams.assign(id=np.arange(len(exams)) + self.exam_base,
+                           created_by=exams['created_by'] + self.user_base
+                           if exams['created_by'].notna().all() else None)
+              [['id', 'title', 'duration', 'created_by', 'attempts_allowed']])
+        _copy(self.cur, 'questions',
+              ['id', 'exam_id', 'question', 'option1', 'option2', 'option3', 'option4', 'answer'],
+              questions.assign(id=np.arange(len(questions)) + question_base,
+                               exam=questions['exam'] + self.exam_base)
+              [['id', 'exam', 'question', 'option1', 'option2', 'option3', 'option4', 'answer']])
+
+    def write_submissions(self, chunk, args):
+        _copy(self.cur, 'submissions',
+              ['exam_id', 'student_id', 'answer_codes', 'score', 'attempt_number', 'submitted_at', 'time_taken'],
+              pd.DataFrame({
+                  'exam_id': chunk['exam'] + self.exam_base,
+                  'student_id': chunk['student'] + self.user_base + args.mediators,
+                  'answer_codes': ['\\x' + c.hex() for c in chunk['codes']],
+                  'score': chunk['score'],
+                  'attempt_number': chunk['attempt_number'],
+                  'submitted_at': chunk['submitted_at'],
+                  'time_taken': chunk['time_taken'],
+              }))
+
+    def finish(self):
+        for table in ('users', 'exams', 'questions', 'submissions'):
+            self.cur.execute(f'''SELECT setval(pg_get_serial_sequence('{table}', 'id'),
+                                               (SELECT COALESCE(MAX(id), 1) FROM {table}))''')
+        self.conn.commit()
+        self.conn.autocommit = True
+        for table in ('users', 'exams', 'questions', 'submissions'):
+            self.cur.execute(f'ANALYZE {table}')
+        self.cur.close()
+
+
+# --------------------
+# SQLite (site.db layout)
+# --------------------
+class SQLiteWriter:
+    def __init__(self, path, clean):
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=MEMORY')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.executescript(SQLITE_SCHEMA)
+        for table, column in SQLITE_COLUMNS:
+            try:
+                self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column}')
+            except sqlite3.OperationalError:
+                pass  # already there
+        self.conn.execute('BEGIN')
+        pattern = f'%@{EMAIL_DOMAIN}'
+        if clean:
+            self.conn.execute('''CREATE TEMP TABLE synthetic_exams AS SELECT id FROM exams
+                                 WHERE created_by IN (SELECT id FROM users WHERE email LIKE ?)
+                                    OR (created_by IS NULL AND title LIKE 'Synthetic exam %')''', (pattern,))
+            self.conn.execute('DELETE FROM submissions WHERE exam_id IN (SELECT id FROM synthetic_exams)')
+            self.conn.execute('DELETE FROM submissions WHERE student_id IN '
+                              '(SELECT id FROM users WHERE email LIKE ?)', (pattern,))
+            self.conn.execute('DELETE FROM questions WHERE exam_id IN (SELECT id FROM synthetic_exams)')
+            self.conn.execute('DELETE FROM exams WHERE id IN (SELECT id FROM synthetic_exams)')
+            self.conn.execute('DELETE FROM users WHERE email LIKE ?', (pattern,))
+            self.conn.execute('DROP TABLE synthetic_exams')
+        if self.conn.execute('SELECT 1 FROM users WHERE email LIKE ? LIMIT 1', (pattern,)).fetchone():
+            raise SystemExit('the SQLite file already has a synthetic dataset; pass --clean to replace it')
+
+    def _next_id(self, table):
+        return self.conn.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}').fetchone()[0]
+
+    def write_fixtures(self, users, exams, questions):
+        self.user_base = self._next_id('users')
+        self.exam_base = self._next_id('exams')
+        question_base = self._next_id('questions')
+        self.conn.executemany('INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)', [
+            (self.user_base + i, *row) for i, row in
+            enumerate(users[['name', 'email', 'mobile', 'password', 'role']].itertuples(index=False))])
+        self.conn.executemany('INSERT INTO exams VALUES (?, ?, ?, ?, ?)', [
+            (self.exam_base + i, title, int(duration),
+             None if pd.isna(created_by) else int(created_by) + self.user_base, int(allowed))
+            for i, (title, duration, created_by, allowed) in
+            enumerate(exams[['title', 'duration', 'created_by', 'attempts_allowed']].itertuples(index=False))])
+        self.conn.executemany('INSERT INTO questions VALUES (?, ?, ?, NULL, ?, ?, ?, ?, ?)', [
+            (question_base + i, int(exam) + self.exam_base, *rest) for i, (exam, *rest) in
+            enumerate(questions[['exam', 'question', 'option1', 'option2', 'option3', 'option4', 'answer']]
+                      .itertuples(index=False))])
+        # legacy `answers` JSON needs every exam's question ids and option texts
+        self.exam_questions = {}
+        for i, (exam, *options) in enumerate(
+                questions[['exam', 'option1', 'option2', 'option3', 'option4']].itertuples(index=False)):
+            self.exam_questions.setdefault(exam, []).append((str(question_base + i), options))
+
+    def write_submissions(self, chunk, args):
+        rows = []
+        for exam, student, attempt, score, at, taken, codes in chunk[
+                ['exam', 'student', 'attempt_number', 'score', 'submitted_at', 'time_taken', 'codes']
+        ].itertuples(index=False):
+            answers = {qid: options[c - 1] for (qid, options), c in zip(self.exam_questions[exam], codes) if c}
+            rows.append((int(exam) + self.exam_base, int(student) + self.user_base + args.mediators,
+                         json.dumps(answers), int(score), int(attempt),
+                         at.isoformat(sep=' ', timespec='seconds'), int(taken)))
+        self.conn.executemany('''
+            INSERT INTO submissions (exam_id, student_id, answers, score, attempt_number, submitted_at, time_taken)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+    def finish(self):
+        self.conn.execute('COMMIT')
+        self.conn.close()
+
+
+def main():
+    args = parse_args()
+    if args.no_postgres and not args.sqlite:
+        raise SystemExit('nothing to write: pass --sqlite with --no-postgres')
+    writers = []
+    pg_conn = None
+    started = time.perf_counter()
+    try:
+        if not args.no_postgres:
+            url = os.environ.get('DATABASE_URL')
+            if not url:
+                raise RuntimeError('DATABASE_URL environment variable not set (or pass --no-postgres)')
+            pg_conn = psycopg2.connect(url, sslmode=os.environ.get('DB_SSLMODE', 'require'))
+            upgrade(pg_conn, verbose=False)
+            writers.append(PostgresWriter(pg_conn, args.clean or args.clean_only))
+        if args.sqlite:
+            writers.append(SQLiteWriter(args.sqlite, args.clean or args.clean_only))
+        if args.clean_only:
+            for writer in writers:
+                writer.finish()
+            return
+
+        rng = np.random.default_rng(args.seed)
+        users = make_users(args)
+        exams = make_exams(rng, args)
+        questions, q_counts = make_questions(rng, args, exams)
+        for writer in writers:
+            writer.write_fixtures(users, exams, questions)
+        print(f'{len(users)} users, {len(exams)} exams, {len(questions)} questions '
+              f'({time.perf_counter() - started:.1f}s)')
+
+        written = 0
+        for chunk in make_submissions(rng, args, exams, questions, q_counts):
+            for writer in writers:
+                writer.write_submissions(chunk, args)
+            written += len(chunk)
+            elapsed = time.perf_counter() - started
+            print(f'  {written}/{args.submissions} submissions ({written / elapsed:,.0f}/s)')
+        for writer in writers:
+            writer.finish()
+    except BaseException:
+        if pg_conn is not None:
+            pg_conn.rollback()
+        raise
+    finally:
+        if pg_conn is not None:
+            pg_conn.close()
+    print(f'done in {time.perf_counter() - started:.1f}s (seed {args.seed})')
+
+
+if __name__ == '__main__':
+    main()
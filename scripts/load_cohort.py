@@ -0,0 +1,456 @@
+"""
+Load test: a whole exam cohort, from login to the synchronized final submit.
+
+Usage:
+  - Against a running app:
+      python scripts/load_cohort.py --url http://127.0.0.1:8000 --students 300
+  - Or let the script start `gunicorn app:app` itself on a free port with
+    the same environment (DATABASE_URL, DB_SSLMODE, ...):
+      python scripts/load_cohort.py --students 300 --workers 4 --threads 8
+  - Record a baseline once, then compare later runs against it:
+      python scripts/load_cohort.py --students 300 --save-baseline cohort.json
+      python scripts/load_cohort.py --students 300 --baseline cohort.json
+
+This script:
+  - Creates an exam, N throwaway students and a few admins (via DATABASE_URL)
+  - Starts the students over --ramp seconds; each one logs in, opens
+    student_home and the exam page, changes --autosave answers with
+    exponential think times (autosave posts plus a heartbeat every 30s),
+    then every student submits at the same moment, --duration seconds
+    after the last one started
+  - Meanwhile the admins keep opening the exam's leaderboard and
+    downloading it as CSV, Excel and PDF
+  - Reports count, errors, throughput and p50/p95/p99/max latency per route,
+    how long the submissions took to reach Postgres, and (when the app
+    records metrics) statements per request for every endpoint
+  - With --baseline, exits 1 if a route's p95/p99 got slower than the
+    baseline by more than --tolerance, or its error rate went up
+  - Cleans up everything it created (unless --keep)
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+import psycopg2
+import psycopg2.extras
+
+load_dotenv()
+
+EMAIL_DOMAIN = 'cohort.loadtest'
+PASSWORD = 'cohort'
+HEARTBEAT_EVERY = 30
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# route -> statuses that count as success
+ROUTES = {
+    'POST login': (302,),
+    'GET student_home': (200,),
+    'GET take_exam': (200,),
+    'POST autosave': (204,),
+    'POST heartbeat': (200,),
+    'POST take_exam': (302,),
+    'GET admin_leaderboard': (200,),
+    'GET leaderboard csv': (200,),
+    'GET leaderboard excel': (200,),
+    'GET leaderboard pdf': (200,),
+}
+# fewer samples than this are too noisy to compare with a baseline
+MIN_SAMPLES = 20
+
+_TOKEN_RE = re.compile(r'name="submit_token" value="([^"]*)"')
+_QUESTION_RE = re.compile(r'name="q(\d+)"')
+_METRIC_RE = re.compile(r'^(sac_http_requests_total|sac_db_queries_total)\{endpoint="([^"]*)"[^}]*\} (\S+)$')
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Exam cohort load test')
+    p.add_argument('--url', help='Base URL of a running app (default: start gunicorn here)')
+    p.add_argument('--workers', type=int, default=2, help='gunicorn workers when the script starts the app')
+    p.add_argument('--threads', type=int, default=1, help='threads per gunicorn worker')
+    p.add_argument('--students', type=int, default=200)
+    p.add_argument('--admins', type=int, default=2)
+    p.add_argument('--questions', type=int, default=20)
+    p.add_argument('--ramp', type=float, default=10, help='Seconds over which students arrive')
+    p.add_argument('--duration', type=float, default=60,
+                   help='Seconds from the last arrival to the synchronized submit')
+    p.add_argument('--think', type=float, default=3, help='Mean think time between answers, seconds')
+    p.add_argument('--autosave', type=int, default=10, help='Answer changes (autosaves) per student')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--timeout', type=float, default=120, help='Seconds to wait for submissions to drain')
+    p.add_argument('--baseline', help='Compare against this baseline JSON file')
+    p.add_argument('--save-baseline', help='Write this run as a baseline JSON file')
+    p.add_argument('--tolerance', type=float, default=20, help='Allowed p95/p99 slowdown, percent')
+    p.add_argument('--keep', action='store_true', help='Keep the accounts, exam and submissions')
+    return p.parse_args()
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Time each request itself, not the page it redirects to."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+# --------------------
+# Fixtures
+# --------------------
+def setup(conn, args):
+    # long enough that no submit is refused as late
+    minutes = math.ceil((args.ramp + args.duration) / 60) + 1
+    cur = conn.cursor()
+    cur.execute('''
+        INSERT INTO exams (title, duration, created_by, attempts_allowed)
+        VALUES ('Cohort load test', %s, NULL, 1) RETURNING id
+    ''', (minutes,))
+    exam_id = cur.fetchone()[0]
+    psycopg2.extras.execute_values(cur, '''
+        INSERT INTO questions (exam_id, question, option1, option2, option3, option4, answer) VALUES %s
+    ''', [(exam_id, f'Question {i}', 'A', 'B', 'C', 'D', 'ABCD'[i % 4]) for i in range(args.questions)])
+    students = [f'student{i}@{EMAIL_DOMAIN}' for i in range(args.students)]
+    admins = [f'admin{i}@{EMAIL_DOMAIN}' for i in range(args.admins)]
+    psycopg2.extras.execute_values(cur, '''
+        INSERT INTO users (name, email, mobile, password, role) VALUES %s
+        ON CONFLICT (email) DO NOTHING
+    ''', [(f'Cohort {i}', e, '0000000000', PASSWORD, 'student') for i, e in enumerate(students)]
+        + [(f'Cohort admin {i}', e, '0000000000', PASSWORD, 'admin') for i, e in enumerate(admins)])
+    conn.commit()
+    cur.close()
+    return exam_id, students, admins
+
+
+def cleanup(conn, exam_id):
+    cur = conn.cursor()
+    cur.execute('SELECT id FROM users WHERE email LIKE %s', (f'%@{EMAIL_DOMAIN}',))
+    user_ids = [r[0] for r in cur.fetchall()]
+    cur.execute('DELETE FROM submissions WHERE exam_id = %s', (exam_id,))
+    cur.execute('DELETE FROM exam_sessions WHERE exam_id = %s', (exam_id,))
+    cur.execute('DELETE FROM proctor_events WHERE exam_id = %s', (exam_id,))
+    cur.execute('DELETE FROM proctor_counts WHERE exam_id = %s', (exam_id,))
+    cur.execute('DELETE FROM questions WHERE exam_id = %s', (exam_id,))
+    cur.execute('DELETE FROM exams WHERE id = %s', (exam_id,))
+    cur.execute('DELETE FROM users WHERE id = ANY(%s)', (user_ids,))
+    conn.commit()
+    cur.close()
+
+
+# --------------------
+# The app under test
+# --------------------
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args):
+    port = free_port()
+    cmd = [sys.executable, '-m', 'gunicorn', 'app:app', '-b', f'127.0.0.1:{port}',
+           '-w', str(args.workers), '--threads', str(args.threads), '--timeout', '300']
+    server = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with {server.returncode}')
+        try:
+            with urllib.request.urlopen(base + '/login', timeout=2) as resp:
+                if resp.status == 200:
+                    return server, base
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('gunicorn did not come up within 30s')
+
+
+class Client:
+    """One browser: a cookie jar, with every request timed into `results`."""
+
+    def __init__(self, base, results):
+        self.base = base
+        self.results = results
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect)
+
+    def request(self, route, path, form=None, json_body=None):
+        headers = {}
+        body = None
+        if form is not None:
+            body = urllib.parse.urlencode(form).encode()
+        elif json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base + path, body, headers)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=300) as resp:
+                text = resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            text, status = e.read(), e.code
+        except OSError as e:
+            text, status = str(e).encode(), None
+        self.results.append((route, started, time.perf_counter() - started, status))
+        return status, text
+
+    def login(self, email):
+        status, _ = self.request('POST login', '/login', {'email': email, 'password': PASSWORD})
+        return status == 302
+
+
+def sleep_until(when):
+    delay = when - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def student(base, exam_id, email, start_at, submit_at, args, rng, results, acked):
+    sleep_until(start_at)
+    client = Client(base, results)
+    if not client.login(email):
+        return
+    client.request('GET student_home', '/student/home')
+    status, page = client.request('GET take_exam', f'/student/take_exam/{exam_id}')
+    page = page.decode('utf-8', 'replace')
+    token = _TOKEN_RE.search(page)
+    if status != 200 or token is None:
+        return
+    token = token.group(1)
+    question_ids = list(dict.fromkeys(_QUESTION_RE.findall(page)))
+    answers = {}
+    last_heartbeat = time.time()
+
+    for _ in range(args.autosave if question_ids else 0):
+        pause = rng.expovariate(1 / args.think) if args.think > 0 else 0
+        if time.time() + pause >= submit_at:
+            break
+        time.sleep(pause)
+        qid = rng.choice(question_ids)
+        answers[qid] = rng.choice('ABCD')
+        client.request('POST autosave', f'/student/take_exam/{exam_id}/autosave',
+                       json_body={'token': token, 'answers': {qid: answers[qid]}})
+        if time.time() - last_heartbeat >= HEARTBEAT_EVERY:
+            client.request('POST heartbeat', f'/student/take_exam/{exam_id}/heartbeat',
+                           json_body={'token': token})
+            last_heartbeat = time.time()
+
+    # idle until the deadline, keeping the timer in sync like the page does
+    while submit_at - time.time() > HEARTBEAT_EVERY:
+        time.sleep(HEARTBEAT_EVERY)
+        client.request('POST heartbeat', f'/student/take_exam/{exam_id}/heartbeat', json_body={'token': token})
+    sleep_until(submit_at)
+    form = {f'q{qid}': value for qid, value in answers.items()}
+    form['submit_token'] = token
+    status, _ = client.request('POST take_exam', f'/student/take_exam/{exam_id}', form)
+    if status == 302:
+        acked.append(email)
+
+
+def admin(base, exam_id, email, stop, args, rng, results):
+    client = Client(base, results)
+    if not client.login(email):
+        return
+    pages = [('GET admin_leaderboard', f'/admin/leaderboard?exam_id={exam_id}'),
+             ('GET leaderboard csv', f'/admin/leaderboard/download/csv?exam_id={exam_id}'),
+             ('GET leaderboard excel', f'/admin/leaderboard/download/excel?exam_id={exam_id}'),
+             ('GET leaderboard pdf', f'/admin/leaderboard/download/pdf?exam_id={exam_id}')]
+    while not stop.is_set():
+        for route, path in pages:
+            if stop.is_set():
+                break
+            client.request(route, path)
+            stop.wait(rng.expovariate(1 / args.think) if args.think > 0 else 0)
+
+
+# --------------------
+# Server-side statements per request
+# --------------------
+def scrape_metrics(base, email):
+    """{endpoint: (requests, statements)} from /admin/metrics, or None."""
+    client = Client(base, [])
+    if not client.login(email):
+        return None
+    status, text = client.request('GET metrics', '/admin/metrics')
+    if status != 200:
+        return None
+    totals = defaultdict(lambda: [0, 0])
+    for line in text.decode().splitlines():
+        m = _METRIC_RE.match(line)
+        if m:
+            totals[m.group(2)][0 if m.group(1) == 'sac_http_requests_total' else 1] += float(m.group(3))
+    return totals
+
+
+def print_queries(before, after):
+    print()
+    print(f"{'endpoint':<28} {'requests':>9} {'stmts/req':>10}")
+    for endpoint in sorted(after):
+        requests = after[endpoint][0] - before.get(endpoint, (0, 0))[0]
+        statements = after[endpoint][1] - before.get(endpoint, (0, 0))[1]
+        if requests > 0:
+            print(f'{endpoint:<28} {int(requests):>9} {statements / requests:>10.2f}')
+
+
+# --------------------
+# Report and baselines
+# --------------------
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return float('nan')
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def summarize(results):
+    """Per-route count, errors, throughput and latency percentiles (ms)."""
+    by_route = defaultdict(list)
+    for route, started, seconds, status in results:
+        by_route[route].append((started, seconds, status))
+    summary = {}
+    for route in ROUTES:
+        samples = by_route.get(route)
+        if not samples:
+            continue
+        latencies = sorted(s for _, s, _ in samples)
+        errors = sum(1 for _, _, status in samples if status not in ROUTES[route])
+        span = max(st + s for st, s, _ in samples) - min(st for st, _, _ in samples)
+        summary[route] = {
+            'count': len(samples),
+            'errors': errors,
+            'error_rate': errors / len(samples),
+            'rps': len(samples) / span if span > 0 else float(len(samples)),
+            'p50': percentile(latencies, 50) * 1000,
+            'p95': percentile(latencies, 95) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'max': latencies[-1] * 1000,
+        }
+    return summary
+
+
+def print_summary(summary):
+    print(f"{'route':<24} {'count':>7} {'errors':>7} {'err %':>6} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for route, s in summary.items():
+        print(f"{route:<24} {s['count']:>7} {s['errors']:>7} {s['error_rate'] * 100:>6.2f} {s['rps']:>8.1f} "
+              f"{s['p50']:>8.1f} {s['p95']:>8.1f} {s['p99']:>8.1f} {s['max']:>8.1f}")
+
+
+def compare(summary, baseline, tolerance):
+    """Regressions against a baseline, as printable lines."""
+    regressions = []
+    limit = 1 + tolerance / 100
+    for route, s in summary.items():
+        base = baseline['routes'].get(route)
+        if base is None or s['count'] < MIN_SAMPLES or base['count'] < MIN_SAMPLES:
+            continue
+        for key in ('p95', 'p99'):
+            if s[key] > base[key] * limit:
+                regressions.append(f'{route}: {key} {s[key]:.1f} ms vs {base[key]:.1f} ms baseline')
+        # one failure more than the baseline's rate is noise, a percentage point is not
+        if s['error_rate'] > base['error_rate'] + max(0.01, 1 / s['count']):
+            regressions.append(f"{route}: error rate {s['error_rate'] * 100:.2f}% "
+                               f"vs {base['error_rate'] * 100:.2f}% baseline")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    url = os.environ.get('DATABASE_URL')
+    if not url:
+        raise RuntimeError('DATABASE_URL environment variable not set')
+    params = {k: getattr(args, k) for k in
+              ('students', 'admins', 'questions', 'ramp', 'duration', 'think', 'autosave', 'seed')}
+    if not args.url:
+        params.update(workers=args.workers, threads=args.threads)
+
+    conn = psycopg2.connect(url, sslmode=os.environ.get('DB_SSLMODE', 'require'))
+    exam_id, students, admins = setup(conn, args)
+    print(f'exam {exam_id}: {args.students} students, {args.admins} admins, {args.questions} questions')
+    server = None
+    try:
+        if args.url:
+            base = args.url.rstrip('/')
+        else:
+            server, base = start_server(args)
+            print(f'started gunicorn ({args.workers} workers x {args.threads} threads) at {base}')
+        before = scrape_metrics(base, admins[0]) if admins else None
+
+        rng = random.Random(args.seed)
+        start_at = time.time() + 1
+        submit_at = start_at + args.ramp + args.duration
+        results, acked = [], []  # list.append is atomic
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=len(admins) or 1) as admin_pool:
+            for email in admins:
+                admin_pool.submit(admin, base, exam_id, email, stop, args, random.Random(rng.random()), results)
+            with ThreadPoolExecutor(max_workers=args.students) as pool:
+                for i, email in enumerate(students):
+                    arrive = start_at + (args.ramp * i / args.students)
+                    pool.submit(student, base, exam_id, email, arrive, submit_at, args,
+                                random.Random(rng.random()), results, acked)
+            acked_at = time.perf_counter()
+            stop.set()
+
+        summary = summarize(results)
+        print_summary(summary)
+
+        cur = conn.cursor()
+        deadline = time.time() + args.timeout
+        while True:
+            cur.execute('SELECT COUNT(*) FROM submissions WHERE exam_id = %s', (exam_id,))
+            rows = cur.fetchone()[0]
+            conn.commit()
+            if rows >= len(acked) or time.time() > deadline:
+                break
+            time.sleep(0.05)
+        cur.close()
+        print(f'\nsubmitted {len(acked)} of {args.students}; {rows} in Postgres '
+              f'{time.perf_counter() - acked_at:.2f}s after the last submit returned')
+        if rows != len(acked):
+            print('MISMATCH: lost or duplicated submissions')
+
+        after = scrape_metrics(base, admins[0]) if before is not None else None
+        if after is not None:
+            print_queries(before, after)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(30)
+        if not args.keep:
+            cleanup(conn, exam_id)
+        conn.close()
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'params': params, 'routes': summary}, f, indent=2)
+        print(f'\nbaseline written to {args.save_baseline}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            print(f"\nwarning: baseline was recorded with {baseline.get('params')}")
+        regressions = compare(summary, baseline, args.tolerance)
+        print(f'\n{len(regressions)} regression(s) against {args.baseline} (tolerance {args.tolerance:g}%)')
+        for line in regressions:
+            print(f'  {line}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
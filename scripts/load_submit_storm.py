@@ -0,0 +1,175 @@
+"""
+Load test: every student of an exam submitting in the same second.
+
+Usage:
+  - Start the app against DATABASE_URL, e.g. `gunicorn app:app -b 127.0.0.1:8000`
+    (SUBMISSION_QUEUE=sync on the server gives the commit-per-request baseline)
+  - Run: python scripts/load_submit_storm.py --url http://127.0.0.1:8000 --students 1000
+
+This script:
+  - Creates N throwaway student accounts and an exam for them (via DATABASE_URL)
+  - Logs every student in and opens the exam page, like a real cohort would
+  - Releases all final submits at once and reports p50/p95/p99/max submit latency
+  - Waits until every acknowledged submission is in `submissions` and
+    reports how long the write-behind queue took to drain
+  - Checks that no submission was lost or written twice, then cleans up (unless --keep)
+"""
+
+import os
+import time
+import argparse
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+import psycopg2
+import psycopg2.extras
+
+load_dotenv()
+
+EMAIL_DOMAIN = 'storm.loadtest'
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Simultaneous-submit load test')
+    p.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the running app')
+    p.add_argument('--students', type=int, default=1000)
+    p.add_argument('--questions', type=int, default=20)
+    p.add_argument('--timeout', type=float, default=120, help='Seconds to wait for the queue to drain')
+    p.add_argument('--keep', action='store_true', help='Keep the accounts, exam and submissions')
+    return p.parse_args()
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Time the submit itself, not the dashboard it redirects to."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def setup(conn, n_students, n_questions):
+    cur = conn.cursor()
+    cur.execute('''
+        INSERT INTO exams (title, duration, created_by, attempts_allowed)
+        VALUES ('Submit storm', 60, NULL, 1) RETURNING id
+    ''')
+    exam_id = cur.fetchone()[0]
+    psycopg2.extras.execute_values(cur, '''
+        INSERT INTO questions (exam_id, question, option1, option2, option3, option4, answer) VALUES %s
+    ''', [(exam_id, f'Question {i}', 'A', 'B', 'C', 'D', 'A') for i in range(n_questions)])
+    cur.execute('SELECT id FROM questions WHERE exam_id = %s ORDER BY id', (exam_id,))
+    question_ids = [r[0] for r in cur.fetchall()]
+    emails = [f'student{i}@{EMAIL_DOMAIN}' for i in range(n_students)]
+    psycopg2.extras.execute_values(cur, '''
+        INSERT INTO users (name, email, mobile, password, role) VALUES %s
+        ON CONFLICT (email) DO NOTHING
+    ''', [(f'Storm {i}', e, '0000000000', 'storm', 'student') for i, e in enumerate(emails)])
+    conn.commit()
+    cur.close()
+    return exam_id, question_ids, emails
+
+
+def cleanup(conn, exam_id):
+    cur = conn.cursor()
+    cur.execute('DELETE FROM submissions WHERE exam_id = %s', (exam_id,))
+    cur.execute('DELETE FROM questions WHERE exam_id = %s', (exam_id,))
+    cur.execute('DELETE FROM exams WHERE id = %s', (exam_id,))
+    cur.execute('DELETE FROM users WHERE email LIKE %s', (f'%@{EMAIL_DOMAIN}',))
+    conn.commit()
+    cur.close()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return float('nan')
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def student(base, exam_id, question_ids, email, barrier, results, idx):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar), NoRedirect)
+
+    def request(path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with opener.open(base + path, body, timeout=300) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    try:
+        request('/login', {'email': email, 'password': 'storm'})
+        request(f'/student/take_exam/{exam_id}')
+    except Exception as e:
+        results[idx] = (None, f'setup: {e}')
+        barrier.abort()
+        return
+
+    form = {f'q{qid}': 'A' for qid in question_ids}
+    form['time_taken'] = 3000 + idx % 600
+    barrier.wait()
+    started = time.perf_counter()
+    try:
+        status = request(f'/student/take_exam/{exam_id}', form)
+    except Exception as e:
+        results[idx] = (None, str(e))
+        return
+    results[idx] = (time.perf_counter() - started, status)
+
+
+def main():
+    args = parse_args()
+    url = os.environ.get('DATABASE_URL')
+    if not url:
+        raise RuntimeError('DATABASE_URL environment variable not set')
+    conn = psycopg2.connect(url, sslmode=os.environ.get('DB_SSLMODE', 'require'))
+    exam_id, question_ids, emails = setup(conn, args.students, args.questions)
+    print(f'exam {exam_id}: {args.students} students, {args.questions} questions')
+
+    barrier = threading.Barrier(args.students)
+    results = [None] * args.students
+    try:
+        with ThreadPoolExecutor(max_workers=args.students) as pool:
+            for i, email in enumerate(emails):
+                pool.submit(student, args.url.rstrip('/'), exam_id, question_ids, email, barrier, results, i)
+        acked_at = time.perf_counter()
+
+        ok = sorted(r[0] for r in results if r and r[0] is not None and r[1] == 302)
+        failed = [r for r in results if not r or r[0] is None or r[1] != 302]
+        print(f'acknowledged {len(ok)}, failed {len(failed)}')
+        for r in failed[:5]:
+            print(f'  {r}')
+        print(f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        print(f'{percentile(ok, 50) * 1000:>8.1f} {percentile(ok, 95) * 1000:>8.1f} '
+              f'{percentile(ok, 99) * 1000:>8.1f} {(ok[-1] if ok else float("nan")) * 1000:>8.1f}')
+
+        cur = conn.cursor()
+        deadline = time.time() + args.timeout
+        while True:
+            cur.execute('''
+                SELECT COUNT(*), COUNT(DISTINCT student_id) FROM submissions WHERE exam_id = %s
+            ''', (exam_id,))
+            rows, students = cur.fetchone()
+            conn.commit()
+            if rows >= len(ok) or time.time() > deadline:
+                break
+            time.sleep(0.05)
+        print(f'in Postgres: {rows} rows for {students} students, '
+              f'drained {time.perf_counter() - acked_at:.2f}s after the last ack')
+        if rows != len(ok) or students != rows:
+            print('MISMATCH: lost or duplicated submissions')
+        cur.close()
+    finally:
+        if not args.keep:
+            cleanup(conn, exam_id)
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
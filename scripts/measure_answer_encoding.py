@@ -0,0 +1,128 @@
+"""
+Compare storage and decode cost of JSON answers vs packed answer_codes.
+
+Usage:
+  python scripts/measure_answer_encoding.py --synthetic --questions 50 --rows 100000
+  python scripts/measure_answer_encoding.py --exam-id 12      # needs DATABASE_URL
+
+Synthetic mode needs no database: it builds an exam with realistic option
+text, encodes random submissions both ways and times decoding a batch into
+a choices matrix. Database mode reports pg_column_size() of both columns and
+decode time for a sample of real rows.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import grading
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Measure answer encoding size and decode time')
+    p.add_argument('--synthetic', action='store_true', help='Use generated data instead of the database')
+    p.add_argument('--questions', type=int, default=50)
+    p.add_argument('--rows', type=int, default=100000)
+    p.add_argument('--exam-id', type=int, help='Exam to sample (database mode)')
+    p.add_argument('--seed', type=int, default=1)
+    return p.parse_args()
+
+
+def synthetic_exam(n_questions, rng):
+    questions = []
+    for i in range(1, n_questions + 1):
+        opts = [f'Option {c} for question {i}: ' + 'x' * rng.randint(5, 40) for c in 'ABCD']
+        questions.append({
+            'id': 1000 + i, 'option1': opts[0], 'option2': opts[1],
+            'option3': opts[2], 'option4': opts[3], 'answer': opts[rng.randint(0, 3)],
+        })
+    return questions
+
+
+def time_decode(label, fn):
+    started = time.perf_counter()
+    out = fn()
+    print(f'{label:<28} {(time.perf_counter() - started) * 1000:>10.1f} ms')
+    return out
+
+
+def run_synthetic(args):
+    rng = random.Random(args.seed)
+    questions = synthetic_exam(args.questions, rng)
+    compiled = grading.compile_answer_key(questions)
+
+    json_rows, code_rows = [], []
+    for _ in range(args.rows):
+        answers = {}
+        for q in questions:
+            pick = rng.randint(0, 4)
+            answers[str(q['id'])] = q[f'option{pick}'] if pick else None
+        json_rows.append(json.dumps(answers))
+        code_rows.append(grading.pack_answers(answers, compiled))
+
+    json_bytes = sum(len(r.encode()) for r in json_rows)
+    code_bytes = sum(len(r) for r in code_rows)
+    print(f'{args.rows} submissions x {args.questions} questions')
+    print(f"{'JSON bytes/submission':<28} {json_bytes / args.rows:>10.1f}")
+    print(f"{'answer_codes bytes/submission':<28} {code_bytes / args.rows:>10.1f}")
+
+    json_matrix = time_decode('decode JSON -> matrix', lambda: np.stack(
+        [grading.encode_answers(json.loads(r), compiled) for r in json_rows]))
+    code_matrix = time_decode('decode codes -> matrix', lambda: np.frombuffer(
+        b''.join(code_rows), dtype=np.int8).reshape(args.rows, args.questions))
+    assert np.array_equal(json_matrix, code_matrix)
+
+
+def run_database(args):
+    from dotenv import load_dotenv
+    import psycopg2
+    load_dotenv()
+    url = os.environ.get('DATABASE_URL')
+    if not url:
+        raise RuntimeError('DATABASE_URL environment variable not set')
+    conn = psycopg2.connect(url, sslmode=os.environ.get('DB_SSLMODE', 'require'))
+    cur = conn.cursor()
+    where = 'WHERE exam_id = %s' if args.exam_id else ''
+    params = (args.exam_id,) if args.exam_id else ()
+    cur.execute(f'''
+        SELECT COUNT(*),
+               AVG(pg_column_size(answers)) FILTER (WHERE answers IS NOT NULL),
+               AVG(pg_column_size(answer_codes)) FILTER (WHERE answer_codes IS NOT NULL),
+               COUNT(*) FILTER (WHERE answer_codes IS NULL)
+        FROM submissions {where}
+    ''', params)
+    total, json_avg, codes_avg, pending = cur.fetchone()
+    print(f'{total} submissions ({pending} not yet backfilled)')
+    print(f"{'JSON bytes/submission':<28} {float(json_avg or 0):>10.1f}")
+    print(f"{'answer_codes bytes/submission':<28} {float(codes_avg or 0):>10.1f}")
+
+    if args.exam_id:
+        cur.execute('''
+            SELECT id, option1, option2, option3, option4, answer
+            FROM questions WHERE exam_id=%s ORDER BY id
+        ''', (args.exam_id,))
+        cols = [d[0] for d in cur.description]
+        compiled = grading.compile_answer_key([dict(zip(cols, r)) for r in cur.fetchall()])
+        cur.execute('''
+            SELECT id, answer_codes, answers, score FROM submissions
+            WHERE exam_id=%s LIMIT %s
+        ''', (args.exam_id, args.rows))
+        rows = cur.fetchall()
+        time_decode(f'decode {len(rows)} rows -> matrix', lambda: grading._choices_for_rows(rows, compiled))
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.synthetic:
+        run_synthetic(args)
+    else:
+        run_database(args)
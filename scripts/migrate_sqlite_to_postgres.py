@@ -7,9 +7,16 @@ Usage:
   - Run: python scripts/migrate_sqlite_to_postgres.py --sqlite-file "C:/Users/.../Google Drive/site.db"
 
 This script:
-  - Creates tables in Postgres if missing
+  - Creates tables in Postgres if missing (runs migrations.py)
   - Copies users, exams, questions, submissions
-  - Preserves relationships by mapping old IDs to new IDs
+  - Preserves relationships by mapping old IDs to new IDs (including the
+    question ids inside each submission's answers)
+  - Numbers each student's attempts at an exam 1..n in submitted_at order,
+    as the unique (exam_id, student_id, attempt_number) index requires
+  - Fills answer_codes from the answers (see grading.py); a submission whose
+    answers don't all match an option keeps only its JSON `answers`
+  - Copies time_taken when the SQLite file has it; site.db predates that
+    column, so its submissions get NULL (the leaderboard sorts them last)
 
 Notes:
   - Keep a backup of your databases before running the migration.
@@ -17,6 +24,7 @@ Notes:
 
 import os
 import argparse
+import sys
 import sqlite3
 import json
 import time
@@ -25,6 +33,10 @@ from dotenv import load_dotenv
 import psycopg2
 import psycopg2.extras
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import upgrade
+import grading
+
 # Load local .env for development
 load_dotenv()
 
@@ -37,49 +49,24 @@ def parse_args():
 
 
 def ensure_pg_tables(pg_conn):
-    cur = pg_conn.cursor()
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            name TEXT,
-            email TEXT UNIQUE,
-            mobile TEXT,
-            password TEXT,
-            role TEXT
-        )
-    ''')
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS exams (
-            id SERIAL PRIMARY KEY,
-            title TEXT,
-            duration INTEGER,
-            created_by INTEGER
-        )
-    ''')
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS questions (
-            id SERIAL PRIMARY KEY,
-            exam_id INTEGER,
-            question TEXT,
-            image TEXT,
-            option1 TEXT,
-            option2 TEXT,
-            option3 TEXT,
-            option4 TEXT,
-            answer TEXT
-        )
-    ''')
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS submissions (
-            id SERIAL PRIMARY KEY,
-            exam_id INTEGER,
-            student_id INTEGER,
-            answers TEXT,
-            score INTEGER,
-            submitted_at TIMESTAMP
-        )
-    ''')
-    pg_conn.commit()
+    upgrade(pg_conn)
+
+
+def _remap_answers(answers_json, question_id_map):
+    """{new question id: answer} for a stored answers JSON; None if it isn't one."""
+    try:
+        answers = json.loads(answers_json) if answers_json else {}
+    except ValueError:
+        return None
+    if not isinstance(answers, dict):
+        return None
+    remapped = {}
+    for qid, value in answers.items():
+        try:
+            remapped[str(question_id_map.get(int(qid), qid))] = value
+        except (TypeError, ValueError):
+            remapped[qid] = value
+    return remapped
 
 
 def migrate(sqlite_path, dry_run=False):
@@ -96,7 +83,7 @@ def migrate(sqlite_path, dry_run=False):
     scur = sconn.cursor()
 
     print('Connecting to Postgres...')
-    pg_conn = psycopg2.connect(DATABASE_URL, sslmode='require')
+    pg_conn = psycopg2.connect(DATABASE_URL, sslmode=os.environ.get('DB_SSLMODE', 'require'))
     pg_conn.autocommit = False
     pg_cur = pg_conn.cursor()
 
@@ -156,6 +143,7 @@ def migrate(sqlite_path, dry_run=False):
         scur.execute('SELECT id, exam_id, question, image, option1, option2, option3, option4, answer FROM questions')
         s_questions = scur.fetchall()
         question_id_map = {}
+        exam_questions = {}  # new exam id -> questions, for the answer keys
         print(f'Found {len(s_questions)} questions')
         for q in s_questions:
             sid = q['id']
@@ -175,18 +163,34 @@ def migrate(sqlite_path, dry_run=False):
             ''', (exam_new, question, image, option1, option2, option3, option4, answer))
             new_id = pg_cur.fetchone()[0]
             question_id_map[sid] = new_id
+            exam_questions.setdefault(exam_new, []).append({
+                'id': new_id, 'option1': option1, 'option2': option2,
+                'option3': option3, 'option4': option4, 'answer': answer})
 
         # --- Submissions ---
         print('Reading submissions from SQLite...')
-        scur.execute('SELECT id, exam_id, student_id, answers, score, submitted_at FROM submissions')
+        columns = {r[1] for r in scur.execute('PRAGMA table_info(submissions)')}
+        time_taken_col = 'time_taken' if 'time_taken' in columns else 'NULL AS time_taken'
+        # attempts in submission order; rows without a time go last
+        scur.execute(f'''
+            SELECT id, exam_id, student_id, answers, score, submitted_at, {time_taken_col}
+            FROM submissions ORDER BY submitted_at IS NULL, submitted_at, id
+        ''')
         s_subs = scur.fetchall()
         print(f'Found {len(s_subs)} submissions')
+        compiled_keys = {exam: grading.compile_answer_key(qs) for exam, qs in exam_questions.items()}
+        attempts = {}
         for s in s_subs:
             exam_old = s['exam_id']
             exam_new = exam_id_map.get(exam_old)
             student_old = s['student_id']
             student_new = user_id_map.get(student_old)
-            answers = s['answers']
+            answers = _remap_answers(s['answers'], question_id_map)
+            compiled = compiled_keys.get(exam_new)
+            answer_codes = None
+            if compiled is not None and answers is not None and grading.lossless(answers, compiled):
+                answer_codes = grading.pack_answers(answers, compiled)
+            attempt_number = attempts[(exam_new, student_new)] = attempts.get((exam_new, student_new), 0) + 1
             score = s['score']
             submitted_at = s['submitted_at']
             # Attempt to parse timestamp if string
@@ -201,9 +205,12 @@ def migrate(sqlite_path, dry_run=False):
                     except Exception:
                         submitted_at_val = None
             pg_cur.execute('''
-                INSERT INTO submissions (exam_id, student_id, answers, score, submitted_at)
-                VALUES (%s,%s,%s,%s,%s)
-            ''', (exam_new, student_new, answers, score, submitted_at_val))
+                INSERT INTO submissions (exam_id, student_id, answers, answer_codes, score,
+                                         attempt_number, submitted_at, time_taken)
+                VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+            ''', (exam_new, student_new, json.dumps(answers) if answers is not None else s['answers'],
+                  psycopg2.Binary(answer_codes) if answer_codes is not None else None,
+                  score, attempt_number, submitted_at_val, s['time_taken']))
 
         if dry_run:
             print('\nDry-run mode enabled. Rolling back changes.')
@@ -0,0 +1,79 @@
+"""
+Move question images saved before the content-addressed store into it.
+
+Usage:
+  - Set DATABASE_URL
+  - Run: python scripts/migrate_uploads_to_store.py [--dry-run] [--delete-originals]
+
+This script:
+  - Finds question images stored as plain file names in static/uploads
+  - Saves each into the store (deduplicated by content) and builds its resized variants
+  - Points every question at the new name and bumps the affected exams'
+    content_version so cached exams pick the change up
+  - Optionally deletes the old files once nothing references them
+"""
+
+import os
+import sys
+import argparse
+
+from dotenv import load_dotenv
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+load_dotenv()
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Move legacy question images into the image store')
+    p.add_argument('--dry-run', action='store_true', help='Only report what would change')
+    p.add_argument('--delete-originals', action='store_true', help='Remove the old files afterwards')
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    import image_store
+
+    url = os.environ.get('DATABASE_URL')
+    if not url:
+        raise RuntimeError('DATABASE_URL environment variable not set')
+    conn = psycopg2.connect(url, sslmode=os.environ.get('DB_SSLMODE', 'require'))
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT image, array_agg(DISTINCT exam_id) FROM questions
+        WHERE image IS NOT NULL AND image <> '' AND position('/' in image) = 0
+        GROUP BY image
+    ''')
+    legacy = cur.fetchall()
+    print(f'{len(legacy)} legacy image(s) referenced')
+
+    moved, missing = 0, 0
+    for old, exam_ids in legacy:
+        path = os.path.join(image_store.ROOT, old)
+        if not os.path.exists(path):
+            print(f'  missing on disk: {old}')
+            missing += 1
+            continue
+        if args.dry_run:
+            print(f'  would move {old} (exams {exam_ids})')
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        new = image_store.save_image(data, old, background=False)
+        cur.execute('UPDATE questions SET image = %s WHERE image = %s', (new, old))
+        cur.execute('UPDATE exams SET content_version = content_version + 1 WHERE id = ANY(%s)', (exam_ids,))
+        conn.commit()
+        moved += 1
+        if args.delete_originals:
+            os.remove(path)
+        print(f'  {old} -> {new}')
+
+    cur.close()
+    conn.close()
+    print(f'moved {moved}, missing {missing}')
+
+
+if __name__ == '__main__':
+    main()
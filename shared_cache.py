@@ -0,0 +1,205 @@
+"""
+Host-local cache tier shared by every gunicorn worker on the machine.
+
+Two pieces live in EXAM_SHARED_CACHE_DIR (tmpfs by default):
+
+  index.bin          a memory-mapped array of per-slot generation counters.
+                     Workers read their slot on every lookup (a plain memory
+                     read, no syscall), so one `invalidate()` in any worker is
+                     seen by all of them on their next request.
+  <id>-<gen>.v<schema>.bin
+                     the payload for an exam at that generation, as bytes
+                     the caller encoded; written once and handed to readers
+                     as a read-only mmap, so array sections can be used in
+                     place and share the page cache. <schema> is the
+                     caller's format version, so after a deploy that changes
+                     it (the index survives restarts) old files are simply
+                     never read.
+
+Exam ids hash into SLOTS counters; a collision only causes a spurious
+reload, never a stale read. Payloads are plain data, never pickles, and the
+directory must be private to this user (mode 0700, our uid) or the tier
+turns itself off. Also disabled where fcntl is missing (Windows dev
+machines) or the directory can't be created.
+"""
+
+import glob
+import logging
+import mmap
+import os
+import stat
+import struct
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+SLOTS = 4096
+_SLOT = struct.Struct('<q')
+
+
+def _default_dir():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, f'sac-exam-cache-{os.getuid()}')
+
+
+CACHE_DIR = os.environ.get('EXAM_SHARED_CACHE_DIR') or _default_dir()
+ENABLED = fcntl is not None and os.environ.get('EXAM_SHARED_CACHE', '1') != '0'
+
+logger = logging.getLogger('sac.shared_cache')
+
+_lock = threading.Lock()
+_index = None
+_index_fd = None
+_index_pid = None
+
+
+def _open_index():
+    """mmap the index file once per process."""
+    global _index, _index_fd, _index_pid, ENABLED
+    if _index is not None and _index_pid == os.getpid():
+        return _index
+    with _lock:
+        if _index is not None and _index_pid == os.getpid():
+            return _index
+        try:
+            os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+            if not _private(os.lstat(CACHE_DIR)):
+                logger.warning('%s is not a private directory of this user; shared cache disabled', CACHE_DIR)
+                ENABLED = False
+                return None
+            fd = os.open(os.path.join(CACHE_DIR, 'index.bin'), os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+            if not _private(os.fstat(fd)):
+                os.close(fd)
+                logger.warning('%s/index.bin is not ours; shared cache disabled', CACHE_DIR)
+                ENABLED = False
+                return None
+            size = SLOTS * _SLOT.size
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            _index = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            _index_fd = fd
+            _index_pid = os.getpid()
+        except OSError:
+            ENABLED = False
+            return None
+    return _index
+
+
+def _private(st):
+    """Owned by us and closed to group/other (a planted file or dir is not)."""
+    return st.st_uid == os.getuid() and not st.st_mode & 0o077 and not stat.S_ISLNK(st.st_mode)
+
+
+def _offset(key):
+    return (key % SLOTS) * _SLOT.size
+
+
+def generation(key):
+    """Current generation for `key`, or None when the shared tier is off."""
+    if not ENABLED:
+        return None
+    index = _open_index()
+    if index is None:
+        return None
+    return _SLOT.unpack_from(index, _offset(key))[0]
+
+
+def _path(key, gen, schema):
+    return os.path.join(CACHE_DIR, f'{key}-{gen}.v{schema}.bin')
+
+
+def get(key, gen, schema=0):
+    """A read-only mmap of the bytes stored for `key` at generation `gen`, if any.
+
+    The mapping stays valid after invalidate() removes the file, so views
+    into it can be kept for as long as they are referenced.
+    """
+    if gen is None:
+        return None
+    try:
+        fd = os.open(_path(key, gen, schema), os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    try:
+        if not _private(os.fstat(fd)):
+            return None
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # ValueError: empty file
+        return None
+    finally:
+        os.close(fd)
+
+
+def put(key, gen, data, schema=0):
+    """Publish the bytes `data` for `key` unless it was invalidated meanwhile."""
+    if gen is None or generation(key) != gen:
+        return False
+    try:
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, _path(key, gen, schema))
+    except OSError:
+        return False
+    # Lost a race with invalidate(): don't leave an orphan behind.
+    if generation(key) != gen:
+        try:
+            os.remove(_path(key, gen, schema))
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def _remove(key):
+    for path in glob.glob(os.path.join(CACHE_DIR, f'{key}-*.*')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def invalidate(key):
+    """Bump `key`'s generation for every worker and drop its stored payloads."""
+    if not ENABLED:
+        return
+    index = _open_index()
+    if index is None:
+        return
+    fcntl.flock(_index_fd, fcntl.LOCK_EX)
+    try:
+        off = _offset(key)
+        gen = _SLOT.unpack_from(index, off)[0] + 1
+        _SLOT.pack_into(index, off, gen)
+    finally:
+        fcntl.flock(_index_fd, fcntl.LOCK_UN)
+    _remove(key)
+
+
+def clear():
+    """Invalidate everything (used after bulk changes)."""
+    if not ENABLED:
+        return
+    index = _open_index()
+    if index is None:
+        return
+    fcntl.flock(_index_fd, fcntl.LOCK_EX)
+    try:
+        for slot in range(SLOTS):
+            off = slot * _SLOT.size
+            _SLOT.pack_into(index, off, _SLOT.unpack_from(index, off)[0] + 1)
+    finally:
+        fcntl.flock(_index_fd, fcntl.LOCK_UN)
+    for path in glob.glob(os.path.join(CACHE_DIR, '*-*.*')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,265 @@
+"""
+Slow-query log with sampled EXPLAIN ANALYZE plans.
+
+Registered on db.query_hooks, so it sees every statement run on a pooled
+connection. One that takes longer than SLOW_QUERY_MS is appended to a
+JSON-lines log with:
+  - its normalized text (literals and placeholders become `?`, VALUES and
+    IN lists collapse) and a fingerprint of it
+  - the shape of its parameters, e.g. `(int, str, list[3])`; never values
+  - duration, rows returned and the endpoint that ran it
+
+With SLOW_QUERY_EXPLAIN above 0, that fraction of slow read-only
+statements (at most one per fingerprint every EXPLAIN_COOLDOWN seconds)
+is re-run as `EXPLAIN (ANALYZE, BUFFERS)` on a background thread with its
+own connection, and the plan is logged next to it. The request that ran
+the slow statement doesn't wait for it. Plans show the actual filter
+values, so the log belongs to admins only.
+
+Slow statements are rare, so every record opens the log, appends one line
+and closes it again under an flock; that keeps the gunicorn workers from
+interleaving and lets any of them rotate the file (SLOW_QUERY_LOG_BYTES,
+SLOW_QUERY_LOG_BACKUPS). `worst()` ranks fingerprints by total time across
+the log and its backups for the admin page.
+
+Environment:
+  SLOW_QUERY_MS           threshold in milliseconds (default 250; 0 logs
+                          everything, a negative value turns the log off)
+  SLOW_QUERY_EXPLAIN      fraction of slow SELECTs to EXPLAIN (default 0)
+  SLOW_QUERY_LOG          log file (default <tmp>/sac-slow-queries.log)
+  SLOW_QUERY_LOG_BYTES    rotate above this size (default 10 MB)
+  SLOW_QUERY_LOG_BACKUPS  rotated files to keep (default 3)
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import has_request_context, request
+
+import db
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_MS', 250))
+EXPLAIN_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN', 0))
+LOG_PATH = os.environ.get('SLOW_QUERY_LOG') or os.path.join(tempfile.gettempdir(), 'sac-slow-queries.log')
+MAX_BYTES = int(os.environ.get('SLOW_QUERY_LOG_BYTES', 10 * 1024 * 1024))
+BACKUPS = int(os.environ.get('SLOW_QUERY_LOG_BACKUPS', 3))
+EXPLAIN_COOLDOWN = 300
+EXPLAIN_TIMEOUT_MS = 30000
+MAX_PENDING_EXPLAINS = 4
+MAX_SQL_LENGTH = 4000
+
+_STRING = re.compile(r"[EeBbXxUu]?'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w$.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s')
+_TUPLE = re.compile(r'\(\s*(?:(?:\?|NULL|TRUE|FALSE)(?:::[\w ]+?)?\s*,\s*)*(?:\?|NULL|TRUE|FALSE)(?:::[\w ]+?)?\s*\)',
+                    re.IGNORECASE)
+_REPEATED = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+_ARRAY = re.compile(r'ARRAY\[[^\]]*\]', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+_WRITES = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|CREATE|DROP|ALTER|TRUNCATE|COPY|CALL|LOCK|NEXTVAL|SETVAL)\b',
+                     re.IGNORECASE)
+
+_local = threading.local()
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+_pending = 0
+_explained = {}  # fingerprint -> when it was last explained
+
+
+def normalize(sql):
+    """SQL text with every literal replaced, for grouping."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = _STRING.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _TUPLE.sub('(...)', sql)
+    sql = _REPEATED.sub('(...), ...', sql)
+    sql = _ARRAY.sub('ARRAY[...]', sql)
+    return _SPACE.sub(' ', sql).strip()[:MAX_SQL_LENGTH]
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+
+def _type(value):
+    if isinstance(value, (list, tuple)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return 'null' if value is None else type(value).__name__
+
+
+def param_shape(vars):
+    """Types (never values) of a statement's parameters."""
+    if vars is None:
+        return None
+    if isinstance(vars, dict):
+        return '{' + ', '.join(f'{k}: {_type(v)}' for k, v in vars.items()) + '}'
+    if isinstance(vars, list) and vars and isinstance(vars[0], (list, tuple, dict)):
+        # executemany()
+        return f'{len(vars)} x {param_shape(vars[0])}'
+    return '(' + ', '.join(_type(v) for v in vars) + ')'
+
+
+def _rotate():
+    for i in range(BACKUPS - 1, 0, -1):
+        if os.path.exists(f'{LOG_PATH}.{i}'):
+            os.replace(f'{LOG_PATH}.{i}', f'{LOG_PATH}.{i + 1}')
+    if BACKUPS > 0:
+        os.replace(LOG_PATH, f'{LOG_PATH}.1')
+    else:
+        os.remove(LOG_PATH)
+
+
+def _append(record):
+    line = json.dumps(record, default=str) + '\n'
+    os.makedirs(os.path.dirname(LOG_PATH) or '.', exist_ok=True)
+    with open(f'{LOG_PATH}.lock', 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(LOG_PATH) and os.path.getsize(LOG_PATH) + len(line) > MAX_BYTES:
+                _rotate()
+            with open(LOG_PATH, 'a') as f:
+                f.write(line)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='explain')
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def _explain(fp, statement):
+    """EXPLAIN ANALYZE one statement on a separate connection and log the plan."""
+    global _pending
+    _local.explaining = True
+    conn = None
+    try:
+        conn = db.checkout_connection()
+        cur = conn.cursor()
+        cur.execute(f'SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}')
+        cur.execute(b'EXPLAIN (ANALYZE, BUFFERS) ' + statement)
+        plan = '\n'.join(r[0] for r in cur.fetchall())
+        cur.close()
+        _append({'type': 'explain', 'at': datetime.now().isoformat(timespec='seconds'),
+                 'fingerprint': fp, 'plan': plan})
+    except Exception as e:
+        _append({'type': 'explain', 'at': datetime.now().isoformat(timespec='seconds'),
+                 'fingerprint': fp, 'error': str(e)})
+    finally:
+        if conn is not None:
+            conn.rollback()  # ANALYZE ran the statement; keep nothing
+            conn.close()
+        _local.explaining = False
+        with _lock:
+            _pending -= 1
+
+
+def _maybe_explain(fp, normalized, cursor, query, vars):
+    global _pending
+    if EXPLAIN_RATE <= 0 or random.random() >= EXPLAIN_RATE:
+        return
+    head = normalized.split(' ', 1)[0].upper()
+    if head not in ('SELECT', 'WITH') or _WRITES.search(normalized):
+        return  # ANALYZE executes the statement: reads only
+    # bind the statement itself: a named cursor's cursor.query is its DECLARE
+    statement = cursor.mogrify(query, vars)
+    if not statement:
+        return
+    now = time.monotonic()
+    with _lock:
+        if now - _explained.get(fp, -EXPLAIN_COOLDOWN) < EXPLAIN_COOLDOWN or _pending >= MAX_PENDING_EXPLAINS:
+            return
+        _explained[fp] = now
+        _pending += 1
+    _get_executor().submit(_explain, fp, statement)
+
+
+def _on_query(cursor, query, vars, seconds):
+    if seconds * 1000 < THRESHOLD_MS or getattr(_local, 'explaining', False):
+        return
+    try:
+        normalized = normalize(query)
+        fp = fingerprint(normalized)
+        _append({
+            'type': 'query',
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'fingerprint': fp,
+            'sql': normalized,
+            'params': param_shape(vars),
+            'ms': round(seconds * 1000, 2),
+            'rows': cursor.rowcount if cursor.description is not None else None,
+            'endpoint': request.endpoint if has_request_context() else None,
+        })
+        _maybe_explain(fp, normalized, cursor, query, vars)
+    except Exception:
+        pass  # the slow-query log must never fail the query it is watching
+
+
+def _records():
+    paths = [f'{LOG_PATH}.{i}' for i in range(BACKUPS, 0, -1)] + [LOG_PATH]
+    for path in paths:
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except OSError:
+            continue
+
+
+def worst(limit=50):
+    """Fingerprints ranked by total time, with their latest plan."""
+    groups, plans = {}, {}
+    for record in _records():
+        fp = record.get('fingerprint')
+        if record.get('type') == 'explain':
+            plans[fp] = record
+            continue
+        group = groups.get(fp)
+        if group is None:
+            group = groups[fp] = {'fingerprint': fp, 'sql': record['sql'], 'params': record['params'],
+                                  'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'endpoints': set(),
+                                  'last_at': None}
+        group['count'] += 1
+        group['total_ms'] += record['ms']
+        group['max_ms'] = max(group['max_ms'], record['ms'])
+        group['last_at'] = record['at']
+        if record.get('endpoint'):
+            group['endpoints'].add(record['endpoint'])
+    ranked = sorted(groups.values(), key=lambda g: g['total_ms'], reverse=True)[:limit]
+    for group in ranked:
+        group['mean_ms'] = round(group['total_ms'] / group['count'], 2)
+        group['total_ms'] = round(group['total_ms'], 2)
+        group['endpoints'] = sorted(group['endpoints'])
+        plan = plans.get(group['fingerprint'])
+        group['plan'] = plan and (plan.get('plan') or f"EXPLAIN failed: {plan.get('error')}")
+    return ranked
+
+
+def init_app(app):
+    if THRESHOLD_MS >= 0 and _on_query not in db.query_hooks:
+        db.query_hooks.append(_on_query)
@@ -0,0 +1,157 @@
+"""
+Fingerprinted, precompressed static assets.
+
+At startup every file under `static/` (except uploads) is hashed and
+`url_for('static', filename='css/style.css')` starts producing
+`css/style.<hash>.css`. Those names change whenever the content does, so
+they are served with `Cache-Control: immutable` and a one-year max-age, and
+browsers stop revalidating them on every page. Unhashed names still work,
+with Flask's normal caching, for anything that hardcodes a path.
+
+Text assets also get gzip (and brotli, when the `brotli` package is
+installed) copies in STATIC_BUILD_DIR, written once per content hash. The
+static view picks the best one the client accepts and sends it with the
+matching Content-Encoding and `Vary: Accept-Encoding`.
+
+Content-addressed question images (see image_store.py) are immutable by
+construction and get the same long-lived headers.
+
+`python static_assets.py` prebuilds the compressed copies, e.g. in a
+release step; otherwise the first worker to start does it.
+
+Environment:
+  STATIC_FINGERPRINT  set to 0 to turn fingerprinting off (e.g. while editing CSS)
+  STATIC_BUILD_DIR    where compressed copies are written
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+
+from flask import request, send_file
+
+try:
+    import brotli
+except ImportError:  # optional: gzip alone still works
+    brotli = None
+
+ENABLED = os.environ.get('STATIC_FINGERPRINT', '1') != '0'
+BUILD_DIR = os.environ.get('STATIC_BUILD_DIR') or os.path.join(tempfile.gettempdir(), 'sac-static')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+MIN_COMPRESS_BYTES = 256
+SKIP_DIRS = {'uploads'}
+
+_STORED_IMAGE = re.compile(r'^uploads/[0-9a-f]{2}/[0-9a-f]{64}(-\d+w)?\.\w+$')
+
+
+class Manifest:
+    """Logical name <-> fingerprinted name, plus the compressed copies of each."""
+
+    def __init__(self):
+        self.urls = {}      # 'css/style.css' -> 'css/style.1a2b3c4d5e.css'
+        self.files = {}     # 'css/style.1a2b3c4d5e.css' -> (source path, {encoding: path})
+
+
+def _fingerprinted(name, digest):
+    root, ext = os.path.splitext(name)
+    return f'{root}.{digest[:10]}{ext}'
+
+
+def _compress(data, digest, ext):
+    """Write gzip/brotli copies keyed by content hash; returns {encoding: path}."""
+    variants = {}
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    encoders = [('gzip', '.gz', lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        encoders.insert(0, ('br', '.br', lambda d: brotli.compress(d, quality=11)))
+    for encoding, suffix, encode in encoders:
+        path = os.path.join(BUILD_DIR, f'{digest}{ext}{suffix}')
+        if not os.path.exists(path):
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(encode(data))
+            os.replace(tmp, path)
+        # not worth a Content-Encoding if it didn't shrink
+        if os.path.getsize(path) < len(data):
+            variants[encoding] = path
+    return variants
+
+
+def build(static_folder):
+    """Hash (and compress) every asset under `static_folder`."""
+    manifest = Manifest()
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        if dirpath == static_folder:
+            dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            name = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+            ext = os.path.splitext(filename)[1].lower()
+            variants = {}
+            if ext in COMPRESSIBLE and len(data) >= MIN_COMPRESS_BYTES:
+                variants = _compress(data, digest, ext)
+            hashed = _fingerprinted(name, digest)
+            manifest.urls[name] = hashed
+            manifest.files[hashed] = (path, variants)
+    return manifest
+
+
+def _send_immutable(path, mimetype, encoding=None):
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    response.headers['Cache-Control'] = IMMUTABLE
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    """Fingerprint `app.static_folder` and take over the `static` endpoint."""
+    if not ENABLED:
+        return
+    manifest = build(app.static_folder)
+    default_static = app.view_functions['static']
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = manifest.urls.get(values['filename'], values['filename'])
+
+    def static(filename):
+        entry = manifest.files.get(filename)
+        if entry is None:
+            response = default_static(filename=filename)
+            if _STORED_IMAGE.match(filename):
+                response.headers['Cache-Control'] = IMMUTABLE
+            return response
+
+        path, variants = entry
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        accepted = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in variants and accepted[encoding] > 0:
+                response = _send_immutable(variants[encoding], mimetype, encoding)
+                break
+        else:
+            response = _send_immutable(path, mimetype)
+        if variants:
+            response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = static
+    app.extensions['static_assets'] = manifest
+
+
+if __name__ == '__main__':
+    here = os.path.dirname(os.path.abspath(__file__))
+    built = build(os.path.join(here, 'static'))
+    for logical, hashed in sorted(built.urls.items()):
+        encodings = ', '.join(sorted(built.files[hashed][1])) or '-'
+        print(f'{logical:<30} {hashed:<40} {encodings}')
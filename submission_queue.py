@@ -0,0 +1,388 @@
+"""
+Write-behind intake for exam submissions.
+
+When an exam's timer runs out every student auto-submits within the same
+second. Instead of each POST waiting on its own Postgres INSERT + COMMIT,
+the graded submission is appended to a local SQLite database in WAL mode
+(one fsync'd row per submit) and the student is answered at once. A
+flusher thread in each worker then moves queued rows into `submissions`
+in batches.
+
+Exactly once: every queued row carries a unique token that is written to
+`submissions.submit_token` (unique index, migration 8). The token comes
+from the exam form (see take_exam), so a double submit of the same page
+(the tab-switch auto-submit racing the button) queues once. A batch is
+written by one autocommitted statement (FLUSH_SQL) that skips tokens
+already present, and only then marked flushed locally, so a worker dying
+between the two just replays the batch and the replay inserts nothing.
+Claimed rows carry a lease (CLAIM_LEASE); if the claiming process dies the
+rows become claimable again when it expires.
+
+Attempt numbers are assigned in that same statement from the rows already
+in Postgres, and the unique (exam_id, student_id, attempt_number) index
+(migration 9) makes duplicates impossible even with several flushers.
+Rows over the exam's attempt limit (or for a deleted exam) are marked
+`rejected` locally instead of being inserted.
+
+The queue file has to be on a disk that survives a process restart and is
+shared by every worker on the host, so async mode needs
+SUBMISSION_QUEUE_PATH set and refuses to start without it (a dyno's temp
+dir does not survive a restart). Without it the queue runs in sync mode:
+each request flushes its own row and the student is only told the submit
+went through once it is in Postgres (QueueError otherwise). Until a row is
+flushed only this host knows about it; pending_count()/pending_counts() let
+attempt checks include it.
+
+Environment:
+  SUBMISSION_QUEUE            'async' or 'sync' to flush inside the request
+                              (default: async if SUBMISSION_QUEUE_PATH is set)
+  SUBMISSION_QUEUE_PATH       SQLite file on persistent storage
+                              (sync mode falls back to <tmp>/sac-submission-queue.db)
+  SUBMISSION_QUEUE_BATCH      rows per flush (default 500)
+  SUBMISSION_QUEUE_INTERVAL   seconds between flushes when idle (default 0.25)
+  SUBMISSION_QUEUE_RETENTION  seconds to keep flushed/rejected rows (default 7 days)
+"""
+
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import psycopg2
+import psycopg2.extras
+
+from db import checkout_connection
+
+MODE = os.environ.get('SUBMISSION_QUEUE') or ('async' if os.environ.get('SUBMISSION_QUEUE_PATH') else 'sync')
+if MODE != 'sync' and not os.environ.get('SUBMISSION_QUEUE_PATH'):
+    raise RuntimeError('SUBMISSION_QUEUE=async needs SUBMISSION_QUEUE_PATH on persistent storage '
+                       '(or set SUBMISSION_QUEUE=sync)')
+# sync mode only holds a row for the length of its request
+PATH = os.environ.get('SUBMISSION_QUEUE_PATH') or os.path.join(tempfile.gettempdir(), 'sac-submission-queue.db')
+BATCH_SIZE = int(os.environ.get('SUBMISSION_QUEUE_BATCH', 500))
+INTERVAL = float(os.environ.get('SUBMISSION_QUEUE_INTERVAL', 0.25))
+RETENTION = float(os.environ.get('SUBMISSION_QUEUE_RETENTION', 7 * 86400))
+CLAIM_LEASE = 30
+MAX_BACKOFF = 60
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS queued_submissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token TEXT NOT NULL UNIQUE,
+    exam_id INTEGER NOT NULL,
+    student_id INTEGER NOT NULL,
+    answer_codes BLOB,
+    score INTEGER,
+    submitted_at TEXT NOT NULL,
+    time_taken INTEGER,
+    state TEXT NOT NULL DEFAULT 'pending',
+    claimed_until REAL NOT NULL DEFAULT 0,
+    tries INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    enqueued_at REAL NOT NULL,
+    done_at REAL
+);
+CREATE INDEX IF NOT EXISTS queued_submissions_pending
+    ON queued_submissions (state, claimed_until, id);
+CREATE INDEX IF NOT EXISTS queued_submissions_student
+    ON queued_submissions (student_id, exam_id) WHERE state = 'pending';
+'''
+
+# One statement per batch: number the new attempts, insert those within the
+# exam's limit and report what happened to every token. The unique indexes
+# on submit_token and (exam_id, student_id, attempt_number) arbitrate
+# between concurrent flushers; a row that loses a race comes back as
+# 'requeue' and is numbered again on the next pass.
+FLUSH_SQL = '''
+    WITH v AS (
+        SELECT * FROM (VALUES %s) AS v (seq, exam_id, student_id, answer_codes, score,
+                                        submitted_at, time_taken, token)
+    ), numbered AS (
+        SELECT v.*, e.id IS NULL AS no_exam, COALESCE(e.attempts_allowed, 1) AS allowed,
+               EXISTS (SELECT 1 FROM submissions s WHERE s.submit_token = v.token) AS done,
+               p.n + row_number() OVER (
+                   PARTITION BY v.exam_id, v.student_id,
+                                EXISTS (SELECT 1 FROM submissions s WHERE s.submit_token = v.token)
+                   ORDER BY v.seq) AS attempt_number
+        FROM v
+        LEFT JOIN exams e ON e.id = v.exam_id
+        CROSS JOIN LATERAL (
+            SELECT COUNT(*) AS n FROM submissions s
+            WHERE s.exam_id = v.exam_id AND s.student_id = v.student_id
+        ) p
+    ), inserted AS (
+        INSERT INTO submissions
+            (exam_id, student_id, answer_codes, score, attempt_number, submitted_at, time_taken, submit_token)
+        SELECT exam_id, student_id, answer_codes, score, attempt_number, submitted_at, time_taken, token
+        FROM numbered
+        WHERE NOT done AND NOT no_exam AND attempt_number <= allowed
+        ON CONFLICT DO NOTHING
+        RETURNING submit_token
+    )
+    SELECT n.token,
+           CASE WHEN n.done OR i.submit_token IS NOT NULL THEN 'flushed'
+                WHEN n.no_exam OR n.attempt_number > n.allowed THEN 'rejected'
+                ELSE 'requeue' END
+    FROM numbered n LEFT JOIN inserted i ON i.submit_token = n.token
+'''
+VALUES_TEMPLATE = '(%s::int, %s::int, %s::int, %s::bytea, %s::int, %s::timestamp, %s::int, %s::text)'
+
+_TOKEN_RE = re.compile(r'^[0-9a-f]{32}$')
+
+class QueueError(RuntimeError):
+    """A sync-mode submission that did not make it into Postgres."""
+
+
+class QueueRejected(QueueError):
+    """A sync-mode submission over the attempt limit (or for a deleted exam)."""
+
+
+_local = threading.local()
+_lock = threading.Lock()
+_wake = threading.Event()
+_flusher = None
+_flusher_pid = None
+_last_error = None
+
+
+def _sqlite():
+    """This thread's connection to the queue file."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(PATH, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=FULL')  # a submit is durable once acknowledged
+        conn.executescript(SCHEMA)
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+def new_form_token():
+    """Idempotency token to render into an exam form."""
+    return uuid.uuid4().hex
+
+
+def submit_token(student_id, form_token):
+    """The queue/submissions token for a POSTed form token.
+
+    Scoped by student so one student's token can never shadow another's; a
+    missing or malformed token gets a fresh one (that POST just can't be
+    deduplicated).
+    """
+    if not form_token or not _TOKEN_RE.match(form_token):
+        form_token = new_form_token()
+    return f'{student_id}-{form_token}'
+
+
+def enqueue(exam_id, student_id, answer_codes, score, submitted_at, time_taken, token=None):
+    """Durably queue a graded submission; returns its token.
+
+    Queuing the same token twice is a no-op. In sync mode the row is flushed
+    before returning; QueueRejected is raised if the flush rejected it, and
+    QueueError (with nothing left queued) if it could not be written.
+    """
+    token = token or uuid.uuid4().hex
+    _sqlite().execute('''
+        INSERT OR IGNORE INTO queued_submissions
+            (token, exam_id, student_id, answer_codes, score, submitted_at, time_taken, enqueued_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (token, exam_id, student_id, answer_codes, score, submitted_at.isoformat(),
+          time_taken, time.time()))
+    if MODE == 'sync':
+        _flush_own(token)
+    else:
+        ensure_flusher()
+        _wake.set()
+    return token
+
+
+def pending_count(exam_id, student_id):
+    """Queued, not yet flushed submissions of one student for one exam."""
+    row = _sqlite().execute('''
+        SELECT COUNT(*) FROM queued_submissions
+        WHERE student_id = ? AND exam_id = ? AND state = 'pending'
+    ''', (student_id, exam_id)).fetchone()
+    return row[0]
+
+
+def pending_counts(student_id):
+    """{exam_id: queued submissions} for one student."""
+    rows = _sqlite().execute('''
+        SELECT exam_id, COUNT(*) FROM queued_submissions
+        WHERE student_id = ? AND state = 'pending' GROUP BY exam_id
+    ''', (student_id,)).fetchall()
+    return dict(rows)
+
+
+def _flush_own(token):
+    """Sync mode: flush this request's row and make sure it landed."""
+    for _ in range(3):  # a lost attempt-number race comes back pending
+        flush(token=token)
+        state, error = _sqlite().execute(
+            'SELECT state, error FROM queued_submissions WHERE token = ?', (token,)).fetchone()
+        if state != 'pending':
+            break
+    if state == 'rejected':
+        raise QueueRejected('attempt limit reached or exam deleted')
+    if state == 'pending':
+        # not acknowledged, so it must not turn up later; a resubmit requeues it
+        _sqlite().execute("DELETE FROM queued_submissions WHERE token = ? AND state = 'pending'", (token,))
+        raise QueueError(error or 'could not save the submission')
+
+
+def _claim(limit, token=None):
+    conn = _sqlite()
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute(f'''
+            SELECT id, exam_id, student_id, answer_codes, score, submitted_at, time_taken, token
+            FROM queued_submissions
+            WHERE state = 'pending' AND claimed_until < ?{' AND token = ?' if token else ''}
+            ORDER BY id LIMIT ?
+        ''', (now, token, limit) if token else (now, limit)).fetchall()
+        if rows:
+            conn.execute(f'''
+                UPDATE queued_submissions SET claimed_until = ?, tries = tries + 1
+                WHERE id IN ({','.join('?' * len(rows))})
+            ''', [now + CLAIM_LEASE] + [r[0] for r in rows])
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return rows
+
+
+def _settle(ids_by_state, error=None):
+    conn = _sqlite()
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for state, ids in ids_by_state.items():
+            if not ids:
+                continue
+            marks = ','.join('?' * len(ids))
+            if state == 'requeue':
+                # lost a race for an attempt number; renumber on the next pass
+                conn.execute(f'''
+                    UPDATE queued_submissions SET claimed_until = 0 WHERE id IN ({marks})
+                ''', ids)
+            elif state == 'retry':
+                # back off exponentially on repeated failures
+                conn.execute(f'''
+                    UPDATE queued_submissions
+                    SET claimed_until = ? + MIN(?, 1 << MIN(tries, 10)), error = ?
+                    WHERE id IN ({marks})
+                ''', [now, MAX_BACKOFF, error] + ids)
+            else:
+                conn.execute(f'''
+                    UPDATE queued_submissions SET state = ?, done_at = ?, error = ?
+                    WHERE id IN ({marks})
+                ''', [state, now, error if state == 'rejected' else None] + ids)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def flush(limit=BATCH_SIZE, token=None):
+    """Move one batch of queued submissions (or just `token`) into Postgres; returns rows handled."""
+    global _last_error
+    rows = _claim(limit, token)
+    if not rows:
+        return 0
+
+    values = [(seq, exam_id, student_id, answer_codes, score,
+               datetime.fromisoformat(submitted_at), time_taken, token)
+              for seq, (_, exam_id, student_id, answer_codes, score, submitted_at, time_taken, token)
+              in enumerate(rows)]
+    ids = {r[7]: r[0] for r in rows}
+    conn = None
+    try:
+        conn = checkout_connection()
+        # a single statement is atomic on its own; autocommit saves the
+        # COMMIT round trip
+        conn.raw.autocommit = True
+        cur = conn.cursor()
+        outcome = psycopg2.extras.execute_values(
+            cur, FLUSH_SQL, values, template=VALUES_TEMPLATE, page_size=len(values), fetch=True)
+        cur.close()
+    except Exception as e:
+        _last_error = f'{datetime.now():%Y-%m-%d %H:%M:%S} {e}'
+        _settle({'retry': list(ids.values())}, error=str(e))
+        return 0
+    finally:
+        if conn is not None:
+            conn.raw.autocommit = False
+            conn.close()
+
+    by_state = {'flushed': [], 'rejected': [], 'requeue': []}
+    for token, state in outcome:
+        by_state[state].append(ids[token])
+    _settle(by_state, error='attempt limit reached or exam deleted')
+    return len(rows)
+
+
+def purge():
+    """Drop flushed/rejected rows older than RETENTION."""
+    _sqlite().execute('''
+        DELETE FROM queued_submissions WHERE state <> 'pending' AND done_at < ?
+    ''', (time.time() - RETENTION,))
+
+
+def _run_flusher():
+    global _last_error
+    last_purge = 0
+    while True:
+        _wake.wait(INTERVAL)
+        _wake.clear()
+        try:
+            # keep going while batches come back full
+            while flush() >= BATCH_SIZE:
+                pass
+            if time.time() - last_purge > 600:
+                purge()
+                last_purge = time.time()
+        except Exception as e:  # keep the thread alive; rows stay queued
+            _last_error = f'{datetime.now():%Y-%m-%d %H:%M:%S} {e}'
+            time.sleep(1)
+
+
+def ensure_flusher():
+    """Start this process's flusher thread if it isn't running (e.g. after fork)."""
+    global _flusher, _flusher_pid
+    if _flusher is not None and _flusher_pid == os.getpid() and _flusher.is_alive():
+        return
+    with _lock:
+        if _flusher is None or _flusher_pid != os.getpid() or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_run_flusher, name='submission-flusher', daemon=True)
+            _flusher.start()
+            _flusher_pid = os.getpid()
+
+
+def stats():
+    rows = _sqlite().execute('''
+        SELECT state, COUNT(*), MIN(enqueued_at) FROM queued_submissions GROUP BY state
+    ''').fetchall()
+    counts = {state: n for state, n, _ in rows}
+    oldest = next((t for state, _, t in rows if state == 'pending'), None)
+    return {
+        'mode': MODE,
+        'path': PATH,
+        'pending': counts.get('pending', 0),
+        'flushed': counts.get('flushed', 0),
+        'rejected': counts.get('rejected', 0),
+        'oldest_pending_seconds': round(time.time() - oldest, 3) if oldest else None,
+        'flusher_alive': bool(_flusher and _flusher_pid == os.getpid() and _flusher.is_alive()),
+        'last_error': _last_error,
+    }
+
+
+def init_app(app):
+    """Start the flusher with the first request so leftovers from a crash are replayed."""
+    if MODE != 'sync':
+        app.before_request(ensure_flusher)